@@ -0,0 +1,2 @@
+"""Benchmarks for promptai. Run each module from the repository root, e.g.
+``python -m benchmarks.templates``."""
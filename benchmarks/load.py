@@ -0,0 +1,373 @@
+"""Load test of the promptai app against the local mock upstream.
+
+    python -m benchmarks.load [--workers 1,2] [--concurrency 1,8,32,128] [--duration 10]
+                              [--stream-ratio 0.0] [--output load.json]
+    python -m benchmarks.load --compare before.json after.json
+
+Starts ``benchmarks.mock_upstream`` and, for each worker count, promptai
+under ``uvicorn --workers N``, both as subprocesses on localhost. Each
+concurrency level runs a closed loop: that many clients each send a request,
+wait for the whole response and send the next, for ``--duration`` seconds
+after a warm-up. Reported per level:
+- throughput (completed requests/s);
+- latency and TTFB (first body byte) p50/p95/p99;
+- errors by status;
+- RSS of the server process tree (peak and at the end);
+- the load generator's own CPU use.
+A client CPU near 100% means the generator, not the server, is the limit.
+
+Results go to a JSON file. ``--compare`` prints the throughput and p99
+changes between two such files.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import httpx
+
+from benchmarks import mock_upstream
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+@dataclass
+class LevelResult:
+    """Raw observations for one concurrency level."""
+
+    latencies: list[float] = field(default_factory=list)
+    ttfbs: list[float] = field(default_factory=list)
+    statuses: dict[str, int] = field(default_factory=dict)
+    rss_samples: list[int] = field(default_factory=list)
+
+    def record(self, status: str, latency: float, ttfb: Optional[float]) -> None:
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == "200":
+            self.latencies.append(latency)
+            if ttfb is not None:
+                self.ttfbs.append(ttfb)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Linear-interpolated percentile ``q`` (0-100) of already sorted values."""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (
+        position - lower
+    )
+
+
+def summarize_ms(values: list[float]) -> dict[str, float]:
+    ordered = sorted(values)
+    return {
+        "p50": percentile(ordered, 50) * 1000.0,
+        "p95": percentile(ordered, 95) * 1000.0,
+        "p99": percentile(ordered, 99) * 1000.0,
+        "mean": sum(ordered) / len(ordered) * 1000.0 if ordered else 0.0,
+        "max": ordered[-1] * 1000.0 if ordered else 0.0,
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident bytes of ``pid`` and its descendants, from /proc; None where unavailable."""
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return None
+    children: dict[int, list[int]] = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # The command name may contain spaces; fields resume after its closing paren.
+        ppid = int(stat[stat.rindex(")") + 2 :].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    total = 0
+    pending = [pid]
+    page = os.sysconf("SC_PAGE_SIZE")
+    while pending:
+        current = pending.pop()
+        try:
+            total += int((proc / str(current) / "statm").read_text().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(children.get(current, ()))
+    return total
+
+
+@contextmanager
+def serve(args: list[str], env: dict[str, str], url: str, timeout: float = 30.0) -> Iterator[int]:
+    """Run a server subprocess until the block exits; yields its pid once it is healthy."""
+    process = subprocess.Popen(
+        [sys.executable, *args],
+        cwd=ROOT,
+        env={**os.environ, "PYTHONPATH": str(ROOT), **env},
+    )
+    try:
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with {process.returncode}: {args}")
+            try:
+                if httpx.get(url, timeout=1.0).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"server did not become healthy: {args}")
+            time.sleep(0.1)
+        yield process.pid
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def promptai_env(upstream_url: str, args: argparse.Namespace) -> dict[str, str]:
+    return {
+        "PROMPTAI_UPSTREAM_URL": upstream_url,
+        "PROMPTAI_MAX_CONNECTIONS": str(args.upstream_connections),
+        "PROMPTAI_MAX_KEEPALIVE": str(args.upstream_connections),
+        "PROMPTAI_CACHE_ENABLED": "true" if args.cache else "false",
+        "PROMPTAI_BATCHING": "true" if args.batching else "false",
+        "PROMPTAI_JOBS_ENABLED": "false",
+        "PROMPTAI_ADMISSION": "false",
+    }
+
+
+async def run_level(
+    base_url: str, server_pid: int, concurrency: int, args: argparse.Namespace
+) -> dict[str, Any]:
+    result = LevelResult()
+    sequence = 0
+    measuring = False
+    stop = False
+
+    def next_body() -> dict[str, Any]:
+        nonlocal sequence
+        sequence += 1
+        n = sequence % args.distinct_prompts if args.distinct_prompts else sequence
+        prompt = f"request {n}: " + "lorem ipsum " * (args.prompt_chars // 12)
+        stream = args.stream_ratio > 0 and (sequence % 1000) < args.stream_ratio * 1000
+        return {"model": "mock", "prompt": prompt, "max_tokens": args.max_tokens, "stream": stream}
+
+    async def client_loop(client: httpx.AsyncClient) -> None:
+        while not stop:
+            body = next_body()
+            started = time.perf_counter()
+            ttfb = None
+            try:
+                async with client.stream("POST", "/v1/completions", json=body) as response:
+                    async for _ in response.aiter_raw():
+                        if ttfb is None:
+                            ttfb = time.perf_counter() - started
+                    status = str(response.status_code)
+            except httpx.HTTPError as exc:
+                status = type(exc).__name__
+            if measuring:
+                result.record(status, time.perf_counter() - started, ttfb)
+
+    async def sample_memory() -> None:
+        while True:
+            rss = process_tree_rss(server_pid)
+            if rss is not None:
+                result.rss_samples.append(rss)
+            await asyncio.sleep(0.25)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        loops = [asyncio.ensure_future(client_loop(client)) for _ in range(concurrency)]
+        await asyncio.sleep(args.warmup)
+        measuring = True
+        sampler = asyncio.ensure_future(sample_memory())
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        measuring = False
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        stop = True
+        sampler.cancel()
+        await asyncio.gather(*loops, sampler, return_exceptions=True)
+
+    completed = len(result.latencies)
+    rss = result.rss_samples
+    return {
+        "concurrency": concurrency,
+        "duration_s": elapsed,
+        "requests": sum(result.statuses.values()),
+        "completed": completed,
+        "errors": sum(n for status, n in result.statuses.items() if status != "200"),
+        "statuses": result.statuses,
+        "throughput_rps": completed / elapsed,
+        "latency_ms": summarize_ms(result.latencies),
+        "ttfb_ms": summarize_ms(result.ttfbs),
+        "server_rss_mb": {
+            "peak": max(rss) / 2**20 if rss else None,
+            "end": rss[-1] / 2**20 if rss else None,
+        },
+        "client_cpu_percent": 100.0 * cpu / elapsed,
+    }
+
+
+def print_level(workers: int, level: dict[str, Any]) -> None:
+    latency, ttfb = level["latency_ms"], level["ttfb_ms"]
+    rss = level["server_rss_mb"]["peak"]
+    rss_text = "n/a" if rss is None else f"{rss:.0f} MB"
+    print(
+        f"workers={workers:<2} c={level['concurrency']:<4} "
+        f"{level['throughput_rps']:>9.1f} req/s  "
+        f"p50={latency['p50']:>7.1f} p95={latency['p95']:>7.1f} p99={latency['p99']:>7.1f} ms  "
+        f"ttfb p50={ttfb['p50']:>7.1f} ms  errors={level['errors']:<5} "
+        f"rss={rss_text}  client cpu={level['client_cpu_percent']:.0f}%"
+    )
+
+
+def git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(args: argparse.Namespace) -> dict[str, Any]:
+    upstream_port = free_port()
+    upstream_url = f"http://127.0.0.1:{upstream_port}"
+    mock_args = ["-m", "benchmarks.mock_upstream", "--port", str(upstream_port)]
+    for name in ("latency_ms", "jitter_ms", "token_rate", "error_rate", "error_status", "seed"):
+        value = getattr(args, name)
+        if value is not None:
+            mock_args += ["--" + name.replace("_", "-"), str(value)]
+
+    runs = []
+    with serve(mock_args, {}, upstream_url + "/healthz"):
+        for workers in args.workers:
+            port = free_port()
+            app_args = [
+                "-m",
+                "uvicorn",
+                "promptai.app:create_app",
+                "--factory",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+                "--no-access-log",
+            ]
+            base_url = f"http://127.0.0.1:{port}"
+            env = promptai_env(upstream_url, args)
+            with serve(app_args, env, base_url + "/healthz") as pid:
+                for concurrency in args.concurrency:
+                    level = asyncio.run(run_level(base_url, pid, concurrency, args))
+                    level["workers"] = workers
+                    print_level(workers, level)
+                    runs.append(level)
+
+    settings = {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "settings": settings,
+        },
+        "runs": runs,
+    }
+
+
+def compare(before_path: str, after_path: str) -> None:
+    before = json.loads(Path(before_path).read_text("utf-8"))
+    after = json.loads(Path(after_path).read_text("utf-8"))
+    baseline = {(r["workers"], r["concurrency"]): r for r in before["runs"]}
+    before_name = before["meta"].get("commit") or before_path
+    print(f"{before_name} -> {after['meta'].get('commit') or after_path}")
+    for run_ in after["runs"]:
+        key = (run_["workers"], run_["concurrency"])
+        old = baseline.get(key)
+        if old is None:
+            continue
+        rps = _change(old["throughput_rps"], run_["throughput_rps"])
+        p99 = _change(old["latency_ms"]["p99"], run_["latency_ms"]["p99"])
+        print(
+            f"workers={key[0]:<2} c={key[1]:<4} "
+            f"throughput {old['throughput_rps']:>9.1f} -> {run_['throughput_rps']:>9.1f} ({rps})  "
+            f"p99 {old['latency_ms']['p99']:>7.1f} -> {run_['latency_ms']['p99']:>7.1f} ms ({p99})"
+        )
+
+
+def _change(old: float, new: float) -> str:
+    return f"{(new - old) / old * 100.0:+.1f}%" if old else "n/a"
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--workers", type=_int_list, default=[1], help="e.g. 1,2,4")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8, 32, 128])
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per level")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds per level")
+    parser.add_argument("--max-tokens", type=int, default=16)
+    parser.add_argument("--prompt-chars", type=int, default=200)
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="fraction streamed")
+    parser.add_argument(
+        "--distinct-prompts", type=int, default=0, help="cycle through N prompts (0: all unique)"
+    )
+    parser.add_argument("--cache", action="store_true", help="enable the response cache")
+    parser.add_argument("--batching", action="store_true", help="enable micro-batching")
+    parser.add_argument("--upstream-connections", type=int, default=100)
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="load.json", help="JSON results file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    mock_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = run(args)
+    Path(args.output).write_text(json.dumps(results, indent=2), "utf-8")
+    print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Cost of the instrumentation on the request path.
+
+    python -m benchmarks.metrics [--seconds 1.0] [--requests 5000]
+
+Micro-benchmarks time each recording primitive; the ASGI cases send requests
+straight into a minimal app (no sockets) with and without ``MetricsMiddleware``
+so the per-request difference is the whole overhead. The cases are run in
+interleaved rounds and the best round of each is reported, which keeps
+machine noise from swamping differences of a few microseconds.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Optional
+
+from fastapi import FastAPI
+from starlette.responses import Response
+
+from promptai.metrics import (
+    REGISTRY,
+    MetricsMiddleware,
+    MetricsRegistry,
+    SlowTraceSampler,
+    Stage,
+    UpstreamStages,
+)
+from promptai.metrics.tracing import Trace, attach_trace, reset_trace
+
+# The events httpcore reports for one HTTP/1.1 request on a fresh connection.
+UPSTREAM_EVENTS = [
+    "connection.connect_tcp.started",
+    "connection.connect_tcp.complete",
+    "http11.send_request_headers.started",
+    "http11.send_request_headers.complete",
+    "http11.send_request_body.started",
+    "http11.send_request_body.complete",
+    "http11.receive_response_headers.started",
+    "http11.receive_response_headers.complete",
+    "http11.receive_response_body.started",
+    "http11.receive_response_body.complete",
+    "http11.response_closed.started",
+    "http11.response_closed.complete",
+]
+
+
+def bench(label: str, fn: Callable[[], Any], seconds: float) -> float:
+    fn()
+    n, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(100):
+            fn()
+        n += 100
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    per_call = (now - start) / n
+    print(f"{label:<48} {per_call * 1e9:>9.0f} ns/op")
+    return per_call
+
+
+def make_app(middleware: bool, sampler: Optional[SlowTraceSampler] = None) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/completions")
+    async def complete() -> Response:
+        return Response(b'{"choices":[]}', media_type="application/json")
+
+    if middleware:
+        app.add_middleware(MetricsMiddleware, sampler=sampler)
+    return app
+
+
+async def drive(app: Any, requests: int) -> float:
+    """Seconds per request for ``requests`` sequential ASGI calls."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v1/completions",
+        "raw_path": b"/v1/completions",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "server": ("test", 80),
+        "client": ("test", 1234),
+    }
+    request_message = {"type": "http.request", "body": b"{}", "more_body": False}
+
+    async def receive() -> dict[str, Any]:
+        return request_message
+
+    async def send(message: dict[str, Any]) -> None:
+        pass
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+async def upstream_events(stages: UpstreamStages, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        timer = stages.timer()
+        for event in UPSTREAM_EVENTS:
+            await timer(event, {})
+    return (time.perf_counter() - start) / rounds
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per micro case")
+    parser.add_argument("--requests", type=int, default=5_000, help="requests per ASGI round")
+    parser.add_argument("--rounds", type=int, default=7, help="interleaved ASGI rounds")
+    args = parser.parse_args()
+
+    series = MetricsRegistry().histogram("bench_seconds", "Benchmark.", ("stage",)).labels("x")
+    bench("histogram observe", lambda: series.observe(0.0123), args.seconds)
+    stage = Stage("bench", series)
+    bench("stage.since (not traced)", lambda: stage.since(time.perf_counter()), args.seconds)
+    token = attach_trace(Trace("POST", "/bench"))
+    bench("stage.since (traced)", lambda: stage.since(time.perf_counter()), args.seconds)
+    reset_trace(token)
+    bench("render /metrics exposition", REGISTRY.render, args.seconds)
+
+    stages = UpstreamStages("bench")
+    per_request = asyncio.run(upstream_events(stages, 20_000))
+    print(f"{'upstream trace callbacks (12 events)':<48} {per_request * 1e9:>9.0f} ns/request")
+
+    print()
+    cases = [
+        ("ASGI request, no middleware", make_app(False)),
+        ("ASGI request, MetricsMiddleware", make_app(True)),
+        ("ASGI request, MetricsMiddleware + 1% sampling", make_app(True, SlowTraceSampler(0.01))),
+        ("ASGI request, MetricsMiddleware + 100% sampling", make_app(True, SlowTraceSampler(1.0))),
+    ]
+    best = [float("inf")] * len(cases)
+
+    async def run_rounds() -> None:
+        for _, app in cases:
+            await drive(app, 200)  # warm up routing and pydantic caches
+        for _ in range(args.rounds):
+            for i, (_, app) in enumerate(cases):
+                best[i] = min(best[i], await drive(app, args.requests))
+
+    asyncio.run(run_rounds())
+    for i, ((label, _), per_request) in enumerate(zip(cases, best)):
+        extra = f"  (+{(per_request - best[0]) * 1e6:.2f} us)" if i != 0 else ""
+        print(f"{label:<48} {per_request * 1e6:>9.2f} us/request{extra}")
+
+
+if __name__ == "__main__":
+    main()
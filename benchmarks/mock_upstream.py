@@ -0,0 +1,212 @@
+"""A local stand-in for an LLM provider, for load tests and CI.
+
+    python -m benchmarks.mock_upstream [--port 9100] [--latency-ms 50] [--token-rate 100]
+                                       [--error-rate 0.0] [--error-status 503]
+
+Serves ``POST /v1/completions`` (plain and ``"stream": true`` server-sent
+events, single prompts and batched prompt lists) and ``POST /v1/embeddings``
+in the shape promptai expects. Every response waits ``latency_ms`` (plus up
+to ``jitter_ms``) before the first byte, then generates ``max_tokens`` tokens
+per prompt at ``token_rate`` tokens/s; streamed tokens are sent as they are
+generated. A fraction ``error_rate`` of requests fail with ``error_status``
+after the latency, to exercise retries.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+TOKEN = " tok"
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 0.0
+    token_rate: float = 100.0  # tokens/s per prompt; 0 generates instantly
+    error_rate: float = 0.0
+    error_status: int = 503
+    default_max_tokens: int = 16
+    embedding_dimensions: int = 8
+    seed: Optional[int] = None
+
+
+class MockUpstream:
+    def __init__(self, config: MockConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.requests = 0
+        self.errors = 0
+
+    async def _wait_first_byte(self) -> None:
+        c = self.config
+        delay = c.latency_ms + (self.rng.uniform(0, c.jitter_ms) if c.jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+
+    def _fail(self) -> Optional[Response]:
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            self.errors += 1
+            return JSONResponse(
+                {"error": {"message": "mock upstream error", "type": "server_error"}},
+                status_code=self.config.error_status,
+                headers={"Retry-After": "0"},
+            )
+        return None
+
+    def _generation_time(self, tokens: int) -> float:
+        rate = self.config.token_rate
+        return tokens / rate if rate > 0 else 0.0
+
+    async def completions(self, request: Request) -> Response:
+        self.requests += 1
+        body = await request.json()
+        prompts = body.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        max_tokens = int(body.get("max_tokens") or self.config.default_max_tokens)
+        await self._wait_first_byte()
+        failure = self._fail()
+        if failure is not None:
+            return failure
+        model = body.get("model", "mock")
+        if body.get("stream"):
+            return StreamingResponse(
+                self._stream(model, len(prompts), max_tokens),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache"},
+            )
+        # Prompts in a batch are generated in parallel, as a provider would.
+        await asyncio.sleep(self._generation_time(max_tokens))
+        prompt_tokens = sum(len(str(p).split()) for p in prompts)
+        return JSONResponse(
+            {
+                "id": f"cmpl-mock-{self.requests}",
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {"index": i, "text": TOKEN * max_tokens, "finish_reason": "length"}
+                    for i in range(len(prompts))
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": max_tokens * len(prompts),
+                    "total_tokens": prompt_tokens + max_tokens * len(prompts),
+                },
+            }
+        )
+
+    async def _stream(self, model: str, prompts: int, tokens: int) -> AsyncIterator[bytes]:
+        delay = self._generation_time(1)
+        request_id = f"cmpl-mock-{self.requests}"
+        for n in range(tokens):
+            if delay and n:
+                await asyncio.sleep(delay)
+            for index in range(prompts):
+                event = {
+                    "id": request_id,
+                    "object": "text_completion",
+                    "model": model,
+                    "choices": [{"index": index, "text": TOKEN, "finish_reason": None}],
+                }
+                yield b"data: " + json.dumps(event, separators=(",", ":")).encode() + b"\n\n"
+        yield b"data: [DONE]\n\n"
+
+    async def embeddings(self, request: Request) -> Response:
+        self.requests += 1
+        body = await request.json()
+        inputs = body.get("input", "")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        dimensions = int(body.get("dimensions") or self.config.embedding_dimensions)
+        await self._wait_first_byte()
+        failure = self._fail()
+        if failure is not None:
+            return failure
+        return JSONResponse(
+            {
+                "object": "list",
+                "model": body.get("model", "mock"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": _vector(str(text), dimensions)}
+                    for i, text in enumerate(inputs)
+                ],
+            }
+        )
+
+    async def stats(self, request: Request) -> Response:
+        return JSONResponse({"requests": self.requests, "errors": self.errors})
+
+
+def _vector(text: str, dimensions: int) -> list[float]:
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=64).digest()
+    return [digest[i % len(digest)] / 255.0 for i in range(dimensions)]
+
+
+def create_app(config: Optional[MockConfig] = None) -> Starlette:
+    upstream = MockUpstream(config or MockConfig())
+
+    async def healthz(request: Request) -> Response:
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(
+        routes=[
+            Route("/v1/completions", upstream.completions, methods=["POST"]),
+            Route("/v1/embeddings", upstream.embeddings, methods=["POST"]),
+            Route("/stats", upstream.stats),
+            Route("/healthz", healthz),
+        ]
+    )
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """The mock's knobs; shared with ``benchmarks.load``, which forwards them."""
+    defaults = MockConfig()
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument("--jitter-ms", type=float, default=defaults.jitter_ms)
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--error-status", type=int, default=defaults.error_status)
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(config_from_args(args)),
+        host=args.host,
+        port=args.port,
+        log_level="warning",
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
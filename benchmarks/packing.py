@@ -0,0 +1,126 @@
+"""Token estimation and context packing on a 10k-message history.
+
+    python -m benchmarks.packing [--messages 10000] [--budget 8000]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable
+
+from promptai.packing import (
+    ApproximateTokenCounter,
+    ContextPacker,
+    MemoizedTokenCounter,
+    Segment,
+    SegmentKind,
+)
+
+_WORDS = (
+    "the model returns a response token stream with latency budget prompt context "
+    "user assistant retrieval document chunk score 2024 config, value; résumé naïve "
+    "http://example.com/path?q=1 function(x) { return x + 1; } 数据 处理"
+).split()
+
+
+def make_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words))
+
+
+def make_segments(rng: random.Random, messages: int, chunks: int) -> list[Segment]:
+    segments = [Segment(make_text(rng, 120), SegmentKind.SYSTEM)]
+    segments += [Segment(make_text(rng, rng.randint(5, 200))) for _ in range(messages)]
+    segments += [
+        Segment(make_text(rng, rng.randint(80, 300)), SegmentKind.RETRIEVED, score=rng.random())
+        for _ in range(chunks)
+    ]
+    return segments
+
+
+def fresh(segments: list[Segment]) -> list[Segment]:
+    return [Segment(s.text, s.kind, s.score) for s in segments]
+
+
+def timed(label: str, fn: Callable[[], object], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<52} {best * 1e3:>10.2f} ms")
+    return best
+
+
+def naive_pack(counter: ApproximateTokenCounter, segments: list[Segment], budget: int) -> int:
+    """Drop the oldest turn and re-render/re-count the whole prompt until it fits."""
+    system = [s.text for s in segments if s.kind is SegmentKind.SYSTEM]
+    turns = [s.text for s in segments if s.kind is SegmentKind.TURN]
+    while turns and counter.count("\n".join(system + turns)) > budget:
+        turns.pop(0)
+    return len(turns)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--chunks", type=int, default=500)
+    parser.add_argument("--budget", type=int, default=8_000)
+    parser.add_argument("--naive-messages", type=int, default=300)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    segments = make_segments(rng, args.messages, args.chunks)
+    texts = [s.text for s in segments]
+    total_chars = sum(map(len, texts))
+    print(
+        f"{len(segments):,} segments ({args.messages:,} turns, {args.chunks} chunks), "
+        f"{total_chars / 1e6:.1f}M chars, budget {args.budget:,} tokens\n"
+    )
+
+    approx = ApproximateTokenCounter()
+    t = timed("estimate every segment (ApproximateTokenCounter)", lambda: approx.count_many(texts))
+    print(f"{'':<52} {total_chars / t / 1e6:>10.1f} M chars/s")
+
+    packer = ContextPacker(approx, per_segment_overhead=4)
+    result = packer.pack(fresh(segments), args.budget)
+    print(
+        f"packed {len(result.segments)} segments, {result.tokens} tokens, "
+        f"counted {result.counted} of {len(segments)}\n"
+    )
+    timed("pack, cold (no counts known)", lambda: packer.pack(fresh(segments), args.budget))
+
+    memo = MemoizedTokenCounter(approx)
+    memo_packer = ContextPacker(memo, per_segment_overhead=4)
+    memo_packer.pack(fresh(segments), args.budget)
+    timed(
+        "pack, memoized counter (next turn, same history)",
+        lambda: memo_packer.pack(fresh(segments), args.budget),
+    )
+
+    warm = fresh(segments)
+    packer.pack(warm, args.budget)
+    timed("pack, counts already on segments", lambda: packer.pack(warm, args.budget))
+
+    big_budget = args.budget * 50
+    timed(
+        f"pack, budget {big_budget:,} (most history fits)",
+        lambda: packer.pack(fresh(segments), big_budget),
+    )
+
+    sub = segments[: args.naive_messages + 1]
+    print()
+    timed(
+        f"pack {args.naive_messages:,} turns",
+        lambda: packer.pack(fresh(sub), args.budget),
+    )
+    timed(
+        f"naive re-render-and-measure, {args.naive_messages:,} turns",
+        lambda: naive_pack(approx, sub, args.budget),
+        repeat=1,
+    )
+
+
+if __name__ == "__main__":
+    main()
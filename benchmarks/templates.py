@@ -0,0 +1,114 @@
+"""Renders per second for compiled templates versus a regex-substitution baseline.
+
+    python -m benchmarks.templates [--seconds 1.0]
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import time
+from typing import Any, Callable
+
+from promptai.templates import get_template
+
+SMALL = (
+    "You are {{ assistant }}, a helpful assistant for {{ company }}.\n"
+    "Answer in {{ language }}. Keep it under {{ limit }} words.\n"
+    "Question: {{ question | truncate:500 }}\n"
+)
+
+SMALL_VARS = {
+    "assistant": "Ada",
+    "company": "Example Corp",
+    "language": "English",
+    "limit": 120,
+    "question": "How do I rotate my API key without downtime?",
+}
+
+
+def large_template(target_chars: int = 32_000) -> tuple[str, dict[str, Any]]:
+    """A ~32k-character template: long literal runs, many slots, a few-shot section."""
+    paragraph = (
+        "The following policy text describes how requests are handled. It is long, "
+        "mostly static, and interleaved with a handful of variables such as "
+        "{{ product }} and {{ region }} that change per request. "
+    )
+    pieces = ["System: {{ system }}\n\n"]
+    i = 0
+    while sum(map(len, pieces)) < target_chars - 600:
+        pieces.append(paragraph)
+        pieces.append(f"[section {i}: {{{{ field_{i % 20} }}}}]\n")
+        i += 1
+    pieces.append(
+        "{{# examples | last:8 }}\nQ: {{ q }}\nA: {{ a | truncate:400 }}\n{{/ examples }}\n"
+        "Question: {{ question }}\n"
+    )
+    variables: dict[str, Any] = {
+        "system": "Be precise.",
+        "product": "promptai",
+        "region": "eu-west",
+        "question": "Summarise the policy.",
+        "examples": [{"q": f"question {n}", "a": "answer " * 20} for n in range(12)],
+    }
+    variables.update({f"field_{n}": f"value {n}" for n in range(20)})
+    return "".join(pieces), variables
+
+
+def regex_baseline(source: str) -> Callable[[dict[str, Any]], str]:
+    """Naive per-call ``re.sub`` render for flat ``{{ name }}`` slots (no filters)."""
+    pattern = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)[^}]*\}\}")
+    return lambda variables: pattern.sub(lambda m: str(variables.get(m.group(1), "")), source)
+
+
+def bench(label: str, fn: Callable[[], Any], seconds: float) -> float:
+    fn()
+    n, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(50):
+            fn()
+        n += 50
+        now = time.perf_counter()
+        if now >= deadline:
+            break
+    rate = n / (now - start)
+    print(f"{label:<42} {rate:>12,.0f} renders/s  {1e6 / rate:>9.2f} us/render")
+    return rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=1.0, help="time per case")
+    args = parser.parse_args()
+
+    small = get_template(SMALL)
+    large_source, large_vars = large_template()
+    large = get_template(large_source)
+    print(f"small template: {len(SMALL):,} chars; large template: {len(large_source):,} chars\n")
+
+    bench("small: compiled render (validated)", lambda: small.render(SMALL_VARS), args.seconds)
+    bench(
+        "small: compiled render (no validation)",
+        lambda: small.render(SMALL_VARS, validate=False),
+        args.seconds,
+    )
+    bench("small: regex baseline", lambda: regex_baseline(SMALL)(SMALL_VARS), args.seconds)
+    bench("small: cache lookup + render", lambda: get_template(SMALL).render(SMALL_VARS), args.seconds)
+    print()
+    bench("32k: compiled render (validated)", lambda: large.render(large_vars), args.seconds)
+    bench(
+        "32k: compiled render (no validation)",
+        lambda: large.render(large_vars, validate=False),
+        args.seconds,
+    )
+    bench("32k: regex baseline (flat slots only)", lambda: regex_baseline(large_source)(large_vars), args.seconds)
+    bench(
+        "32k: cache lookup + render",
+        lambda: get_template(large_source).render(large_vars),
+        args.seconds,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""promptai: a FastAPI front end for upstream LLM providers."""
+
+from promptai.config import (
+    AdmissionConfig,
+    BatchingConfig,
+    CacheConfig,
+    JobsConfig,
+    MetricsConfig,
+    PoolConfig,
+    ProviderConfig,
+    RetryConfig,
+    Settings,
+    TimeoutConfig,
+)
+from promptai.upstream import PoolStats, UpstreamClient, UpstreamError, UpstreamRegistry
+
+__version__ = "0.1.0"
+
+__all__ = [
+    "AdmissionConfig",
+    "BatchingConfig",
+    "CacheConfig",
+    "JobsConfig",
+    "MetricsConfig",
+    "PoolConfig",
+    "PoolStats",
+    "ProviderConfig",
+    "RetryConfig",
+    "Settings",
+    "TimeoutConfig",
+    "UpstreamClient",
+    "UpstreamError",
+    "UpstreamRegistry",
+    "create_app",
+]
+
+
+def __getattr__(name: str):
+    # The app factory pulls in FastAPI; import it lazily so the library parts
+    # stay usable without the web stack.
+    if name == "create_app":
+        from promptai.app import create_app
+
+        return create_app
+    raise AttributeError(f"module 'promptai' has no attribute {name!r}")
@@ -0,0 +1,35 @@
+"""Admission control: per-key rate limits and in-flight concurrency caps."""
+
+from promptai.admission.buckets import (
+    BucketCheck,
+    LimiterBackend,
+    MemoryLimiterBackend,
+    SqliteLimiterBackend,
+)
+from promptai.admission.concurrency import (
+    AdmissionRejected,
+    ConcurrencyLimiter,
+    QueueFull,
+    QueueTimeout,
+    SharedSlots,
+)
+from promptai.admission.middleware import (
+    AdmissionController,
+    AdmissionMiddleware,
+    build_admission,
+)
+
+__all__ = [
+    "AdmissionController",
+    "AdmissionMiddleware",
+    "AdmissionRejected",
+    "BucketCheck",
+    "ConcurrencyLimiter",
+    "LimiterBackend",
+    "MemoryLimiterBackend",
+    "QueueFull",
+    "QueueTimeout",
+    "SharedSlots",
+    "SqliteLimiterBackend",
+    "build_admission",
+]
@@ -0,0 +1,326 @@
+"""Token-bucket rate limiting with pluggable bucket storage.
+
+Buckets are refilled lazily: each stores only ``(tokens, updated_at)`` and the
+refill since the last check is computed on access, so a check is O(1) and
+idle buckets cost nothing until they are touched again.
+
+A check may span several buckets (per-key and global, requests and tokens);
+it is admitted only if every bucket has room, and then all are debited
+together.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Optional, Sequence, Union
+
+import anyio.to_thread
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BucketCheck:
+    """Debit ``cost`` from bucket ``key`` refilling at ``rate``/s up to ``capacity``."""
+
+    key: str
+    rate: float
+    capacity: float
+    cost: float
+
+
+def refill(tokens: float, updated_at: float, now: float, check: BucketCheck) -> float:
+    return min(check.capacity, tokens + max(0.0, now - updated_at) * check.rate)
+
+
+def shortfall(tokens: float, check: BucketCheck) -> float:
+    """Seconds until ``check`` could pass; 0 if it passes now.
+
+    A cost larger than the whole bucket is admitted once the bucket is full
+    and drives it into debt, so oversized requests are slowed, not refused.
+    """
+    need = min(check.cost, check.capacity)
+    if tokens >= need:
+        return 0.0
+    return (need - tokens) / check.rate if check.rate > 0 else float("inf")
+
+
+class LimiterBackend(ABC):
+    """Storage for bucket state, local to a process or shared between workers.
+
+    A backend that ``shares_slots`` also counts in-flight requests across
+    processes, so one ``max_in_flight`` cap covers every worker.
+    """
+
+    shares_slots = False
+
+    @abstractmethod
+    async def take(self, checks: Sequence[BucketCheck]) -> float:
+        """Atomically debit every bucket, or none.
+
+        Returns 0.0 when admitted, otherwise the seconds to wait before the
+        tightest bucket would have room.
+        """
+
+    @property
+    @abstractmethod
+    def size(self) -> int:
+        """Number of buckets currently stored."""
+
+    async def acquire_slot(self, limit: int) -> bool:
+        """Take one of ``limit`` shared in-flight slots; False if all are in use."""
+        return True
+
+    async def release_slot(self) -> None:
+        pass
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MemoryLimiterBackend(LimiterBackend):
+    """Buckets in an LRU dict; keys idle for ``idle_ttl`` seconds are evicted.
+
+    Eviction is lossless as long as ``idle_ttl`` is at least the time a
+    bucket takes to refill completely, because a re-created bucket starts
+    full. Each check evicts at most a few stale keys from the LRU end, so the
+    cost stays O(1) amortised at any number of keys.
+    """
+
+    def __init__(
+        self,
+        *,
+        idle_ttl: float = 600.0,
+        max_keys: int = 100_000,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.idle_ttl = idle_ttl
+        self.max_keys = max_keys
+        self._clock = clock
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+
+    @property
+    def size(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, checks: Sequence[BucketCheck]) -> float:
+        return self.take_now(checks)
+
+    def take_now(self, checks: Sequence[BucketCheck]) -> float:
+        now = self._clock()
+        buckets = self._buckets
+        states = []
+        wait = 0.0
+        for check in checks:
+            state = buckets.get(check.key)
+            if state is None:
+                tokens = check.capacity
+            else:
+                tokens = refill(state[0], state[1], now, check)
+                buckets.move_to_end(check.key)
+            states.append(tokens)
+            wait = max(wait, shortfall(tokens, check))
+        if wait == 0.0:
+            for check, tokens in zip(checks, states):
+                buckets[check.key] = [tokens - check.cost, now]
+        self._evict(now)
+        return wait
+
+    def _evict(self, now: float) -> None:
+        buckets = self._buckets
+        for _ in range(4):
+            if not buckets:
+                return
+            key, state = next(iter(buckets.items()))
+            if len(buckets) > self.max_keys or now - state[1] > self.idle_ttl:
+                del buckets[key]
+            else:
+                return
+
+
+class SqliteLimiterBackend(LimiterBackend):
+    """Buckets in a SQLite file shared by every worker process on the host.
+
+    Each check runs in one ``BEGIN IMMEDIATE`` transaction, which serialises
+    writers across processes, so N uvicorn workers enforce a single limit.
+    Timestamps are wall-clock so they agree between processes.
+
+    In-flight slots are counted per process in the ``slots`` table. A
+    background thread refreshes this process's row every ``slot_lease / 3``
+    seconds, and rows older than ``slot_lease`` are ignored. The slots of a
+    worker that dies without cleaning up are freed after at most that long.
+
+    ``size`` is counted when the file is opened and at each sweep, and is
+    kept up to date in between for keys this process creates.
+    """
+
+    shares_slots = True
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS buckets_updated_at ON buckets (updated_at);
+        CREATE TABLE IF NOT EXISTS slots (
+            worker TEXT PRIMARY KEY,
+            in_use INTEGER NOT NULL,
+            heartbeat REAL NOT NULL
+        );
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        *,
+        idle_ttl: float = 600.0,
+        sweep_every: int = 1000,
+        slot_lease: float = 30.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.path = str(path)
+        self.idle_ttl = idle_ttl
+        self.sweep_every = sweep_every
+        self.slot_lease = slot_lease
+        self.worker = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self._clock = clock
+        self._ops = 0
+        self._slots = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+        self._conn = sqlite3.connect(
+            self.path, timeout=5.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self._SCHEMA)
+        self._size = self._conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def take(self, checks: Sequence[BucketCheck]) -> float:
+        return await anyio.to_thread.run_sync(self._take, checks)
+
+    async def acquire_slot(self, limit: int) -> bool:
+        return await anyio.to_thread.run_sync(self._acquire_slot, limit)
+
+    async def release_slot(self) -> None:
+        await anyio.to_thread.run_sync(self._release_slot)
+
+    async def aclose(self) -> None:
+        self._closed.set()
+        with self._lock:
+            try:
+                self._conn.execute("DELETE FROM slots WHERE worker = ?", (self.worker,))
+            finally:
+                self._conn.close()
+
+    def _acquire_slot(self, limit: int) -> bool:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = self._clock()
+                others = conn.execute(
+                    "SELECT COALESCE(SUM(in_use), 0) FROM slots"
+                    " WHERE worker != ? AND heartbeat >= ?",
+                    (self.worker, now - self.slot_lease),
+                ).fetchone()[0]
+                granted = others + self._slots < limit
+                if granted:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO slots (worker, in_use, heartbeat) VALUES (?, ?, ?)",
+                        (self.worker, self._slots + 1, now),
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if granted:
+                self._slots += 1
+                if self._heartbeat is None:
+                    self._heartbeat = threading.Thread(
+                        target=self._beat, name="promptai-limiter-heartbeat", daemon=True
+                    )
+                    self._heartbeat.start()
+            return granted
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self._slots -= 1
+            self._conn.execute(
+                "UPDATE slots SET in_use = ?, heartbeat = ? WHERE worker = ?",
+                (self._slots, self._clock(), self.worker),
+            )
+
+    def _beat(self) -> None:
+        while not self._closed.wait(self.slot_lease / 3):
+            with self._lock:
+                if self._closed.is_set():
+                    return
+                try:
+                    self._conn.execute(
+                        "UPDATE slots SET heartbeat = ? WHERE worker = ?",
+                        (self._clock(), self.worker),
+                    )
+                except sqlite3.Error as exc:
+                    logger.warning("limiter heartbeat failed: %s", exc)
+
+    def _take(self, checks: Sequence[BucketCheck]) -> float:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = self._clock()
+                states = []
+                wait = 0.0
+                created = 0
+                for check in checks:
+                    row = conn.execute(
+                        "SELECT tokens, updated_at FROM buckets WHERE key = ?", (check.key,)
+                    ).fetchone()
+                    created += row is None
+                    tokens = check.capacity if row is None else refill(row[0], row[1], now, check)
+                    states.append(tokens)
+                    wait = max(wait, shortfall(tokens, check))
+                if wait == 0.0:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                        [(c.key, tokens - c.cost, now) for c, tokens in zip(checks, states)],
+                    )
+                    self._size += created
+                self._ops += 1
+                if self._ops % self.sweep_every == 0:
+                    conn.execute(
+                        "DELETE FROM buckets WHERE updated_at < ?", (now - self.idle_ttl,)
+                    )
+                    conn.execute(
+                        "DELETE FROM slots WHERE heartbeat < ?", (now - self.slot_lease,)
+                    )
+                    self._size = conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return wait
+
+
+def build_limiter_backend(
+    backend: str, *, sqlite_path: Optional[str] = None, idle_ttl: float, max_keys: int
+) -> LimiterBackend:
+    if backend == "sqlite":
+        return SqliteLimiterBackend(sqlite_path or "promptai-limits.sqlite3", idle_ttl=idle_ttl)
+    return MemoryLimiterBackend(idle_ttl=idle_ttl, max_keys=max_keys)
@@ -0,0 +1,243 @@
+"""In-flight concurrency caps with a bounded, tenant-fair wait queue."""
+
+from __future__ import annotations
+
+import asyncio
+from collections import OrderedDict, deque
+from typing import Optional
+
+from promptai.admission.buckets import LimiterBackend
+from promptai.metrics.tracing import detach_trace
+
+
+class AdmissionRejected(Exception):
+    """A request was refused; ``status_code`` and ``retry_after`` shape the response."""
+
+    status_code = 429
+
+    def __init__(self, reason: str, retry_after: Optional[float] = None) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class QueueFull(AdmissionRejected):
+    pass
+
+
+class QueueTimeout(AdmissionRejected):
+    status_code = 503
+
+
+class ConcurrencyLimiter:
+    """Global and per-tenant in-flight caps.
+
+    Requests over a cap wait in a per-tenant FIFO rather than being refused.
+    Freed slots are handed out round-robin across tenants with waiters, so a
+    tenant with a deep backlog cannot starve one with a single request. Both
+    the total queue and each tenant's queue are bounded; beyond that, and
+    after ``queue_timeout`` seconds of waiting, requests are rejected.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_in_flight: int,
+        max_in_flight_per_tenant: int,
+        max_queue: int,
+        max_queue_per_tenant: int,
+        queue_timeout: float,
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_tenant = max_in_flight_per_tenant
+        self.max_queue = max_queue
+        self.max_queue_per_tenant = max_queue_per_tenant
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self._active: dict[str, int] = {}
+        # Tenants with waiters, in round-robin order.
+        self._waiters: OrderedDict[str, deque[asyncio.Future[None]]] = OrderedDict()
+
+    def _has_room(self, tenant: str) -> bool:
+        return (
+            self.in_flight < self.max_in_flight
+            and self._active.get(tenant, 0) < self.max_in_flight_per_tenant
+        )
+
+    def _grant(self, tenant: str) -> None:
+        self.in_flight += 1
+        self._active[tenant] = self._active.get(tenant, 0) + 1
+
+    async def acquire(self, tenant: str) -> float:
+        """Wait for a slot; returns the seconds spent queued."""
+        if tenant not in self._waiters and self._has_room(tenant):
+            self._grant(tenant)
+            return 0.0
+        queue = self._waiters.get(tenant)
+        if self.queued >= self.max_queue or (
+            queue is not None and len(queue) >= self.max_queue_per_tenant
+        ):
+            raise QueueFull("too many queued requests", retry_after=1.0)
+
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[None] = loop.create_future()
+        if queue is None:
+            queue = self._waiters[tenant] = deque()
+        queue.append(future)
+        self.queued += 1
+        started = loop.time()
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as exc:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: hand the slot on.
+                self.release(tenant)
+            else:
+                self._forget(tenant, future)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise QueueTimeout("timed out waiting for capacity", retry_after=1.0) from None
+            raise
+        return loop.time() - started
+
+    def release(self, tenant: str) -> None:
+        self.in_flight -= 1
+        remaining = self._active[tenant] - 1
+        if remaining:
+            self._active[tenant] = remaining
+        else:
+            del self._active[tenant]
+        self._dispatch()
+
+    def _forget(self, tenant: str, future: asyncio.Future[None]) -> None:
+        queue = self._waiters.get(tenant)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+        except ValueError:
+            return
+        self.queued -= 1
+        if not queue:
+            del self._waiters[tenant]
+
+    def _dispatch(self) -> None:
+        # One pass over waiting tenants: each gets at most one slot per pass,
+        # then moves to the back of the rotation.
+        for tenant in list(self._waiters):
+            if self.in_flight >= self.max_in_flight:
+                return
+            if not self._has_room(tenant):
+                continue
+            queue = self._waiters[tenant]
+            future = None
+            while queue:
+                candidate = queue.popleft()
+                self.queued -= 1
+                if not candidate.done():  # skip waiters cancelled but not yet cleaned up
+                    future = candidate
+                    break
+            if queue:
+                self._waiters.move_to_end(tenant)
+            else:
+                del self._waiters[tenant]
+            if future is not None:
+                self._grant(tenant)
+                future.set_result(None)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "tenants_in_flight": len(self._active),
+            "tenants_queued": len(self._waiters),
+        }
+
+
+class SharedSlots:
+    """FIFO wait for the in-flight slots a shared ``LimiterBackend`` counts across workers.
+
+    Slots freed by other processes are not signalled here. While requests
+    wait, one pump task polls the backend with backoff from ``min_delay``
+    up to ``max_delay``, and retries at once when this process frees a
+    slot. Each slot it gets goes to the oldest waiter, so a process polls
+    once at a time however many requests are queued.
+    """
+
+    def __init__(
+        self,
+        backend: LimiterBackend,
+        limit: int,
+        *,
+        min_delay: float = 0.005,
+        max_delay: float = 0.1,
+    ) -> None:
+        self.backend = backend
+        self.limit = limit
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._waiters: deque[asyncio.Future[None]] = deque()
+        self._freed = asyncio.Event()
+        self._pump: Optional[asyncio.Task[None]] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: float) -> None:
+        """Wait up to ``timeout`` seconds for a slot; raises ``QueueTimeout``."""
+        if not self._waiters and await self.backend.acquire_slot(self.limit):
+            return
+        future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.ensure_future(self._run_pump())
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException as exc:
+            if future.done() and not future.cancelled():
+                # Granted just as we gave up: give the slot back.
+                asyncio.ensure_future(self.release())
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(exc, asyncio.TimeoutError):
+                raise QueueTimeout("timed out waiting for capacity", retry_after=1.0) from None
+            raise
+
+    async def release(self) -> None:
+        await self.backend.release_slot()
+        self._freed.set()
+
+    async def _run_pump(self) -> None:
+        # Started by whichever request queued first, but serves them all.
+        detach_trace()
+        waiters = self._waiters
+        delay = self.min_delay
+        while True:
+            while waiters and waiters[0].done():  # timed out or cancelled
+                waiters.popleft()
+            if not waiters:
+                return
+            self._freed.clear()
+            if await self.backend.acquire_slot(self.limit):
+                delay = self.min_delay
+                while waiters and waiters[0].done():
+                    waiters.popleft()
+                if waiters:
+                    waiters.popleft().set_result(None)
+                else:
+                    await self.backend.release_slot()
+                continue
+            try:
+                await asyncio.wait_for(self._freed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.max_delay)
+
+    async def aclose(self) -> None:
+        if self._pump is not None:
+            self._pump.cancel()
+            await asyncio.gather(self._pump, return_exceptions=True)
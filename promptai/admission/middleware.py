@@ -0,0 +1,298 @@
+"""ASGI admission-control middleware.
+
+Every HTTP request is attributed to an API key (the tenant), charged against
+per-key and global token buckets for requests/second and estimated
+tokens/minute, and then admitted through the in-flight concurrency limiter.
+Rejections are answered directly with 429/503 and a ``Retry-After`` header.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+from typing import Any, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from promptai.admission.buckets import BucketCheck, LimiterBackend, build_limiter_backend
+from promptai.admission.concurrency import AdmissionRejected, ConcurrencyLimiter, SharedSlots
+from promptai.config import AdmissionConfig
+from promptai.metrics.stages import ADMISSION_QUEUE, ADMISSION_RATE_LIMIT
+from promptai.metrics.tracing import perf_counter
+from promptai.packing import ApproximateTokenCounter, TokenCounter
+
+ANONYMOUS = "anonymous"
+
+
+class AdmissionController:
+    """Limiter state shared by the middleware and the stats endpoint.
+
+    When the backend shares in-flight slots between workers, a request
+    admitted by this process's fair queue also has to take one of the
+    ``max_in_flight`` slots shared by every worker. It waits for that slot
+    within what is left of ``queue_timeout``.
+    """
+
+    def __init__(
+        self,
+        config: AdmissionConfig,
+        *,
+        backend: Optional[LimiterBackend] = None,
+        counter: Optional[TokenCounter] = None,
+    ) -> None:
+        self.config = config
+        self.backend = backend or build_limiter_backend(
+            config.backend,
+            sqlite_path=config.sqlite_path,
+            idle_ttl=config.idle_ttl,
+            max_keys=config.max_keys,
+        )
+        # Not the memoized default: request bodies are almost never repeated,
+        # and caching each one would only evict the packer's history entries.
+        self.counter = counter or ApproximateTokenCounter()
+        self.concurrency = ConcurrencyLimiter(
+            max_in_flight=config.max_in_flight,
+            max_in_flight_per_tenant=config.max_in_flight_per_key,
+            max_queue=config.max_queue,
+            max_queue_per_tenant=config.max_queue_per_key,
+            queue_timeout=config.queue_timeout,
+        )
+        self.slots: Optional[SharedSlots] = None
+        if self.backend.shares_slots:
+            self.slots = SharedSlots(self.backend, config.max_in_flight)
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_rejected = 0
+
+    def tenant_for(self, headers: Headers) -> str:
+        """Stable identifier for the caller's API key; the raw key is never stored."""
+        raw = headers.get(self.config.api_key_header, "")
+        if raw.lower().startswith("bearer "):
+            raw = raw[7:]
+        raw = raw.strip()
+        if not raw:
+            return ANONYMOUS
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+    def estimate_tokens(self, body: bytes) -> int:
+        """Prompt tokens (estimated locally) plus the completion budget requested."""
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 0
+        return self.estimate_request_tokens(data)
+
+    def estimate_request_tokens(self, data: Any) -> int:
+        """``estimate_tokens`` for a request body that is already parsed."""
+        if not isinstance(data, dict):
+            return 0
+        texts: list[Any] = [data.get("prompt"), data.get("template"), data.get("input")]
+        variables = data.get("variables")
+        if isinstance(variables, dict):
+            texts.extend(v for v in variables.values() if isinstance(v, str))
+        tokens = 0
+        for text in texts:
+            if isinstance(text, str):
+                tokens += self.counter.count(text)
+            elif isinstance(text, list):
+                tokens += sum(self.counter.count(t) for t in text if isinstance(t, str))
+        max_tokens = data.get("max_tokens")
+        if not isinstance(max_tokens, int):
+            completes = "prompt" in data or "template" in data
+            max_tokens = self.config.default_max_tokens if completes else 0
+        return tokens + max_tokens
+
+    def estimate_oversized_tokens(self, size: int) -> int:
+        """Charge for a body too large to parse: about four bytes a token, plus the budget."""
+        return size // 4 + self.config.default_max_tokens
+
+    def checks(self, tenant: str, tokens: int) -> list[BucketCheck]:
+        c = self.config
+        checks = []
+        if c.requests_per_second:
+            burst = c.request_burst or c.requests_per_second
+            checks.append(BucketCheck(f"rps:{tenant}", c.requests_per_second, burst, 1))
+        if c.global_requests_per_second:
+            rate = c.global_requests_per_second
+            checks.append(BucketCheck("rps:*", rate, c.global_request_burst or rate, 1))
+        checks.extend(self.token_checks(tenant, tokens))
+        return checks
+
+    def token_checks(self, tenant: str, tokens: int) -> list[BucketCheck]:
+        """The tokens-per-minute part of ``checks``; batch jobs are charged only this."""
+        c = self.config
+        checks = []
+        if tokens:
+            if c.tokens_per_minute:
+                rate = c.tokens_per_minute / 60.0
+                checks.append(BucketCheck(f"tpm:{tenant}", rate, c.tokens_per_minute, tokens))
+            if c.global_tokens_per_minute:
+                rate = c.global_tokens_per_minute / 60.0
+                checks.append(BucketCheck("tpm:*", rate, c.global_tokens_per_minute, tokens))
+        return checks
+
+    async def charge_tokens(self, tenant: str, tokens: int) -> float:
+        """Debit ``tokens`` from the tenant's and global buckets, waiting until they have room.
+
+        Returns the seconds spent waiting.
+        """
+        checks = self.token_checks(tenant, tokens)
+        if not checks:
+            return 0.0
+        waited = 0.0
+        while True:
+            wait = await self.backend.take(checks)
+            if not wait:
+                return waited
+            wait = min(wait, 60.0)  # re-check at least once a minute
+            await asyncio.sleep(wait)
+            waited += wait
+
+    async def acquire(self, tenant: str) -> None:
+        """Admit one request for ``tenant``; raises ``AdmissionRejected``."""
+        queued = await self.concurrency.acquire(tenant)
+        if self.slots is None:
+            return
+        try:
+            await self.slots.acquire(max(0.0, self.config.queue_timeout - queued))
+        except BaseException:
+            self.concurrency.release(tenant)
+            raise
+
+    async def release(self, tenant: str) -> None:
+        self.concurrency.release(tenant)
+        if self.slots is not None:
+            await self.slots.release()
+
+    def stats(self) -> dict[str, Any]:
+        stats = {
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "queue_rejected": self.queue_rejected,
+            "buckets": self.backend.size,
+            **self.concurrency.stats(),
+        }
+        if self.slots is not None:
+            stats["queued_for_shared_slot"] = self.slots.waiting
+        return stats
+
+    async def aclose(self) -> None:
+        if self.slots is not None:
+            await self.slots.aclose()
+        await self.backend.aclose()
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware.
+
+    Add with ``app.add_middleware(AdmissionMiddleware, controller=...)``.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController) -> None:
+        self.app = app
+        self.controller = controller
+        self._exempt = tuple(controller.config.exempt_paths)
+        self._token_paths = frozenset(controller.config.token_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self._exempt):
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        headers = Headers(scope=scope)
+        tenant = controller.tenant_for(headers)
+
+        tokens = 0
+        if scope["method"] == "POST" and scope["path"] in self._token_paths:
+            limit = controller.config.max_estimate_body_bytes
+            body, size, receive = await _buffer_body(receive, limit)
+            if body is not None:
+                tokens = controller.estimate_tokens(body)
+            else:
+                tokens = controller.estimate_oversized_tokens(size)
+
+        started = perf_counter()
+        wait = await controller.backend.take(controller.checks(tenant, tokens))
+        ADMISSION_RATE_LIMIT.since(started)
+        if wait:
+            controller.rate_limited += 1
+            await _reject(scope, receive, send, 429, "rate limit exceeded", wait)
+            return
+
+        started = perf_counter()
+        try:
+            await controller.acquire(tenant)
+        except AdmissionRejected as exc:
+            ADMISSION_QUEUE.since(started)
+            controller.queue_rejected += 1
+            await _reject(scope, receive, send, exc.status_code, exc.reason, exc.retry_after)
+            return
+        ADMISSION_QUEUE.since(started)
+        controller.admitted += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await controller.release(tenant)
+
+
+async def _buffer_body(receive: Receive, limit: int) -> tuple[Optional[bytes], int, Receive]:
+    """Read the request body (up to ``limit`` bytes) and return a receive that replays it.
+
+    Oversized bodies are not parsed: the body is ``None`` alongside the bytes
+    read so far, the chunks already read are replayed and the rest streams
+    through untouched.
+    """
+    chunks: list[bytes] = []
+    size = 0
+    more = True
+    while more:
+        message = await receive()
+        if message["type"] != "http.request":
+            # Client went away; replay what we saw so the app notices.
+            replay = [{"type": "http.request", "body": c, "more_body": True} for c in chunks]
+            return None, size, _replaying(replay + [message], receive)
+        chunk = message.get("body", b"")
+        chunks.append(chunk)
+        size += len(chunk)
+        more = message.get("more_body", False)
+        if more and size > limit:
+            replay = [{"type": "http.request", "body": c, "more_body": True} for c in chunks]
+            return None, size, _replaying(replay, receive)
+    body = b"".join(chunks)
+    replay = [{"type": "http.request", "body": body, "more_body": False}]
+    return body, size, _replaying(replay, receive)
+
+
+def _replaying(messages: list[Message], receive: Receive) -> Receive:
+    pending = list(messages)
+
+    async def replay() -> Message:
+        if pending:
+            return pending.pop(0)
+        return await receive()
+
+    return replay
+
+
+async def _reject(
+    scope: Scope,
+    receive: Receive,
+    send: Send,
+    status_code: int,
+    reason: str,
+    retry_after: Optional[float],
+) -> None:
+    headers = {}
+    if retry_after is not None and math.isfinite(retry_after):
+        headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    response = JSONResponse({"detail": reason}, status_code=status_code, headers=headers)
+    await response(scope, receive, send)
+
+
+def build_admission(config: AdmissionConfig) -> Optional[AdmissionController]:
+    return AdmissionController(config) if config.enabled else None
@@ -0,0 +1,270 @@
+"""HTTP routes for the promptai service."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, AsyncIterator, Optional, Union
+
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import ValidationError
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from promptai.batching import UpstreamBatcher
+from promptai.cache import ResponseCache
+from promptai.completions import complete
+from promptai.jobs import Job, JobManager, JobStatus, UploadError
+from promptai.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from promptai.metrics import REGISTRY
+from promptai.metrics.collect import render_service_metrics
+from promptai.schemas import CompletionRequest, EmbeddingRequest, PoolStatsResponse
+from promptai.streaming import UpstreamStreamResponse
+from promptai.templates import TemplateError
+from promptai.upstream import UpstreamClient, UpstreamError, UpstreamRegistry
+
+router = APIRouter()
+
+
+def get_upstream(request: Request) -> UpstreamRegistry:
+    return request.app.state.upstream
+
+
+def get_cache(request: Request) -> Optional[ResponseCache]:
+    return getattr(request.app.state, "cache", None)
+
+
+def get_batchers(request: Request) -> dict[str, UpstreamBatcher]:
+    return getattr(request.app.state, "batchers", {})
+
+
+def get_jobs(request: Request) -> JobManager:
+    jobs = getattr(request.app.state, "jobs", None)
+    if jobs is None:
+        raise HTTPException(status_code=404, detail="batch jobs are disabled")
+    return jobs
+
+
+async def get_job(job_id: str, jobs: JobManager = Depends(get_jobs)) -> Job:
+    job = await jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"no batch job {job_id!r}")
+    return job
+
+
+def wants_cache_bypass(request: Request) -> bool:
+    directives = request.headers.get("cache-control", "").lower()
+    return "no-cache" in directives or "no-store" in directives
+
+
+def resolve_client(
+    registry: UpstreamRegistry, body: Union[CompletionRequest, EmbeddingRequest]
+) -> UpstreamClient:
+    try:
+        return registry.for_model(body.model, body.provider)
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=exc.args[0]) from None
+
+
+def upstream_http_error(exc: UpstreamError) -> HTTPException:
+    """Map a failed upstream call onto the status we return to our caller."""
+    if exc.status_code is not None and 400 <= exc.status_code < 500 and exc.status_code != 429:
+        return HTTPException(status_code=exc.status_code, detail=str(exc))
+    status = 429 if exc.status_code == 429 else 502
+    return HTTPException(status_code=status, detail=str(exc))
+
+
+def render_prompt(body: CompletionRequest) -> str:
+    try:
+        return body.render_prompt()
+    except TemplateError as exc:
+        raise HTTPException(status_code=422, detail=f"template: {exc}") from None
+    except ValidationError as exc:
+        raise HTTPException(
+            status_code=422, detail=exc.errors(include_url=False, include_context=False)
+        ) from None
+
+
+@router.get("/healthz")
+async def healthz() -> dict[str, str]:
+    return {"status": "ok"}
+
+
+@router.get("/upstream/pool", response_model=PoolStatsResponse)
+async def pool_stats(registry: UpstreamRegistry = Depends(get_upstream)) -> PoolStatsResponse:
+    return PoolStatsResponse(providers=[s.as_dict() for s in registry.stats()])
+
+
+@router.get("/cache/stats")
+async def cache_stats(cache: Optional[ResponseCache] = Depends(get_cache)) -> dict[str, Any]:
+    return {"enabled": cache is not None, **(cache.stats() if cache is not None else {})}
+
+
+@router.get("/batching/stats")
+async def batching_stats(
+    batchers: dict[str, UpstreamBatcher] = Depends(get_batchers),
+) -> dict[str, Any]:
+    return {"providers": [batcher.stats() for batcher in batchers.values()]}
+
+
+@router.get("/admission/stats")
+async def admission_stats(request: Request) -> dict[str, Any]:
+    admission = getattr(request.app.state, "admission", None)
+    return {"enabled": admission is not None, **(admission.stats() if admission else {})}
+
+
+@router.get("/metrics", response_model=None)
+async def metrics(request: Request) -> Response:
+    """Histograms and component gauges in the Prometheus text exposition format."""
+    if not request.app.state.settings.metrics.enabled:
+        raise HTTPException(status_code=404, detail="metrics are disabled")
+    body = REGISTRY.render() + render_service_metrics(request.app.state)
+    return Response(body, media_type=METRICS_CONTENT_TYPE)
+
+
+@router.get("/metrics/traces")
+async def slow_traces(request: Request) -> dict[str, Any]:
+    """The slowest sampled request traces, slowest first."""
+    sampler = getattr(request.app.state, "sampler", None)
+    if sampler is None:
+        return {"enabled": False, "sampled": 0, "traces": []}
+    return {"enabled": True, "sampled": sampler.sampled, "traces": sampler.slowest()}
+
+
+@router.post("/v1/completions", response_model=None)
+async def create_completion(
+    body: CompletionRequest,
+    request: Request,
+    registry: UpstreamRegistry = Depends(get_upstream),
+    cache: Optional[ResponseCache] = Depends(get_cache),
+    batchers: dict[str, UpstreamBatcher] = Depends(get_batchers),
+) -> Response:
+    """Complete a prompt; with ``"stream": true`` the upstream events are relayed as SSE.
+
+    Non-streaming bodies are passed through as the raw upstream bytes and,
+    unless the caller sends ``Cache-Control: no-cache``, served from and
+    stored in the response cache.
+    """
+    client = resolve_client(registry, body)
+    prompt = render_prompt(body)
+
+    try:
+        if body.stream:
+            upstream = await client.open_stream(
+                "POST", client.config.completions_path, json=body.upstream_payload(prompt)
+            )
+            return UpstreamStreamResponse(upstream)
+        content, status = await complete(
+            body,
+            prompt,
+            client,
+            cache=None if wants_cache_bypass(request) else cache,
+            batcher=batchers.get(client.name),
+        )
+    except UpstreamError as exc:
+        raise upstream_http_error(exc) from None
+    headers = {"X-Cache": status.value} if status is not None else None
+    return Response(content, media_type="application/json", headers=headers)
+
+
+@router.post("/v1/embeddings", response_model=None)
+async def create_embedding(
+    body: EmbeddingRequest,
+    registry: UpstreamRegistry = Depends(get_upstream),
+    batchers: dict[str, UpstreamBatcher] = Depends(get_batchers),
+) -> Response:
+    client = resolve_client(registry, body)
+    batcher = batchers.get(client.name)
+    payload = body.upstream_payload()
+    try:
+        if batcher is not None and isinstance(body.input, str):
+            content = await batcher.embed(payload)
+        else:
+            response = await client.request("POST", client.config.embeddings_path, json=payload)
+            content = response.content
+    except UpstreamError as exc:
+        raise upstream_http_error(exc) from None
+    return Response(content, media_type="application/json")
+
+
+@router.post("/v1/batches", status_code=201)
+async def create_batch(request: Request, jobs: JobManager = Depends(get_jobs)) -> dict[str, Any]:
+    """Upload a JSONL file of completion requests and start processing it.
+
+    Send the file as the ``file`` part of a multipart form or as the bare
+    request body. Options (form fields, or query parameters for a bare body):
+    ``concurrency``, ``defaults`` (a JSON object merged under every line) and
+    any single completion field such as ``model``.
+    """
+    try:
+        job = await jobs.create(request)
+    except UploadError as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.reason) from None
+    return job.describe()
+
+
+@router.get("/v1/batches")
+async def list_batches(jobs: JobManager = Depends(get_jobs)) -> dict[str, Any]:
+    await jobs.refresh()
+    return {"data": [job.describe() for job in jobs.jobs()]}
+
+
+@router.get("/v1/batches/{job_id}")
+async def get_batch(job: Job = Depends(get_job)) -> dict[str, Any]:
+    return job.describe()
+
+
+@router.post("/v1/batches/{job_id}/cancel")
+async def cancel_batch(
+    job: Job = Depends(get_job), jobs: JobManager = Depends(get_jobs)
+) -> dict[str, Any]:
+    cancelled = await jobs.cancel(job)
+    if cancelled is None:
+        raise HTTPException(
+            status_code=409, detail="batch job is running in another worker process"
+        )
+    return cancelled.describe()
+
+
+@router.post("/v1/batches/{job_id}/resume")
+async def resume_batch(
+    job: Job = Depends(get_job), jobs: JobManager = Depends(get_jobs)
+) -> dict[str, Any]:
+    resumed = await jobs.resume(job)
+    if resumed is None:
+        job = await jobs.get(job.id) or job
+        raise HTTPException(status_code=409, detail=f"batch job is {job.record.status.value}")
+    return resumed.describe()
+
+
+@router.get("/v1/batches/{job_id}/results", response_model=None)
+async def download_batch_results(
+    job: Job = Depends(get_job), jobs: JobManager = Depends(get_jobs)
+) -> Response:
+    """The results so far as JSONL, streamed from disk.
+
+    Until the job completes, the download stops at the last result covered
+    when the request arrived, so it never ends mid-line.
+    """
+    path = jobs.store.output_path(job.id)
+    filename = f"{job.id}-results.jsonl"
+    if job.record.status is JobStatus.COMPLETED and not job.running:
+        return FileResponse(path, media_type="application/x-ndjson", filename=filename)
+    size = job.flush()
+    return StreamingResponse(
+        _read_file(path, size),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Length": str(size),
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        },
+    )
+
+
+async def _read_file(path: Path, size: int, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    async with await anyio.open_file(path, "rb") as f:
+        while size > 0:
+            chunk = await f.read(min(chunk_size, size))
+            if not chunk:
+                return
+            size -= len(chunk)
+            yield chunk
@@ -0,0 +1,86 @@
+"""FastAPI application factory.
+
+Run with ``uvicorn promptai.app:create_app --factory``.
+"""
+
+from __future__ import annotations
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from promptai.admission import AdmissionMiddleware, build_admission
+from promptai.api import router
+from promptai.batching import UpstreamBatcher
+from promptai.cache import build_cache
+from promptai.config import Settings
+from promptai.jobs import JobManager
+from promptai.metrics import MetricsMiddleware, SlowTraceSampler
+from promptai.upstream import UpstreamRegistry
+
+
+def create_app(
+    settings: Optional[Settings] = None,
+    *,
+    transport: Optional[httpx.AsyncBaseTransport] = None,
+) -> FastAPI:
+    """Build the app. ``transport`` overrides the network layer for every provider."""
+    if settings is None:
+        settings = Settings.from_env()
+    admission = build_admission(settings.admission)
+    metrics = settings.metrics
+    sampler = None
+    if metrics.enabled and metrics.trace_sample_rate > 0:
+        sampler = SlowTraceSampler(
+            metrics.trace_sample_rate, metrics.slow_traces, dump_path=metrics.trace_dump_path
+        )
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        registry = UpstreamRegistry.from_configs(
+            settings.providers, settings.default_provider, transport=transport
+        )
+        cache = build_cache(settings.cache)
+        batchers = {
+            client.name: UpstreamBatcher(client, client.config.batching)
+            for client in registry
+            if client.config.batching.enabled
+        }
+        jobs = None
+        if settings.jobs.enabled:
+            jobs = JobManager(
+                settings.jobs, registry, cache=cache, batchers=batchers, admission=admission
+            )
+            await jobs.start()
+        app.state.upstream = registry
+        app.state.cache = cache
+        app.state.batchers = batchers
+        app.state.jobs = jobs
+        try:
+            yield
+        finally:
+            if jobs is not None:
+                await jobs.aclose()
+            for batcher in batchers.values():
+                await batcher.aclose()
+            await registry.aclose()
+            if cache is not None:
+                await cache.aclose()
+            if admission is not None:
+                await admission.aclose()
+            if sampler is not None and sampler.dump_path is not None:
+                sampler.dump()
+
+    app = FastAPI(title="promptai", lifespan=lifespan)
+    app.state.settings = settings
+    app.state.admission = admission
+    app.state.sampler = sampler
+    app.include_router(router)
+    if admission is not None:
+        app.add_middleware(AdmissionMiddleware, controller=admission)
+    if metrics.enabled:
+        # Added last, so it is outermost and times admission too.
+        app.add_middleware(MetricsMiddleware, sampler=sampler)
+    return app
@@ -0,0 +1,288 @@
+"""Micro-batching of concurrent upstream calls.
+
+``MicroBatcher`` groups items submitted under the same key and dispatches
+them together once ``max_batch_size`` items are waiting or the oldest has
+waited ``max_wait`` seconds, whichever comes first. Each caller gets back its
+own slot of the batch result.
+
+``UpstreamBatcher`` applies this to a provider's completion and embedding
+endpoints, which accept a list of prompts/inputs in one request and return
+choices/data tagged with the input ``index``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Generic, Hashable, Optional, TypeVar
+
+from promptai.config import BatchingConfig
+from promptai.metrics.stages import BATCH_CALL, BATCH_QUEUE
+from promptai.metrics.tracing import detach_trace, perf_counter
+from promptai.upstream import UpstreamClient, UpstreamError
+
+I = TypeVar("I")
+O = TypeVar("O")
+
+__all__ = ["BatchStats", "MicroBatcher", "UpstreamBatcher"]
+
+
+@dataclass
+class RunningStat:
+    """Count, sum, max and last value of a series of observations."""
+
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    last: float = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.last = value
+        if value > self.max:
+            self.max = value
+
+    def as_dict(self) -> dict[str, float]:
+        mean = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "mean": mean, "max": self.max, "last": self.last}
+
+
+@dataclass
+class BatchStats:
+    batches: int = 0
+    items: int = 0
+    failures: int = 0
+    in_flight: int = 0
+    batch_size: RunningStat = field(default_factory=RunningStat)
+    queue_wait: RunningStat = field(default_factory=RunningStat)
+    latency: RunningStat = field(default_factory=RunningStat)
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "batch_size": self.batch_size.as_dict(),
+            "queue_wait_seconds": self.queue_wait.as_dict(),
+            "latency_seconds": self.latency.as_dict(),
+        }
+
+
+class _Batch(Generic[I, O]):
+    __slots__ = ("items", "futures", "enqueued", "timer")
+
+    def __init__(self) -> None:
+        self.items: list[I] = []
+        self.futures: list[asyncio.Future[O]] = []
+        self.enqueued: list[float] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher(Generic[I, O]):
+    """Coalesces concurrent ``submit`` calls into batched ``dispatch`` calls.
+
+    ``dispatch(key, items)`` must return one result per item, in order. If it
+    raises, every caller in the batch sees the exception. Callers that are
+    cancelled while queued are dropped from their batch before dispatch.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[Hashable, list[I]], Awaitable[list[O]]],
+        *,
+        max_batch_size: int = 16,
+        max_wait: float = 0.005,
+        max_concurrent_batches: Optional[int] = None,
+    ) -> None:
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self._dispatch = dispatch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.stats = BatchStats()
+        self._pending: dict[Hashable, _Batch[I, O]] = {}
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._slots = (
+            asyncio.Semaphore(max_concurrent_batches) if max_concurrent_batches else None
+        )
+
+    @property
+    def pending(self) -> int:
+        return sum(len(batch.items) for batch in self._pending.values())
+
+    async def submit(self, key: Hashable, item: I) -> O:
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch()
+            batch.timer = loop.call_later(self.max_wait, self._flush, key)
+        future: asyncio.Future[O] = loop.create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        batch.enqueued.append(loop.time())
+        if len(batch.items) >= self.max_batch_size:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._run(key, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: _Batch[I, O]) -> None:
+        # This task inherited the context of whichever caller started the
+        # batch; its upstream spans belong to no single request's trace.
+        detach_trace()
+        if self._slots is not None:
+            async with self._slots:
+                await self._run_now(key, batch)
+        else:
+            await self._run_now(key, batch)
+
+    async def _run_now(self, key: Hashable, batch: _Batch[I, O]) -> None:
+        live = [i for i, fut in enumerate(batch.futures) if not fut.done()]
+        if not live:
+            return
+        items = [batch.items[i] for i in live]
+        futures = [batch.futures[i] for i in live]
+
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        stats = self.stats
+        for i in live:
+            wait = start - batch.enqueued[i]
+            stats.queue_wait.add(wait)
+            BATCH_QUEUE.observe(wait)
+        stats.batches += 1
+        stats.items += len(items)
+        stats.batch_size.add(len(items))
+        stats.in_flight += 1
+        try:
+            results = await self._dispatch(key, items)
+            if len(results) != len(items):
+                raise RuntimeError(
+                    f"batch dispatch returned {len(results)} results for {len(items)} items"
+                )
+        except BaseException as exc:
+            stats.failures += 1
+            cancelled = isinstance(exc, asyncio.CancelledError)
+            for fut in futures:
+                if not fut.done():
+                    if cancelled:
+                        fut.cancel()
+                    else:
+                        fut.set_exception(exc)
+            if cancelled:
+                raise
+            return
+        finally:
+            stats.in_flight -= 1
+            stats.latency.add(loop.time() - start)
+        for fut, result in zip(futures, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def flush(self) -> None:
+        """Dispatch everything queued now and wait for all batches to finish."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+class UpstreamBatcher:
+    """Batches one provider's completion and single-input embedding calls.
+
+    Requests are grouped by model and all other parameters, so only the
+    prompt (or input) differs within a batch. The batched response is split
+    per caller by each choice's/datum's ``index``; ``usage`` describes the
+    whole batch and is therefore omitted from the per-caller bodies.
+    """
+
+    def __init__(self, client: UpstreamClient, config: BatchingConfig) -> None:
+        self.client = client
+        options = dict(
+            max_batch_size=config.max_batch_size,
+            max_wait=config.max_wait_ms / 1000.0,
+            max_concurrent_batches=config.max_concurrent_batches,
+        )
+        self.completions: MicroBatcher[str, bytes] = MicroBatcher(
+            self._dispatch_completions, **options
+        )
+        self.embeddings: MicroBatcher[str, bytes] = MicroBatcher(
+            self._dispatch_embeddings, **options
+        )
+
+    async def complete(self, payload: dict[str, Any]) -> bytes:
+        key, prompt = _split_key(payload, "prompt")
+        started = perf_counter()
+        try:
+            return await self.completions.submit(key, prompt)
+        finally:
+            BATCH_CALL.since(started)
+
+    async def embed(self, payload: dict[str, Any]) -> bytes:
+        key, text = _split_key(payload, "input")
+        started = perf_counter()
+        try:
+            return await self.embeddings.submit(key, text)
+        finally:
+            BATCH_CALL.since(started)
+
+    async def _dispatch_completions(self, key: Hashable, prompts: list[str]) -> list[bytes]:
+        payload = {**json.loads(key), "prompt": prompts}  # type: ignore[arg-type]
+        path = self.client.config.completions_path
+        response = await self.client.request("POST", path, json=payload)
+        return self._split_response(response.json(), "choices", len(prompts))
+
+    async def _dispatch_embeddings(self, key: Hashable, inputs: list[str]) -> list[bytes]:
+        payload = {**json.loads(key), "input": inputs}  # type: ignore[arg-type]
+        path = self.client.config.embeddings_path
+        response = await self.client.request("POST", path, json=payload)
+        return self._split_response(response.json(), "data", len(inputs))
+
+    def _split_response(self, body: dict[str, Any], field_name: str, n: int) -> list[bytes]:
+        entries = body.get(field_name)
+        if not isinstance(entries, list):
+            raise UpstreamError(self.client.name, f"batched response has no {field_name!r} list")
+        per_item: list[list[dict[str, Any]]] = [[] for _ in range(n)]
+        for position, entry in enumerate(entries):
+            index = entry.get("index", position) if isinstance(entry, dict) else position
+            if not 0 <= index < n:
+                raise UpstreamError(self.client.name, f"batched response index {index} is invalid")
+            per_item[index].append({**entry, "index": len(per_item[index])})
+        shared = {k: v for k, v in body.items() if k not in (field_name, "usage")}
+        return [
+            json.dumps({**shared, field_name: item}, separators=(",", ":")).encode("utf-8")
+            for item in per_item
+        ]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "provider": self.client.name,
+            "max_batch_size": self.completions.max_batch_size,
+            "max_wait_ms": self.completions.max_wait * 1000.0,
+            "completions": _batcher_stats(self.completions),
+            "embeddings": _batcher_stats(self.embeddings),
+        }
+
+    async def aclose(self) -> None:
+        await self.completions.flush()
+        await self.embeddings.flush()
+
+
+def _batcher_stats(batcher: MicroBatcher) -> dict[str, Any]:
+    return {**batcher.stats.as_dict(), "pending": batcher.pending}
+
+
+def _split_key(payload: dict[str, Any], field_name: str) -> tuple[str, Any]:
+    rest = {k: v for k, v in payload.items() if k != field_name}
+    return json.dumps(rest, sort_keys=True, separators=(",", ":")), payload[field_name]
@@ -0,0 +1,20 @@
+"""Response cache for prompt completions."""
+
+from promptai.cache.backends import BackendStats, CacheBackend, MemoryBackend, SqliteBackend
+from promptai.cache.keys import cache_key, context_key
+from promptai.cache.service import CacheStatus, ResponseCache, SingleFlight, build_cache
+from promptai.cache.similarity import NearDuplicateIndex
+
+__all__ = [
+    "BackendStats",
+    "CacheBackend",
+    "CacheStatus",
+    "MemoryBackend",
+    "NearDuplicateIndex",
+    "ResponseCache",
+    "SingleFlight",
+    "SqliteBackend",
+    "build_cache",
+    "cache_key",
+    "context_key",
+]
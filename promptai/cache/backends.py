@@ -0,0 +1,313 @@
+"""Storage backends for cached completion responses.
+
+Backends store opaque ``bytes`` (the upstream response body) under a string
+key, each with a TTL, and enforce their own entry-count and byte-size bounds
+by evicting least-recently-used entries.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, Union
+
+import anyio.to_thread
+
+
+@dataclass
+class BackendStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class CacheBackend(ABC):
+    """Interface every response-cache backend implements."""
+
+    def __init__(self) -> None:
+        self.stats = BackendStats()
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return the live value for ``key`` or None; counts a hit or miss."""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """Store ``value`` for ``ttl`` seconds, evicting as needed."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def clear(self) -> None:
+        ...
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """In-process LRU bounded by entry count and total value bytes."""
+
+    def __init__(
+        self,
+        max_entries: int = 10_000,
+        max_bytes: int = 256 * 1024 * 1024,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__()
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= self._clock():
+            self._discard(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (value, self._clock() + ttl)
+        self.stats.entries += 1
+        self.stats.bytes += len(value)
+        while self.stats.entries > self.max_entries or self.stats.bytes > self.max_bytes:
+            _, (old, _) = self._entries.popitem(last=False)
+            self.stats.entries -= 1
+            self.stats.bytes -= len(old)
+            self.stats.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._discard(key)
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self.stats.entries = self.stats.bytes = 0
+
+    def _discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.stats.entries -= 1
+            self.stats.bytes -= len(entry[0])
+
+
+class SqliteBackend(CacheBackend):
+    """On-disk LRU in a single SQLite file, so cached responses survive restarts.
+
+    The database runs in WAL mode with memory-mapped reads. Calls are made on
+    a worker thread to keep disk I/O off the event loop; a lock serialises
+    them over the one shared connection.
+
+    Several worker processes may share the file. Entry and byte totals live
+    in a one-row ``totals`` table kept current by triggers, and eviction
+    reads them inside the writing ``BEGIN IMMEDIATE`` transaction, so the
+    bounds hold for the file as a whole. ``stats.entries``/``stats.bytes``
+    are refreshed from it after each write. Hits do not write: access times
+    are buffered and flushed in one transaction every ``touch_batch`` hits,
+    every ``touch_interval`` seconds, or before the next eviction, so LRU
+    order is at most that stale.
+    """
+
+    _SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)",
+        """CREATE TABLE IF NOT EXISTS totals (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            entries INTEGER NOT NULL,
+            bytes INTEGER NOT NULL
+        )""",
+        # Files written before the totals table existed are counted once here.
+        """INSERT OR IGNORE INTO totals (id, entries, bytes)
+            SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM responses""",
+        """CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN
+            UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size WHERE id = 0;
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN
+            UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size WHERE id = 0;
+        END""",
+    )
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_entries: int = 100_000,
+        max_bytes: int = 1024 * 1024 * 1024,
+        *,
+        mmap_size: int = 256 * 1024 * 1024,
+        touch_batch: int = 256,
+        touch_interval: float = 1.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        super().__init__()
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._touched: dict[str, float] = {}
+        self._touched_since = 0.0
+        self._conn = sqlite3.connect(
+            self.path, timeout=5.0, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        with self._lock, self._transaction():
+            for statement in self._SCHEMA:
+                self._conn.execute(statement)
+            self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (self._clock(),))
+            self._evict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await anyio.to_thread.run_sync(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await anyio.to_thread.run_sync(self._set, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await anyio.to_thread.run_sync(self._delete, key)
+
+    async def clear(self) -> None:
+        await anyio.to_thread.run_sync(self._clear)
+
+    async def aclose(self) -> None:
+        with self._lock:
+            if self._touched:
+                with self._transaction():
+                    self._flush_touched()
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # IMMEDIATE takes the write lock up front, so a transaction that
+        # reads the totals never has to upgrade and lose a race to another
+        # process.
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+        self._read_totals()
+
+    def _read_totals(self) -> None:
+        row = self._conn.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+        self.stats.entries, self.stats.bytes = row
+
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            value, expires_at = row
+            now = self._clock()
+            if expires_at <= now:
+                with self._transaction():
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key = ? AND expires_at <= ?", (key, now)
+                    )
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            if not self._touched:
+                self._touched_since = now
+            self._touched[key] = now
+            if (
+                len(self._touched) >= self.touch_batch
+                or now - self._touched_since >= self.touch_interval
+            ):
+                with self._transaction():
+                    self._flush_touched()
+            self.stats.hits += 1
+            return value
+
+    def _flush_touched(self) -> None:
+        self._conn.executemany(
+            "UPDATE responses SET accessed_at = ? WHERE key = ?",
+            [(at, key) for key, at in self._touched.items()],
+        )
+        self._touched.clear()
+
+    def _set(self, key: str, value: bytes, ttl: float) -> None:
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        now = self._clock()
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.execute(
+                "INSERT INTO responses (key, value, size, expires_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl, now),
+            )
+            self._evict()
+
+    def _delete(self, key: str) -> None:
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._touched.pop(key, None)
+
+    def _clear(self) -> None:
+        with self._lock, self._transaction():
+            self._conn.execute("DELETE FROM responses")
+            self._touched.clear()
+
+    def _evict(self) -> None:
+        # Runs inside a write transaction, so the totals include every process's writes.
+        conn = self._conn
+        entries, size = conn.execute("SELECT entries, bytes FROM totals WHERE id = 0").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        if self._touched:
+            self._flush_touched()
+        while entries > self.max_entries or size > self.max_bytes:
+            victims = conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 64"
+            ).fetchall()
+            if not victims:
+                break
+            for key, victim_size in victims:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                entries -= 1
+                size -= victim_size
+                self.stats.evictions += 1
+                if entries <= self.max_entries and size <= self.max_bytes:
+                    break
@@ -0,0 +1,28 @@
+"""Canonical cache keys for completion requests."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Mapping
+
+
+def _canonical(obj: Any) -> bytes:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode(
+        "utf-8"
+    )
+
+
+def _clean(params: Mapping[str, Any]) -> dict[str, Any]:
+    # ``None`` means "provider default", which is the same as leaving it out.
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def cache_key(model: str, prompt: str, params: Mapping[str, Any]) -> str:
+    """SHA-256 over (model, rendered prompt, sampling params) in canonical JSON."""
+    return hashlib.sha256(_canonical([model, prompt, _clean(params)])).hexdigest()
+
+
+def context_key(model: str, params: Mapping[str, Any]) -> str:
+    """Like ``cache_key`` without the prompt; near-duplicate matches stay within one context."""
+    return hashlib.sha256(_canonical([model, _clean(params)])).hexdigest()
@@ -0,0 +1,156 @@
+"""Response cache front end: exact lookup, optional near-duplicate lookup and
+coalescing of identical in-flight requests."""
+
+from __future__ import annotations
+
+import asyncio
+import enum
+from typing import Any, Awaitable, Callable, Generic, Mapping, Optional, TypeVar
+
+import anyio.to_thread
+
+from promptai.cache.backends import CacheBackend, MemoryBackend, SqliteBackend
+from promptai.cache.keys import cache_key, context_key
+from promptai.cache.similarity import NearDuplicateIndex
+from promptai.config import CacheConfig
+from promptai.metrics.stages import CACHE_LOOKUP
+from promptai.metrics.tracing import perf_counter
+
+T = TypeVar("T")
+
+
+class CacheStatus(str, enum.Enum):
+    HIT = "hit"
+    NEAR_HIT = "near-hit"
+    MISS = "miss"
+    COALESCED = "coalesced"
+
+
+class SingleFlight(Generic[T]):
+    """Run at most one call per key at a time; concurrent callers share its result.
+
+    The shared call runs in its own task, so a caller that is cancelled does
+    not cancel the work the other callers are waiting on.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> tuple[T, bool]:
+        """Return ``(result, shared)``; ``shared`` is True if another caller started the call."""
+        task = self._calls.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._calls[key] = task
+
+        def _done(t: asyncio.Task[T]) -> None:
+            if self._calls.get(key) is t:
+                del self._calls[key]
+            if not t.cancelled():
+                t.exception()  # mark retrieved even if every caller went away
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task), False
+
+
+class ResponseCache:
+    """Caches upstream completion bodies keyed on (model, prompt, params)."""
+
+    def __init__(
+        self,
+        backend: CacheBackend,
+        *,
+        ttl: float = 3600.0,
+        near_duplicates: Optional[NearDuplicateIndex] = None,
+    ) -> None:
+        self.backend = backend
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.near_hits = 0
+        self.coalesced = 0
+        self._flights: SingleFlight[bytes] = SingleFlight()
+
+    async def get_or_compute(
+        self,
+        model: str,
+        prompt: str,
+        params: Mapping[str, Any],
+        compute: Callable[[], Awaitable[bytes]],
+    ) -> tuple[bytes, CacheStatus]:
+        started = perf_counter()
+        key = cache_key(model, prompt, params)
+        value = await self.backend.get(key)
+        if value is not None:
+            CACHE_LOOKUP.since(started)
+            return value, CacheStatus.HIT
+
+        near = self.near_duplicates
+        context: Optional[str] = None
+        signature: Optional[tuple[int, ...]] = None
+        if near is not None:
+            context = context_key(model, params)
+            # Pure-Python hashing; long prompts would stall the event loop.
+            signature = await anyio.to_thread.run_sync(near.signature, prompt)
+            match = near.query(context, signature)
+            if match is not None:
+                value = await self.backend.get(match[0])
+                if value is not None:
+                    CACHE_LOOKUP.since(started)
+                    self.near_hits += 1
+                    return value, CacheStatus.NEAR_HIT
+                near.discard(match[0])
+        CACHE_LOOKUP.since(started)
+
+        async def fill() -> bytes:
+            result = await compute()
+            await self.backend.set(key, result, self.ttl)
+            if near is not None:
+                near.add(context, key, signature)
+            return result
+
+        value, shared = await self._flights.do(key, fill)
+        if shared:
+            self.coalesced += 1
+            return value, CacheStatus.COALESCED
+        return value, CacheStatus.MISS
+
+    def stats(self) -> dict[str, Any]:
+        stats = self.backend.stats.as_dict()
+        stats.update(
+            backend=type(self.backend).__name__,
+            near_hits=self.near_hits,
+            coalesced=self.coalesced,
+            in_flight=len(self._flights),
+        )
+        if self.near_duplicates is not None:
+            stats["near_duplicate_entries"] = len(self.near_duplicates)
+        return stats
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
+
+
+def build_cache(config: CacheConfig) -> Optional[ResponseCache]:
+    """Construct the cache described by ``config``, or None when disabled."""
+    if not config.enabled:
+        return None
+    if config.backend == "sqlite":
+        backend: CacheBackend = SqliteBackend(
+            config.sqlite_path, max_entries=config.max_entries, max_bytes=config.max_bytes
+        )
+    else:
+        backend = MemoryBackend(max_entries=config.max_entries, max_bytes=config.max_bytes)
+    near = None
+    if config.near_duplicate:
+        near = NearDuplicateIndex(
+            config.near_duplicate_threshold,
+            shingle_size=config.shingle_size,
+            max_shingles=config.max_shingles,
+            max_entries=config.max_entries,
+        )
+    return ResponseCache(backend, ttl=config.ttl, near_duplicates=near)
@@ -0,0 +1,151 @@
+"""Near-duplicate prompt lookup via word shingles, MinHash and LSH banding.
+
+Prompts are normalised (case-folded, reduced to word tokens), cut into
+overlapping ``shingle_size``-word shingles and summarised by a MinHash
+signature. Signatures are split into bands; two prompts sharing any band
+bucket become candidates and the best candidate is accepted when its
+estimated Jaccard similarity reaches ``threshold``.
+
+Long prompts are summarised by a sample of their shingles: the
+``max_shingles`` with the smallest hashes. The sample is consistent (a
+shingle shared by two prompts is kept or dropped in both alike), so it
+estimates the same similarity while bounding the signature cost.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import random
+import re
+from collections import OrderedDict
+from typing import Optional
+
+_WORD_RE = re.compile(r"\w+")
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 61) - 1
+
+
+def normalize(text: str) -> list[str]:
+    """Case-fold ``text`` and split it into word tokens, dropping punctuation."""
+    return _WORD_RE.findall(text.casefold())
+
+
+def shingle_hashes(tokens: list[str], size: int, limit: Optional[int] = None) -> set[int]:
+    """64-bit hashes of every ``size``-word shingle (one shingle for short texts).
+
+    With ``limit``, only the ``limit`` smallest hashes are kept.
+    """
+    if len(tokens) <= size:
+        grams = [" ".join(tokens)] if tokens else []
+    else:
+        grams = [" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)]
+    hashes = {
+        int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little")
+        for g in grams
+    }
+    if limit is not None and len(hashes) > limit:
+        hashes = set(heapq.nsmallest(limit, hashes))
+    return hashes
+
+
+class MinHasher:
+    """Universal-hash MinHash over 64-bit shingle hashes."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1) -> None:
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, hashes: set[int]) -> tuple[int, ...]:
+        if not hashes:
+            return (_MAX_HASH,) * self.num_perm
+        p = _MERSENNE_PRIME
+        return tuple(min((a * h + b) % p for h in hashes) for a, b in self._perms)
+
+
+def estimated_jaccard(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class NearDuplicateIndex:
+    """Bounded in-process LSH index mapping prompts to exact cache keys.
+
+    The index only remembers which cache key a prompt was stored under; the
+    response itself stays in the cache backend. Entries are grouped by a
+    context key (model plus sampling params) so matches never cross models.
+
+    ``signature`` is the expensive step (milliseconds for a long prompt); a
+    caller computes it once, off the event loop, and passes it to both
+    ``query`` and ``add``.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        *,
+        shingle_size: int = 3,
+        max_shingles: Optional[int] = 256,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_entries: int = 10_000,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.max_shingles = max_shingles
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self._hasher = MinHasher(num_perm)
+        self._entries: OrderedDict[str, tuple[str, tuple[int, ...]]] = OrderedDict()
+        self._buckets: dict[tuple[str, int, tuple[int, ...]], set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def signature(self, text: str) -> tuple[int, ...]:
+        hashes = shingle_hashes(normalize(text), self.shingle_size, self.max_shingles)
+        return self._hasher.signature(hashes)
+
+    def add(self, context: str, key: str, signature: tuple[int, ...]) -> None:
+        self.discard(key)
+        self._entries[key] = (context, signature)
+        for bucket in self._band_keys(context, signature):
+            self._buckets.setdefault(bucket, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.discard(next(iter(self._entries)))
+
+    def discard(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for bucket in self._band_keys(*entry):
+            members = self._buckets.get(bucket)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._buckets[bucket]
+
+    def query(self, context: str, signature: tuple[int, ...]) -> Optional[tuple[str, float]]:
+        """Return ``(cache_key, similarity)`` of the closest stored prompt, if close enough."""
+        candidates: set[str] = set()
+        for bucket in self._band_keys(context, signature):
+            candidates.update(self._buckets.get(bucket, ()))
+        best: Optional[tuple[str, float]] = None
+        for key in candidates:
+            score = estimated_jaccard(signature, self._entries[key][1])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        if best is not None:
+            self._entries.move_to_end(best[0])
+        return best
+
+    def _band_keys(self, context: str, signature: tuple[int, ...]):
+        rows = self.rows
+        for band in range(self.bands):
+            yield (context, band, signature[band * rows : (band + 1) * rows])
@@ -0,0 +1,38 @@
+"""Non-streaming completion calls shared by the HTTP route and batch jobs."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from promptai.batching import UpstreamBatcher
+from promptai.cache import CacheStatus, ResponseCache
+from promptai.schemas import CompletionRequest
+from promptai.upstream import UpstreamClient
+
+
+async def complete(
+    body: CompletionRequest,
+    prompt: str,
+    client: UpstreamClient,
+    *,
+    cache: Optional[ResponseCache] = None,
+    batcher: Optional[UpstreamBatcher] = None,
+) -> tuple[bytes, Optional[CacheStatus]]:
+    """Run one completion and return the raw upstream body.
+
+    The call goes through ``batcher`` when given and is served from and
+    stored in ``cache`` when given; the returned status is ``None`` when no
+    cache was consulted. Raises ``UpstreamError``.
+    """
+    payload = body.upstream_payload(prompt)
+
+    async def call_upstream() -> bytes:
+        if batcher is not None:
+            return await batcher.complete(payload)
+        response = await client.request("POST", client.config.completions_path, json=payload)
+        return response.content
+
+    if cache is None:
+        return await call_upstream(), None
+    params = {**body.sampling_params(), "provider": client.name}
+    return await cache.get_or_compute(body.model, prompt, params, call_upstream)
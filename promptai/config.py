@@ -0,0 +1,314 @@
+"""Runtime configuration for the promptai service.
+
+Settings are plain pydantic models so they can be built in code, loaded from a
+JSON document, or assembled from ``PROMPTAI_*`` environment variables (a
+``.env`` file in the working directory is honoured).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Literal, Mapping, Optional
+
+from pydantic import BaseModel, Field, model_validator
+
+ENV_PREFIX = "PROMPTAI_"
+
+
+class PoolConfig(BaseModel):
+    """Connection-pool sizing for one provider's long-lived client."""
+
+    max_connections: int = Field(100, ge=1)
+    max_keepalive_connections: int = Field(20, ge=0)
+    keepalive_expiry: float = Field(30.0, ge=0)
+    http2: bool = False
+
+
+class TimeoutConfig(BaseModel):
+    """Per-phase timeouts in seconds, passed straight to ``httpx.Timeout``."""
+
+    connect: float = 5.0
+    read: float = 60.0
+    write: float = 10.0
+    pool: float = 5.0
+
+
+class RetryConfig(BaseModel):
+    """Retry policy for upstream calls.
+
+    Delays use "full jitter": attempt ``n`` sleeps a uniform random time in
+    ``[0, min(backoff_max, backoff_base * 2 ** n)]`` unless the upstream sent
+    a ``Retry-After`` header.
+    """
+
+    max_attempts: int = Field(3, ge=1)
+    backoff_base: float = Field(0.25, ge=0)
+    backoff_max: float = Field(8.0, ge=0)
+    retry_statuses: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+    retry_read_timeouts: bool = False
+
+
+class BatchingConfig(BaseModel):
+    """Micro-batching of concurrent calls to one provider.
+
+    Only enable this for providers whose completion and embedding endpoints
+    accept a list of prompts/inputs and tag each result with its ``index``.
+    """
+
+    enabled: bool = False
+    max_batch_size: int = Field(16, ge=1)
+    max_wait_ms: float = Field(5.0, ge=0)
+    max_concurrent_batches: Optional[int] = Field(None, ge=1)
+
+
+class ProviderConfig(BaseModel):
+    """One upstream LLM provider."""
+
+    name: str
+    base_url: str
+    api_key: Optional[str] = None
+    auth_header: str = "Authorization"
+    auth_scheme: Optional[str] = "Bearer"
+    completions_path: str = "/v1/completions"
+    embeddings_path: str = "/v1/embeddings"
+    models: tuple[str, ...] = ()
+    headers: dict[str, str] = Field(default_factory=dict)
+    pool: PoolConfig = Field(default_factory=PoolConfig)
+    timeouts: TimeoutConfig = Field(default_factory=TimeoutConfig)
+    retry: RetryConfig = Field(default_factory=RetryConfig)
+    batching: BatchingConfig = Field(default_factory=BatchingConfig)
+
+    def serves(self, model: str) -> bool:
+        """Return True if ``model`` is listed, or matches a ``prefix*`` entry."""
+        for pattern in self.models:
+            if pattern.endswith("*"):
+                if model.startswith(pattern[:-1]):
+                    return True
+            elif model == pattern:
+                return True
+        return False
+
+
+class CacheConfig(BaseModel):
+    """Response cache for non-streaming completions."""
+
+    enabled: bool = True
+    backend: Literal["memory", "sqlite"] = "memory"
+    ttl: float = Field(3600.0, gt=0)
+    max_entries: int = Field(10_000, ge=1)
+    max_bytes: int = Field(256 * 1024 * 1024, ge=1)
+    sqlite_path: str = "promptai-cache.sqlite3"
+    near_duplicate: bool = False
+    near_duplicate_threshold: float = Field(0.9, gt=0, le=1)
+    shingle_size: int = Field(3, ge=1)
+    max_shingles: Optional[int] = Field(256, ge=1)
+
+
+class AdmissionConfig(BaseModel):
+    """Per-API-key rate limits and in-flight caps enforced by ``AdmissionMiddleware``.
+
+    Rate limits are token buckets; ``None`` disables a limit. With the
+    ``sqlite`` backend, buckets and the ``max_in_flight`` count live in one
+    file shared by every worker on the host, so global limits hold across
+    uvicorn workers. Per-key in-flight caps and the fair wait queue are per
+    worker process, as is ``max_in_flight`` with the ``memory`` backend.
+    """
+
+    enabled: bool = False
+    api_key_header: str = "authorization"
+    requests_per_second: Optional[float] = Field(10.0, gt=0)
+    request_burst: Optional[float] = Field(20.0, gt=0)
+    tokens_per_minute: Optional[float] = Field(100_000.0, gt=0)
+    global_requests_per_second: Optional[float] = Field(None, gt=0)
+    global_request_burst: Optional[float] = Field(None, gt=0)
+    global_tokens_per_minute: Optional[float] = Field(None, gt=0)
+    default_max_tokens: int = Field(256, ge=0)
+    max_in_flight: int = Field(256, ge=1)
+    max_in_flight_per_key: int = Field(16, ge=1)
+    max_queue: int = Field(1024, ge=0)
+    max_queue_per_key: int = Field(64, ge=0)
+    queue_timeout: float = Field(30.0, gt=0)
+    backend: Literal["memory", "sqlite"] = "memory"
+    sqlite_path: str = "promptai-limits.sqlite3"
+    idle_ttl: float = Field(600.0, gt=0)
+    max_keys: int = Field(100_000, ge=1)
+    max_estimate_body_bytes: int = Field(1024 * 1024, ge=0)
+    token_paths: list[str] = Field(default_factory=lambda: ["/v1/completions", "/v1/embeddings"])
+    exempt_paths: list[str] = Field(
+        default_factory=lambda: [
+            "/healthz",
+            "/metrics",
+            "/upstream/",
+            "/cache/",
+            "/batching/",
+            "/admission/",
+        ]
+    )
+
+
+class JobsConfig(BaseModel):
+    """Offline batch jobs uploaded as JSONL and run in the background.
+
+    Each job lives in its own directory under ``directory`` holding the
+    uploaded input, the results and a checkpoint, so jobs interrupted by a
+    restart pick up where they stopped.
+
+    ``concurrency`` is per job; ``max_in_flight`` caps the upstream calls of
+    all jobs together in one worker process. With admission control on,
+    each line's estimated tokens are also charged to the uploader's
+    tokens-per-minute buckets before it is sent.
+    """
+
+    enabled: bool = True
+    directory: str = "promptai-jobs"
+    concurrency: int = Field(16, ge=1)
+    max_concurrency: int = Field(256, ge=1)
+    max_in_flight: int = Field(64, ge=1)
+    max_line_bytes: int = Field(1024 * 1024, ge=1)
+    checkpoint_interval: float = Field(2.0, gt=0)
+    resume_on_startup: bool = True
+
+
+class MetricsConfig(BaseModel):
+    """Latency histograms at ``/metrics`` and opt-in slow-request tracing.
+
+    With ``trace_sample_rate`` above zero, that fraction of requests records
+    a span per stage; the slowest ``slow_traces`` are served at
+    ``/metrics/traces`` and, with ``trace_dump_path`` set, written there on
+    shutdown.
+    """
+
+    enabled: bool = True
+    trace_sample_rate: float = Field(0.0, ge=0, le=1)
+    slow_traces: int = Field(20, ge=1)
+    trace_dump_path: Optional[str] = None
+
+
+class Settings(BaseModel):
+    """Top-level service settings."""
+
+    providers: list[ProviderConfig] = Field(default_factory=list)
+    default_provider: Optional[str] = None
+    cache: CacheConfig = Field(default_factory=CacheConfig)
+    admission: AdmissionConfig = Field(default_factory=AdmissionConfig)
+    jobs: JobsConfig = Field(default_factory=JobsConfig)
+    metrics: MetricsConfig = Field(default_factory=MetricsConfig)
+
+    @model_validator(mode="after")
+    def _check_providers(self) -> "Settings":
+        names = [p.name for p in self.providers]
+        if len(set(names)) != len(names):
+            raise ValueError("provider names must be unique")
+        if self.default_provider is None and self.providers:
+            self.default_provider = self.providers[0].name
+        if self.default_provider is not None and self.default_provider not in names:
+            raise ValueError(f"unknown default provider {self.default_provider!r}")
+        return self
+
+    @classmethod
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> "Settings":
+        """Build settings from the environment.
+
+        ``PROMPTAI_CONFIG`` may point to a JSON file holding the whole settings
+        document; otherwise a single provider is described by
+        ``PROMPTAI_UPSTREAM_URL`` and friends.
+        """
+        if environ is None:
+            _load_dotenv()
+            environ = os.environ
+        env = _Env(environ)
+
+        config_path = env.get("CONFIG")
+        if config_path:
+            return cls.model_validate(json.loads(Path(config_path).read_text("utf-8")))
+
+        data: dict = {}
+        base_url = env.get("UPSTREAM_URL")
+        if base_url:
+            data["providers"] = [
+                {
+                    "name": env.get("UPSTREAM_NAME", "default"),
+                    "base_url": base_url,
+                    "api_key": env.get("UPSTREAM_API_KEY"),
+                    "completions_path": env.get("UPSTREAM_COMPLETIONS_PATH", "/v1/completions"),
+                    "pool": {
+                        "max_connections": env.get_int("MAX_CONNECTIONS", 100),
+                        "max_keepalive_connections": env.get_int("MAX_KEEPALIVE", 20),
+                        "keepalive_expiry": env.get_float("KEEPALIVE_EXPIRY", 30.0),
+                        "http2": env.get_bool("HTTP2", False),
+                    },
+                    "batching": {
+                        "enabled": env.get_bool("BATCHING", False),
+                        "max_batch_size": env.get_int("BATCH_MAX_SIZE", 16),
+                        "max_wait_ms": env.get_float("BATCH_MAX_WAIT_MS", 5.0),
+                    },
+                }
+            ]
+        data["cache"] = {
+            "enabled": env.get_bool("CACHE_ENABLED", True),
+            "backend": env.get("CACHE_BACKEND", "memory"),
+            "ttl": env.get_float("CACHE_TTL", 3600.0),
+            "max_entries": env.get_int("CACHE_MAX_ENTRIES", 10_000),
+            "max_bytes": env.get_int("CACHE_MAX_BYTES", 256 * 1024 * 1024),
+            "sqlite_path": env.get("CACHE_PATH", "promptai-cache.sqlite3"),
+            "near_duplicate": env.get_bool("CACHE_NEAR_DUPLICATE", False),
+            "near_duplicate_threshold": env.get_float("CACHE_NEAR_DUPLICATE_THRESHOLD", 0.9),
+        }
+        data["admission"] = {
+            "enabled": env.get_bool("ADMISSION", False),
+            "requests_per_second": env.get_float("RATE_LIMIT_RPS", 10.0),
+            "request_burst": env.get_float("RATE_LIMIT_BURST", 20.0),
+            "tokens_per_minute": env.get_float("RATE_LIMIT_TPM", 100_000.0),
+            "max_in_flight": env.get_int("MAX_IN_FLIGHT", 256),
+            "max_in_flight_per_key": env.get_int("MAX_IN_FLIGHT_PER_KEY", 16),
+            "backend": env.get("LIMITER_BACKEND", "memory"),
+            "sqlite_path": env.get("LIMITER_PATH", "promptai-limits.sqlite3"),
+        }
+        data["jobs"] = {
+            "enabled": env.get_bool("JOBS_ENABLED", True),
+            "directory": env.get("JOBS_DIR", "promptai-jobs"),
+            "concurrency": env.get_int("JOBS_CONCURRENCY", 16),
+            "max_in_flight": env.get_int("JOBS_MAX_IN_FLIGHT", 64),
+            "resume_on_startup": env.get_bool("JOBS_RESUME", True),
+        }
+        data["metrics"] = {
+            "enabled": env.get_bool("METRICS", True),
+            "trace_sample_rate": env.get_float("TRACE_SAMPLE_RATE", 0.0),
+            "slow_traces": env.get_int("SLOW_TRACES", 20),
+            "trace_dump_path": env.get("TRACE_DUMP_PATH"),
+        }
+        return cls.model_validate(data)
+
+
+class _Env:
+    """Typed accessors over ``PROMPTAI_``-prefixed variables."""
+
+    def __init__(self, environ: Mapping[str, str]) -> None:
+        self._environ = environ
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        return self._environ.get(ENV_PREFIX + name, default)
+
+    def get_int(self, name: str, default: int) -> int:
+        value = self.get(name)
+        return default if value in (None, "") else int(value)
+
+    def get_float(self, name: str, default: float) -> float:
+        value = self.get(name)
+        return default if value in (None, "") else float(value)
+
+    def get_bool(self, name: str, default: bool) -> bool:
+        value = self.get(name)
+        if value in (None, ""):
+            return default
+        return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _load_dotenv() -> None:
+    try:
+        from dotenv import load_dotenv
+    except ImportError:  # python-dotenv is optional
+        return
+    load_dotenv()
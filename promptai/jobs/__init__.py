@@ -0,0 +1,19 @@
+"""Offline batch jobs: JSONL uploads of completion requests run in the background."""
+
+from promptai.jobs.manager import JobManager
+from promptai.jobs.records import Checkpoint, JobLock, JobRecord, JobStatus, JobStore
+from promptai.jobs.runner import Job
+from promptai.jobs.upload import Upload, UploadError, receive_upload
+
+__all__ = [
+    "Checkpoint",
+    "Job",
+    "JobLock",
+    "JobManager",
+    "JobRecord",
+    "JobStatus",
+    "JobStore",
+    "Upload",
+    "UploadError",
+    "receive_upload",
+]
@@ -0,0 +1,233 @@
+"""The batch jobs in the shared jobs directory and the ones this process runs."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import shutil
+import time
+from typing import Any, Optional
+
+import anyio.to_thread
+from starlette.requests import Request
+
+from promptai.admission import AdmissionController
+from promptai.batching import UpstreamBatcher
+from promptai.cache import ResponseCache
+from promptai.config import JobsConfig
+from promptai.jobs.records import JobRecord, JobStatus, JobStore, is_job_id, new_job_id
+from promptai.jobs.runner import Job
+from promptai.jobs.upload import UploadError, receive_upload
+from promptai.schemas import CompletionRequest
+from promptai.upstream import UpstreamRegistry
+
+logger = logging.getLogger(__name__)
+
+_RESUMABLE = (JobStatus.QUEUED, JobStatus.RUNNING, JobStatus.PAUSED)
+_UNFINISHED = (*_RESUMABLE, JobStatus.FAILED, JobStatus.CANCELLED)
+# Upload options that configure the job; everything else is a per-line default.
+_JOB_OPTIONS = ("concurrency", "defaults")
+
+
+class JobManager:
+    """Creates, runs, cancels and resumes jobs stored under ``config.directory``.
+
+    Jobs left running or paused by a previous process are resumed by
+    ``start`` when ``config.resume_on_startup`` is set; ``aclose`` pauses
+    running jobs at a checkpoint.
+
+    Several worker processes may share the directory. A job runs only in the
+    process holding its ``JobLock``; the others skip it. Jobs this process
+    is not running are read from disk on each lookup, so any worker can
+    report on, download, resume or cancel-check any job.
+    """
+
+    def __init__(
+        self,
+        config: JobsConfig,
+        registry: UpstreamRegistry,
+        *,
+        cache: Optional[ResponseCache] = None,
+        batchers: Optional[dict[str, UpstreamBatcher]] = None,
+        admission: Optional[AdmissionController] = None,
+    ) -> None:
+        self.config = config
+        self.registry = registry
+        self.cache = cache
+        self.batchers = batchers or {}
+        self.admission = admission
+        # Upstream calls in flight across every job this process runs.
+        self.in_flight = asyncio.Semaphore(config.max_in_flight)
+        self.store = JobStore(config.directory)
+        self._jobs: dict[str, Job] = {}
+
+    def _job(self, record: JobRecord) -> Job:
+        job = Job(
+            record,
+            self.store,
+            self.config,
+            self.registry,
+            cache=self.cache,
+            batchers=self.batchers,
+            in_flight=self.in_flight,
+            admission=self.admission,
+        )
+        self._jobs[record.id] = job
+        return job
+
+    async def start(self) -> None:
+        await self.refresh()
+        if not self.config.resume_on_startup:
+            return
+        for job in self.jobs():
+            if job.record.status not in _RESUMABLE:
+                continue
+            resumed = await self._launch(job.id, _RESUMABLE)
+            if resumed is not None:
+                logger.info(
+                    "resuming batch job %s at line %d", job.id, resumed.record.checkpoint.line
+                )
+
+    async def refresh(self) -> None:
+        """Reload every job this process is not running from disk."""
+        for record in await anyio.to_thread.run_sync(self.store.load_all):
+            current = self._jobs.get(record.id)
+            if current is None or not current.running:
+                self._job(record)
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        if not is_job_id(job_id):
+            return None
+        job = self._jobs.get(job_id)
+        if job is not None and job.running:
+            return job
+        record = await anyio.to_thread.run_sync(self.store.load, job_id)
+        return self._job(record) if record is not None else job
+
+    def jobs(self) -> list[Job]:
+        return sorted(self._jobs.values(), key=lambda job: job.record.created_at)
+
+    async def create(self, request: Request) -> Job:
+        """Store an uploaded JSONL file as a new job and start it.
+
+        Raises ``UploadError`` for a malformed upload or bad options.
+        """
+        job_id = new_job_id()
+        await anyio.to_thread.run_sync(self.store.create, job_id)
+        try:
+            upload = await receive_upload(request, self.store.input_path(job_id))
+            concurrency, defaults = self._options(upload.options)
+        except BaseException:
+            await anyio.to_thread.run_sync(shutil.rmtree, self.store.directory(job_id), True)
+            raise
+        record = JobRecord(
+            id=job_id,
+            total_lines=upload.lines,
+            input_bytes=upload.bytes,
+            concurrency=concurrency,
+            defaults=defaults,
+            tenant=self.admission.tenant_for(request.headers) if self.admission else None,
+        )
+        job = self._job(record)
+        await job.save()
+        return await self._launch(job_id, (JobStatus.QUEUED,)) or job
+
+    def _options(self, options: dict[str, str]) -> tuple[int, dict[str, Any]]:
+        try:
+            concurrency = int(options.get("concurrency", self.config.concurrency))
+        except ValueError:
+            raise UploadError("concurrency must be an integer", status_code=422) from None
+        if not 1 <= concurrency <= self.config.max_concurrency:
+            raise UploadError(
+                f"concurrency must be between 1 and {self.config.max_concurrency}",
+                status_code=422,
+            )
+        defaults: dict[str, Any] = {}
+        if "defaults" in options:
+            try:
+                defaults = json.loads(options["defaults"])
+            except ValueError:
+                defaults = None  # type: ignore[assignment]
+            if not isinstance(defaults, dict):
+                raise UploadError("defaults must be a JSON object", status_code=422)
+        defaults.update((k, v) for k, v in options.items() if k not in _JOB_OPTIONS)
+        unknown = sorted(set(defaults) - set(CompletionRequest.model_fields))
+        if unknown:
+            raise UploadError(f"unknown request fields: {', '.join(unknown)}", status_code=422)
+        return concurrency, defaults
+
+    async def _launch(self, job_id: str, statuses: tuple[JobStatus, ...]) -> Optional[Job]:
+        """Run the job if no other process is and, once locked, its status is in ``statuses``.
+
+        The record is re-read under the lock: another worker may have
+        finished or cancelled the job since this process last looked.
+        """
+        current = self._jobs.get(job_id)
+        if current is not None and current.running:
+            return None
+        lock = self.store.lock(job_id)
+        if not lock.acquire():
+            return None
+        try:
+            record = await anyio.to_thread.run_sync(self.store.load, job_id)
+        except BaseException:
+            lock.release()
+            raise
+        if record is None or record.status not in statuses:
+            lock.release()
+            if record is not None:
+                self._job(record)
+            return None
+        job = self._job(record)
+        job.task = asyncio.ensure_future(job.run())
+        job.task.add_done_callback(_log_crash)
+        job.task.add_done_callback(lambda _: lock.release())
+        return job
+
+    async def cancel(self, job: Job) -> Optional[Job]:
+        """Stop an unfinished job, keeping its progress; it can be resumed later.
+
+        Returns the job as cancelled, or None if another worker process is
+        running it.
+        """
+        if job.running:
+            assert job.task is not None
+            job.cancel_requested = True
+            job.task.cancel()
+            await asyncio.gather(job.task, return_exceptions=True)
+            return job
+        lock = self.store.lock(job.id)
+        if not lock.acquire():
+            return None
+        try:
+            record = await anyio.to_thread.run_sync(self.store.load, job.id)
+            if record is None:
+                return job
+            if record.status in _RESUMABLE:
+                # Queued, paused, or left running by a process that died.
+                record.status = JobStatus.CANCELLED
+                record.finished_at = time.time()
+                await anyio.to_thread.run_sync(self.store.save, record)
+            return self._job(record)
+        finally:
+            lock.release()
+
+    async def resume(self, job: Job) -> Optional[Job]:
+        """Restart a stopped, unfinished job; returns None if there is nothing to do.
+
+        That includes a job another worker process is running.
+        """
+        return await self._launch(job.id, _UNFINISHED)
+
+    async def aclose(self) -> None:
+        running = [job.task for job in self._jobs.values() if job.running]
+        for task in running:
+            task.cancel()  # type: ignore[union-attr]
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+def _log_crash(task: asyncio.Task[None]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("batch job task crashed", exc_info=task.exception())
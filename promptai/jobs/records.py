@@ -0,0 +1,197 @@
+"""Persistent job state: one directory per job holding input, output and checkpoint."""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import secrets
+import sys
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from pydantic import BaseModel, Field
+
+if sys.platform == "win32":
+    import msvcrt
+
+    def _lock_fd(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+    def _unlock_fd(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+    import fcntl
+
+    def _lock_fd(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock_fd(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+INPUT_FILE = "input.jsonl"
+OUTPUT_FILE = "output.jsonl"
+STATE_FILE = "state.json"
+LOCK_FILE = "lock"
+
+logger = logging.getLogger(__name__)
+
+_JOB_ID = re.compile(r"^batch_[0-9a-f]{16}$")
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    PAUSED = "paused"  # interrupted by a shutdown; resumed on the next start
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class Checkpoint(BaseModel):
+    """How far a job got, consistent with the first ``output_bytes`` of its results.
+
+    Lines complete out of order, so progress is a low-water mark (every line
+    before ``line`` is done, and ``line`` starts at byte ``offset`` of the
+    input) plus the few lines past it that are already done.
+    """
+
+    line: int = 0
+    offset: int = 0
+    done: list[int] = Field(default_factory=list)
+    output_bytes: int = 0
+    succeeded: int = 0
+    failed: int = 0
+
+
+class JobRecord(BaseModel):
+    id: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = Field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    total_lines: int = 0
+    input_bytes: int = 0
+    concurrency: int = 16
+    defaults: dict[str, Any] = Field(default_factory=dict)
+    tenant: Optional[str] = None  # admission-control tenant of the uploader
+    error: Optional[str] = None
+    checkpoint: Checkpoint = Field(default_factory=Checkpoint)
+
+
+def new_job_id() -> str:
+    return f"batch_{secrets.token_hex(8)}"
+
+
+def is_job_id(value: str) -> bool:
+    return _JOB_ID.match(value) is not None
+
+
+class JobLock:
+    """Exclusive lock on a job directory, held by the process running the job.
+
+    Every worker sharing the jobs directory takes it before running a job,
+    so a job runs in one process at a time. It is an OS file lock, released
+    when the process exits however it dies.
+    """
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Take the lock without waiting; False if another holder has it."""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            _lock_fd(fd)
+        except OSError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            try:
+                _unlock_fd(fd)
+            finally:
+                os.close(fd)
+
+    def held_elsewhere(self) -> bool:
+        if self._fd is not None:
+            return False
+        if not self.acquire():
+            return True
+        self.release()
+        return False
+
+
+class JobStore:
+    """Job directories under ``root``; records are replaced atomically on save."""
+
+    def __init__(self, root: Union[str, Path]) -> None:
+        self.root = Path(root)
+
+    def directory(self, job_id: str) -> Path:
+        return self.root / job_id
+
+    def input_path(self, job_id: str) -> Path:
+        return self.root / job_id / INPUT_FILE
+
+    def output_path(self, job_id: str) -> Path:
+        return self.root / job_id / OUTPUT_FILE
+
+    def lock(self, job_id: str) -> JobLock:
+        return JobLock(self.root / job_id / LOCK_FILE)
+
+    def create(self, job_id: str) -> Path:
+        path = self.directory(job_id)
+        path.mkdir(parents=True)
+        return path
+
+    def save(self, record: JobRecord) -> None:
+        path = self.directory(record.id) / STATE_FILE
+        # A temporary name per writer, so processes saving the same job never
+        # replace each other's half-written file.
+        tmp = path.with_name(f"{STATE_FILE}.{os.getpid()}-{secrets.token_hex(4)}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(record.model_dump_json())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    def load(self, job_id: str) -> Optional[JobRecord]:
+        path = self.directory(job_id) / STATE_FILE
+        try:
+            return JobRecord.model_validate_json(path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except ValueError as exc:
+            logger.warning("skipping unreadable job state %s: %s", path, exc)
+            return None
+
+    def load_all(self) -> list[JobRecord]:
+        if not self.root.is_dir():
+            return []
+        records = []
+        for path in sorted(self.root.glob(f"batch_*/{STATE_FILE}")):
+            try:
+                records.append(JobRecord.model_validate_json(path.read_bytes()))
+            except ValueError as exc:
+                logger.warning("skipping unreadable job state %s: %s", path, exc)
+        return records
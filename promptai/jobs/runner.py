@@ -0,0 +1,365 @@
+"""Running batch jobs: a bounded worker pool over a JSONL file of completion requests.
+
+Each input line is a ``CompletionRequest`` body (merged over the job's
+``defaults``), optionally with a ``custom_id`` echoed back in its result.
+One reader streams lines off disk into a small queue and ``concurrency``
+workers call upstream through the shared clients, cache and batchers. Calls
+are also bounded by a semaphore shared by every job in the process and, when
+admission control is on, paced by the uploader's tokens-per-minute buckets.
+Each result is appended to the output as soon as it arrives, tagged with
+its input line number, so results are in completion order rather than
+input order.
+
+Memory stays constant however large the input: the reader holds a bounded
+window of lines between the oldest unfinished one and the newest read, and
+nothing else grows with the input. The window is also what the checkpoint
+records, so a resumed job skips exactly the lines whose results are already
+in the output.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, BinaryIO, Optional, TypeAlias
+
+import anyio.to_thread
+from pydantic import ValidationError
+
+from promptai.admission import AdmissionController
+from promptai.batching import UpstreamBatcher
+from promptai.cache import ResponseCache
+from promptai.completions import complete
+from promptai.config import JobsConfig
+from promptai.jobs.records import Checkpoint, JobRecord, JobStatus, JobStore
+from promptai.metrics.tracing import detach_trace
+from promptai.schemas import CompletionRequest
+from promptai.templates import TemplateError
+from promptai.upstream import UpstreamError, UpstreamRegistry
+
+logger = logging.getLogger(__name__)
+
+# Lines read off disk per thread hop.
+_READ_BATCH = 256
+# Lines the reader may run ahead of the oldest unfinished one, per worker.
+_WINDOW_PER_WORKER = 32
+
+
+class _Line:
+    __slots__ = ("number", "end", "done")
+
+    def __init__(self, number: int, end: int) -> None:
+        self.number = number
+        self.end = end
+        self.done = False
+
+
+# Lines handed from the reader to the workers; ``None`` tells a worker to stop.
+_LineQueue: TypeAlias = "asyncio.Queue[Optional[tuple[_Line, Optional[bytes]]]]"
+
+
+class _Watermark:
+    """Low-water mark over lines that finish out of order.
+
+    Lines are added in input order with the byte offset just past them;
+    ``line``/``offset`` advance over the finished prefix and each line
+    advanced over frees one slot of the reader's window.
+    """
+
+    def __init__(self, line: int, offset: int, window: asyncio.Semaphore) -> None:
+        self.line = line
+        self.offset = offset
+        self._window = window
+        self._pending: deque[_Line] = deque()
+
+    def add(self, number: int, end: int) -> _Line:
+        entry = _Line(number, end)
+        self._pending.append(entry)
+        return entry
+
+    def finish(self, entry: _Line) -> None:
+        entry.done = True
+        pending = self._pending
+        while pending and pending[0].done:
+            head = pending.popleft()
+            self.line = head.number + 1
+            self.offset = head.end
+            self._window.release()
+
+    def done_ahead(self) -> list[int]:
+        return [entry.number for entry in self._pending if entry.done]
+
+
+class Job:
+    """One job: its persisted record plus, while running, the live progress."""
+
+    def __init__(
+        self,
+        record: JobRecord,
+        store: JobStore,
+        config: JobsConfig,
+        registry: UpstreamRegistry,
+        *,
+        cache: Optional[ResponseCache] = None,
+        batchers: Optional[dict[str, UpstreamBatcher]] = None,
+        in_flight: Optional[asyncio.Semaphore] = None,
+        admission: Optional[AdmissionController] = None,
+    ) -> None:
+        self.record = record
+        self.store = store
+        self.config = config
+        self.registry = registry
+        self.cache = cache
+        self.batchers = batchers or {}
+        self.in_flight = in_flight or asyncio.Semaphore(config.max_in_flight)
+        self.admission = admission
+        self.task: Optional[asyncio.Task[None]] = None
+        self.cancel_requested = False
+        self._watermark: Optional[_Watermark] = None
+        self._out: Optional[BinaryIO] = None
+        self._output_bytes = record.checkpoint.output_bytes
+        self._succeeded = record.checkpoint.succeeded
+        self._failed = record.checkpoint.failed
+        self._processed = record.checkpoint.line + len(record.checkpoint.done)
+        self._run_started = 0.0
+        self._run_processed = 0
+
+    @property
+    def id(self) -> str:
+        return self.record.id
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def flush(self) -> int:
+        """Flush buffered results; returns the size of the output up to its last whole line."""
+        if self._out is not None:
+            self._out.flush()
+        return self._output_bytes
+
+    def progress(self) -> dict[str, Any]:
+        total = self.record.total_lines
+        processed = self._processed
+        rate = 0.0
+        elapsed = time.monotonic() - self._run_started if self._run_started else 0.0
+        if self.running and elapsed > 0:
+            rate = self._run_processed / elapsed
+        remaining = max(0, total - processed)
+        return {
+            "total_lines": total,
+            "processed_lines": processed,
+            "succeeded": self._succeeded,
+            "failed": self._failed,
+            "percent": 100.0 * processed / total if total else 100.0,
+            "lines_per_second": rate,
+            "eta_seconds": remaining / rate if rate else None,
+            "output_bytes": self._output_bytes,
+        }
+
+    def describe(self) -> dict[str, Any]:
+        return {
+            **self.record.model_dump(mode="json", exclude={"checkpoint", "tenant"}),
+            "progress": self.progress(),
+        }
+
+    async def save(self) -> None:
+        await anyio.to_thread.run_sync(self.store.save, self.record)
+
+    def _snapshot(self) -> None:
+        # Synchronous, so it sees results and watermark from the same instant.
+        watermark = self._watermark
+        if watermark is None:
+            return
+        if self._out is not None:
+            self._out.flush()
+        self.record.checkpoint = Checkpoint(
+            line=watermark.line,
+            offset=watermark.offset,
+            done=watermark.done_ahead(),
+            output_bytes=self._output_bytes,
+            succeeded=self._succeeded,
+            failed=self._failed,
+        )
+
+    async def run(self) -> None:
+        # Launched from the upload (or resume) request, whose trace this task
+        # inherited; the job outlives it and must not grow it line by line.
+        detach_trace()
+        record = self.record
+        record.status = JobStatus.RUNNING
+        record.started_at = record.started_at or time.time()
+        record.finished_at = None
+        record.error = None
+        self.cancel_requested = False
+        await self.save()
+
+        checkpoint = record.checkpoint
+        output_path = self.store.output_path(self.id)
+        self._out = await anyio.to_thread.run_sync(
+            _open_output, output_path, checkpoint.output_bytes
+        )
+        window = asyncio.Semaphore(record.concurrency * _WINDOW_PER_WORKER)
+        self._watermark = _Watermark(checkpoint.line, checkpoint.offset, window)
+        self._run_started = time.monotonic()
+        self._run_processed = 0
+        queue: _LineQueue = asyncio.Queue(record.concurrency)
+
+        tasks = [asyncio.ensure_future(self._read(queue, window, set(checkpoint.done)))]
+        tasks += [asyncio.ensure_future(self._work(queue)) for _ in range(record.concurrency)]
+        checkpointer = asyncio.ensure_future(self._checkpoint_periodically())
+        try:
+            await asyncio.gather(*tasks)
+            record.status = JobStatus.COMPLETED
+        except asyncio.CancelledError:
+            record.status = JobStatus.CANCELLED if self.cancel_requested else JobStatus.PAUSED
+            raise
+        except Exception as exc:
+            logger.exception("batch job %s failed", self.id)
+            record.status = JobStatus.FAILED
+            record.error = repr(exc)
+        finally:
+            for task in [*tasks, checkpointer]:
+                task.cancel()
+            await asyncio.gather(*tasks, checkpointer, return_exceptions=True)
+            self._snapshot()
+            self._out.close()
+            self._out = None
+            if record.status is not JobStatus.PAUSED:
+                record.finished_at = time.time()
+            await self.save()
+            logger.info("batch job %s %s: %s", self.id, record.status.value, self.progress())
+
+    async def _checkpoint_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.checkpoint_interval)
+            self._snapshot()
+            await self.save()
+
+    async def _read(
+        self,
+        queue: _LineQueue,
+        window: asyncio.Semaphore,
+        already_done: set[int],
+    ) -> None:
+        watermark = self._watermark
+        assert watermark is not None
+        path = self.store.input_path(self.id)
+        number = watermark.line
+        with open(path, "rb") as f:
+            f.seek(watermark.offset)
+            while True:
+                lines = await anyio.to_thread.run_sync(
+                    _read_lines, f, _READ_BATCH, self.config.max_line_bytes
+                )
+                if not lines:
+                    break
+                for raw, end in lines:
+                    await window.acquire()
+                    entry = watermark.add(number, end)
+                    number += 1
+                    if entry.number in already_done:
+                        watermark.finish(entry)
+                    elif raw is not None and not raw.strip():
+                        self._finished(entry)  # blank lines produce no result
+                    else:
+                        await queue.put((entry, raw))
+        for _ in range(self.record.concurrency):
+            await queue.put(None)
+
+    async def _work(self, queue: _LineQueue) -> None:
+        assert self._out is not None
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            entry, raw = item
+            result = await self._process(entry.number, raw)
+            if "error" in result:
+                self._failed += 1
+            else:
+                self._succeeded += 1
+            data = json.dumps(result, separators=(",", ":")).encode("utf-8") + b"\n"
+            self._out.write(data)
+            self._output_bytes += len(data)
+            self._finished(entry)
+
+    def _finished(self, entry: _Line) -> None:
+        self._processed += 1
+        self._run_processed += 1
+        assert self._watermark is not None
+        self._watermark.finish(entry)
+
+    async def _process(self, number: int, raw: Optional[bytes]) -> dict[str, Any]:
+        result: dict[str, Any] = {"line": number}
+        try:
+            if raw is None:
+                raise ValueError(f"line is longer than {self.config.max_line_bytes} bytes")
+            data = json.loads(raw)
+            if not isinstance(data, dict):
+                raise ValueError("line is not a JSON object")
+            custom_id = data.pop("custom_id", None)
+            if custom_id is not None:
+                result["custom_id"] = custom_id
+            data = {**self.record.defaults, **data}
+            body = CompletionRequest.model_validate(data)
+            body.stream = False
+            prompt = body.render_prompt()
+            client = self.registry.for_model(body.model, body.provider)
+            if self.admission is not None and self.record.tenant is not None:
+                tokens = self.admission.estimate_request_tokens(data)
+                await self.admission.charge_tokens(self.record.tenant, tokens)
+            async with self.in_flight:
+                content, _ = await complete(
+                    body, prompt, client, cache=self.cache, batcher=self.batchers.get(client.name)
+                )
+            result["response"] = json.loads(content)
+        except UpstreamError as exc:
+            result["error"] = {
+                "type": "upstream_error",
+                "status_code": exc.status_code,
+                "message": str(exc),
+            }
+        except ValidationError as exc:
+            result["error"] = {
+                "type": "invalid_request",
+                "message": exc.errors(include_url=False, include_context=False),
+            }
+        except (ValueError, KeyError, TemplateError) as exc:
+            message = exc.args[0] if isinstance(exc, KeyError) else str(exc)
+            result["error"] = {"type": "invalid_request", "message": message}
+        except Exception as exc:
+            # Anything else is still this line's failure; one bad line must not
+            # fail a job of millions.
+            logger.warning("batch job %s line %d failed", self.id, number, exc_info=True)
+            result["error"] = {"type": "internal_error", "message": repr(exc)}
+        return result
+
+
+def _open_output(path: Any, size: int) -> BinaryIO:
+    """Open the results for appending, dropping anything written after the checkpoint."""
+    f = open(path, "ab")
+    f.truncate(size)
+    return f
+
+
+def _read_lines(f: BinaryIO, count: int, limit: int) -> list[tuple[Optional[bytes], int]]:
+    """Up to ``count`` lines with the offset just past each; over-long lines read as ``None``."""
+    lines: list[tuple[Optional[bytes], int]] = []
+    offset = f.tell()
+    for _ in range(count):
+        raw: Optional[bytes] = f.readline(limit + 1)
+        if not raw:
+            break
+        offset += len(raw)
+        if len(raw) > limit and not raw.endswith(b"\n"):
+            # Skip the rest of the line without holding it.
+            while raw and not raw.endswith(b"\n"):
+                raw = f.readline(64 * 1024)
+                offset += len(raw)
+            raw = None
+        lines.append((raw, offset))
+    return lines
@@ -0,0 +1,190 @@
+"""Streaming JSONL uploads.
+
+The request body is written to disk chunk by chunk as it arrives, so an
+upload of any size costs one network chunk of memory. Two encodings are
+accepted: ``multipart/form-data`` with the JSONL in a ``file`` part (parsed
+incrementally with python-multipart) and a bare JSONL body. Small form
+fields, or query parameters for a bare body, carry the job options.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import anyio
+from starlette.requests import Request
+
+try:
+    try:
+        import python_multipart as multipart
+        from python_multipart.multipart import parse_options_header
+    except ModuleNotFoundError:  # python-multipart < 0.0.13
+        import multipart  # type: ignore[no-redef]
+        from multipart.multipart import parse_options_header  # type: ignore[no-redef]
+except ModuleNotFoundError:  # pragma: no cover - python-multipart is optional
+    multipart = None
+    parse_options_header = None
+
+JSONL_MEDIA_TYPES = frozenset(
+    ["application/jsonl", "application/x-ndjson", "application/x-jsonlines", "text/plain"]
+)
+FILE_FIELD = "file"
+
+
+class UploadError(Exception):
+    """The upload was refused; ``status_code`` is the HTTP status to answer with."""
+
+    def __init__(self, reason: str, status_code: int = 400) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+
+
+@dataclass
+class Upload:
+    """What was received: byte and line counts of the stored file, and the options."""
+
+    bytes: int = 0
+    lines: int = 0
+    options: dict[str, str] = field(default_factory=dict)
+
+
+class _LineCounter:
+    __slots__ = ("bytes", "newlines", "last")
+
+    def __init__(self) -> None:
+        self.bytes = 0
+        self.newlines = 0
+        self.last = b"\n"
+
+    def update(self, data: bytes) -> None:
+        if data:
+            self.bytes += len(data)
+            self.newlines += data.count(b"\n")
+            self.last = data[-1:]
+
+    @property
+    def lines(self) -> int:
+        # A final line without a trailing newline still counts.
+        return self.newlines + (self.last != b"\n")
+
+
+async def receive_upload(
+    request: Request, destination: Path, *, max_field_bytes: int = 64 * 1024
+) -> Upload:
+    """Store the uploaded JSONL at ``destination`` and return its counts and options."""
+    content_type = request.headers.get("content-type", "")
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type == "multipart/form-data":
+        return await _receive_multipart(request, content_type, destination, max_field_bytes)
+    if media_type in JSONL_MEDIA_TYPES or not media_type:
+        counter = _LineCounter()
+        async with await anyio.open_file(destination, "wb") as f:
+            async for chunk in request.stream():
+                counter.update(chunk)
+                await f.write(chunk)
+        return Upload(counter.bytes, counter.lines, dict(request.query_params))
+    raise UploadError(f"unsupported content type {media_type!r}", status_code=415)
+
+
+class _FormReader:
+    """python-multipart callbacks collecting the file part's data and small fields."""
+
+    def __init__(self, max_field_bytes: int) -> None:
+        self.max_field_bytes = max_field_bytes
+        self.fields: dict[str, str] = {}
+        self.file_chunks: list[bytes] = []
+        self.seen_file = False
+        self._header_field = bytearray()
+        self._header_value = bytearray()
+        self._disposition = b""
+        self._name: Optional[str] = None
+        self._in_file = False
+        self._value = bytearray()
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._name = None
+        self._in_file = False
+        self._value.clear()
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = bytes(self._header_value)
+        self._header_field.clear()
+        self._header_value.clear()
+
+    def on_headers_finished(self) -> None:
+        _, params = parse_options_header(self._disposition)
+        name = params.get(b"name", b"").decode("latin-1")
+        if name == FILE_FIELD:
+            if self.seen_file:
+                raise UploadError(f"more than one {FILE_FIELD!r} part")
+            self.seen_file = self._in_file = True
+        else:
+            self._name = name
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file:
+            self.file_chunks.append(data[start:end])
+        elif self._name:
+            self._value += data[start:end]
+            if len(self._value) > self.max_field_bytes:
+                raise UploadError(f"form field {self._name!r} is too large", status_code=413)
+
+    def on_part_end(self) -> None:
+        if self._name:
+            self.fields[self._name] = self._value.decode("utf-8", errors="replace")
+        self._in_file = False
+        self._name = None
+
+
+async def _receive_multipart(
+    request: Request, content_type: str, destination: Path, max_field_bytes: int
+) -> Upload:
+    if multipart is None:
+        raise UploadError(
+            "multipart uploads need python-multipart; send the JSONL as the request body",
+            status_code=415,
+        )
+    _, params = parse_options_header(content_type)
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise UploadError("multipart body without a boundary")
+    reader = _FormReader(max_field_bytes)
+    parser = multipart.MultipartParser(boundary, reader.callbacks())
+    counter = _LineCounter()
+    async with await anyio.open_file(destination, "wb") as f:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except multipart.exceptions.MultipartParseError as exc:
+                raise UploadError(f"malformed multipart body: {exc}") from None
+            if reader.file_chunks:
+                data = b"".join(reader.file_chunks)
+                reader.file_chunks.clear()
+                counter.update(data)
+                await f.write(data)
+        parser.finalize()
+    if not reader.seen_file:
+        raise UploadError(f"multipart body has no {FILE_FIELD!r} part")
+    return Upload(counter.bytes, counter.lines, {**request.query_params, **reader.fields})
@@ -0,0 +1,31 @@
+"""Latency histograms, request-stage timing and sampled slow-request traces."""
+
+from promptai.metrics.middleware import MetricsMiddleware
+from promptai.metrics.registry import (
+    CONTENT_TYPE,
+    DEFAULT_BUCKETS,
+    REGISTRY,
+    Histogram,
+    HistogramSeries,
+    MetricsRegistry,
+    render_family,
+)
+from promptai.metrics.stages import UpstreamStages, UpstreamTimer
+from promptai.metrics.tracing import SlowTraceSampler, Stage, Trace, current_trace
+
+__all__ = [
+    "CONTENT_TYPE",
+    "DEFAULT_BUCKETS",
+    "Histogram",
+    "HistogramSeries",
+    "MetricsMiddleware",
+    "MetricsRegistry",
+    "REGISTRY",
+    "SlowTraceSampler",
+    "Stage",
+    "Trace",
+    "UpstreamStages",
+    "UpstreamTimer",
+    "current_trace",
+    "render_family",
+]
@@ -0,0 +1,132 @@
+"""Point-in-time gauges and counters read from the app's components at scrape time."""
+
+from __future__ import annotations
+
+from typing import Any
+
+from promptai.metrics.registry import render_family
+
+
+def render_service_metrics(state: Any) -> str:
+    """Exposition text for the components stored on ``app.state``.
+
+    Values come from each component's own ``stats()``, so nothing is counted
+    twice on the request path.
+    """
+    parts: list[str] = []
+    registry = getattr(state, "upstream", None)
+    if registry is not None:
+        pools = list(registry.stats())
+        parts.append(
+            render_family(
+                "promptai_upstream_connections",
+                "gauge",
+                "Upstream pool connections by state.",
+                ("provider", "state"),
+                [((p.provider, "in_use"), p.in_use) for p in pools]
+                + [((p.provider, "idle"), p.idle) for p in pools],
+            )
+        )
+        parts.append(
+            render_family(
+                "promptai_upstream_pool_waiters",
+                "gauge",
+                "Requests waiting for an upstream pool connection.",
+                ("provider",),
+                [((p.provider,), p.waiters) for p in pools],
+            )
+        )
+
+    cache = getattr(state, "cache", None)
+    if cache is not None:
+        stats = cache.stats()
+        parts.append(
+            render_family(
+                "promptai_cache_lookups_total",
+                "counter",
+                "Response cache lookups by outcome.",
+                ("outcome",),
+                [
+                    (("hit",), stats["hits"]),
+                    (("near_hit",), stats["near_hits"]),
+                    (("miss",), stats["misses"]),
+                    (("coalesced",), stats["coalesced"]),
+                ],
+            )
+        )
+        parts.append(
+            render_family(
+                "promptai_cache_entries",
+                "gauge",
+                "Entries in the response cache.",
+                (),
+                [((), stats["entries"])],
+            )
+        )
+        parts.append(
+            render_family(
+                "promptai_cache_bytes",
+                "gauge",
+                "Bytes held by the response cache.",
+                (),
+                [((), stats["bytes"])],
+            )
+        )
+
+    batchers = getattr(state, "batchers", None) or {}
+    if batchers:
+        samples = []
+        for name, batcher in batchers.items():
+            samples.append(((name, "completions"), batcher.completions.pending))
+            samples.append(((name, "embeddings"), batcher.embeddings.pending))
+        parts.append(
+            render_family(
+                "promptai_batch_pending",
+                "gauge",
+                "Calls waiting to join an upstream batch.",
+                ("provider", "kind"),
+                samples,
+            )
+        )
+
+    admission = getattr(state, "admission", None)
+    if admission is not None:
+        stats = admission.stats()
+        parts.append(
+            render_family(
+                "promptai_admission_requests_total",
+                "counter",
+                "Requests seen by admission control, by decision.",
+                ("decision",),
+                [
+                    (("admitted",), stats["admitted"]),
+                    (("rate_limited",), stats["rate_limited"]),
+                    (("queue_rejected",), stats["queue_rejected"]),
+                ],
+            )
+        )
+        parts.append(
+            render_family(
+                "promptai_admission_requests",
+                "gauge",
+                "Requests in flight or queued for admission.",
+                ("state",),
+                [(("in_flight",), stats["in_flight"]), (("queued",), stats["queued"])],
+            )
+        )
+
+    jobs = getattr(state, "jobs", None)
+    if jobs is not None:
+        counts: dict[str, int] = {}
+        for job in jobs.jobs():
+            counts[job.record.status.value] = counts.get(job.record.status.value, 0) + 1
+        parts.append(
+            render_family(
+                "promptai_batch_jobs",
+                "gauge",
+                "Batch jobs by status.",
+                ("status",),
+                [((status,), n) for status, n in sorted(counts.items())],
+            )
+        )
+    return "".join(parts)
@@ -0,0 +1,80 @@
+"""ASGI middleware timing whole requests and response writes, and sampling traces."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+from promptai.metrics.registry import HistogramSeries
+from promptai.metrics.stages import REQUEST_SECONDS, RESPONSE
+from promptai.metrics.tracing import SlowTraceSampler, attach_trace, perf_counter, reset_trace
+
+if TYPE_CHECKING:
+    from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+UNMATCHED = "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; add it last so it wraps every other middleware.
+
+    Requests are labelled by route template (``/v1/batches/{job_id}``), not
+    raw path, so label cardinality stays bounded; requests that never reach
+    a route, such as admission rejections, are labelled ``unmatched``. The
+    ``response`` stage is recorded only for single-message responses, from
+    ``http.response.start`` until the body has been handed to the server; a
+    streamed body's relay time is covered by the upstream ``total`` phase.
+    """
+
+    def __init__(self, app: ASGIApp, sampler: Optional[SlowTraceSampler] = None) -> None:
+        self.app = app
+        self.sampler = sampler
+        # route -> method -> status -> series, so the hot path allocates no label tuples.
+        self._series: dict[str, dict[str, dict[int, HistogramSeries]]] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = perf_counter()
+        status = 500
+        response_started = 0.0
+        first_body = True
+
+        async def send_timed(message: Message) -> None:
+            nonlocal status, response_started, first_body
+            kind = message["type"]
+            if kind == "http.response.start":
+                status = message["status"]
+                response_started = perf_counter()
+            elif kind == "http.response.body" and first_body:
+                first_body = False
+                if not message.get("more_body", False):
+                    await send(message)
+                    RESPONSE.since(response_started)
+                    return
+            await send(message)
+
+        trace = token = None
+        if self.sampler is not None:
+            trace = self.sampler.start(scope["method"], scope["path"])
+            if trace is not None:
+                token = attach_trace(trace)
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            route = scope.get("route")
+            self._series_for(
+                getattr(route, "path", UNMATCHED), scope["method"], status
+            ).observe(perf_counter() - started)
+            if trace is not None:
+                reset_trace(token)  # type: ignore[arg-type]
+                self.sampler.finish(trace, status)  # type: ignore[union-attr]
+
+    def _series_for(self, route: str, method: str, status: int) -> HistogramSeries:
+        try:
+            return self._series[route][method][status]
+        except KeyError:
+            series = REQUEST_SECONDS.labels(route, method, str(status))
+            self._series.setdefault(route, {}).setdefault(method, {})[status] = series
+            return series
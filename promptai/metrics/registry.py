@@ -0,0 +1,172 @@
+"""Fixed-bucket latency histograms with Prometheus text exposition.
+
+Recording is the hot path, so label values are resolved once: ``labels()``
+returns a series object that callers keep and observe into directly. An
+observation is one ``bisect`` over the bucket bounds and three additions;
+nothing is allocated. Buckets are cumulated only when the registry is
+rendered.
+
+Metrics are per process; with several uvicorn workers each exposes its own.
+"""
+
+from __future__ import annotations
+
+import math
+from bisect import bisect_left
+from typing import Iterable, Sequence
+
+# Seconds, spanning sub-millisecond local stages to slow upstream completions.
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class HistogramSeries:
+    """One label combination of a histogram; ``counts[-1]`` is the +Inf bucket."""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram:
+    """A histogram family; one ``HistogramSeries`` per combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: dict[tuple[str, ...], HistogramSeries] = {}
+
+    def labels(self, *values: str) -> HistogramSeries:
+        """The series for these label values; keep it rather than calling per observation."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            series = self._series[values] = HistogramSeries(self.buckets)
+        return series
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {_escape_help(self.help)}"
+        yield f"# TYPE {self.name} histogram"
+        bounds = [_format_value(b) for b in self.buckets] + ["+Inf"]
+        for values, series in self._series.items():
+            labels = _format_labels(self.labelnames, values)
+            prefix = labels[:-1] + "," if labels else "{"
+            cumulative = 0
+            for bound, n in zip(bounds, series.counts):
+                cumulative += n
+                yield f'{self.name}_bucket{prefix}le="{bound}"}} {cumulative}'
+            yield f"{self.name}_sum{labels} {_format_value(series.sum)}"
+            yield f"{self.name}_count{labels} {series.count}"
+
+
+class MetricsRegistry:
+    """Named histograms rendered together in the text exposition format."""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Histogram] = {}
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        *,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Register a histogram, or return the one already registered under ``name``."""
+        existing = self._metrics.get(name)
+        if existing is not None:
+            if existing.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name!r} is already registered with other labels")
+            return existing
+        metric = self._metrics[name] = Histogram(name, help, labelnames, buckets=buckets)
+        return metric
+
+    def get(self, name: str) -> Histogram:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+REGISTRY = MetricsRegistry()
+
+
+def render_family(
+    name: str,
+    kind: str,
+    help: str,
+    labelnames: Sequence[str],
+    samples: Iterable[tuple[Sequence[str], float]],
+) -> str:
+    """A gauge or counter family from values read at scrape time (pool sizes, stats, ...)."""
+    lines = [f"# HELP {name} {_escape_help(help)}", f"# TYPE {name} {kind}"]
+    labelnames = tuple(labelnames)
+    for values, value in samples:
+        lines.append(f"{name}{_format_labels(labelnames, tuple(values))} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape_label(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if not math.isfinite(value):
+        return "NaN" if math.isnan(value) else ("+Inf" if value > 0 else "-Inf")
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
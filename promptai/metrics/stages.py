@@ -0,0 +1,80 @@
+"""The histograms and stages recorded by promptai, bound once at import."""
+
+from __future__ import annotations
+
+from promptai.metrics.registry import REGISTRY
+from promptai.metrics.tracing import Stage, perf_counter
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "promptai_stage_seconds", "Time spent in each stage of request handling.", ("stage",)
+)
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    "promptai_upstream_seconds",
+    "Upstream call phases: connect, tls, ttfb (to response headers) and total.",
+    ("provider", "phase"),
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "promptai_request_seconds",
+    "Whole request latency by route, method and status code.",
+    ("route", "method", "status"),
+)
+
+
+def _stage(name: str) -> Stage:
+    return Stage(name, STAGE_SECONDS.labels(name))
+
+
+TEMPLATE_RENDER = _stage("template_render")
+CACHE_LOOKUP = _stage("cache_lookup")
+ADMISSION_RATE_LIMIT = _stage("admission_rate_limit")
+ADMISSION_QUEUE = _stage("admission_queue")
+BATCH_QUEUE = _stage("batch_queue")
+BATCH_CALL = _stage("batch_call")
+RESPONSE = _stage("response")
+
+
+class UpstreamStages:
+    """One provider's upstream phases."""
+
+    __slots__ = ("connect", "tls", "ttfb", "total")
+
+    def __init__(self, provider: str) -> None:
+        self.connect = Stage("upstream_connect", UPSTREAM_SECONDS.labels(provider, "connect"))
+        self.tls = Stage("upstream_tls", UPSTREAM_SECONDS.labels(provider, "tls"))
+        self.ttfb = Stage("upstream_ttfb", UPSTREAM_SECONDS.labels(provider, "ttfb"))
+        self.total = Stage("upstream_total", UPSTREAM_SECONDS.labels(provider, "total"))
+
+    def timer(self) -> UpstreamTimer:
+        """A fresh httpx ``trace`` extension callback for one upstream attempt."""
+        return UpstreamTimer(self)
+
+
+class UpstreamTimer:
+    """httpcore trace callback turning connection events into upstream phases.
+
+    Pass as ``extensions={"trace": timer}``. ``total`` runs from the start of
+    the attempt until httpcore closes the response, so for a relayed stream
+    it covers the whole stream. Each attempt of a retried call is timed on
+    its own. Transports that are not httpcore-based (such as
+    ``httpx.MockTransport``) emit no events and record nothing.
+    """
+
+    __slots__ = ("stages", "started", "phase_started")
+
+    def __init__(self, stages: UpstreamStages) -> None:
+        self.stages = stages
+        self.started = perf_counter()
+        self.phase_started = 0.0
+
+    async def __call__(self, event: str, info: dict) -> None:
+        if event.endswith(".started"):
+            if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+                self.phase_started = perf_counter()
+        elif event.endswith("receive_response_headers.complete"):
+            self.stages.ttfb.since(self.started)
+        elif event.endswith(("response_closed.complete", "response_closed.failed")):
+            self.stages.total.since(self.started)
+        elif event == "connection.connect_tcp.complete":
+            self.stages.connect.since(self.phase_started)
+        elif event == "connection.start_tls.complete":
+            self.stages.tls.since(self.phase_started)
@@ -0,0 +1,148 @@
+"""Timed request stages and sampled per-request traces.
+
+A ``Stage`` is a named histogram series. Code on the request path takes a
+``perf_counter()`` timestamp and hands it to ``stage.since(started)`` when
+the stage ends, which records the duration and, if the current request is
+being traced, appends a span to its trace.
+
+Tracing is opt-in and sampled: ``SlowTraceSampler`` picks requests at
+``sample_rate``, and the middleware attaches a ``Trace`` to the request's
+context. The sampler keeps only the slowest ``keep`` traces in a min-heap,
+so it stays bounded however long the process runs.
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import random
+import time
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Optional, Union
+
+from promptai.metrics.registry import HistogramSeries
+
+perf_counter = time.perf_counter
+
+_current: ContextVar[Optional[Trace]] = ContextVar("promptai_trace", default=None)
+
+
+class Trace:
+    """Spans recorded for one sampled request, as ``(name, offset, duration)`` seconds."""
+
+    __slots__ = ("method", "path", "started", "wall_time", "duration", "status", "spans")
+
+    def __init__(self, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.started = perf_counter()
+        self.wall_time = time.time()
+        self.duration = 0.0
+        self.status = 0
+        self.spans: list[tuple[str, float, float]] = []
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.wall_time,
+            "duration_ms": self.duration * 1000.0,
+            "spans": [
+                {"name": name, "offset_ms": offset * 1000.0, "duration_ms": duration * 1000.0}
+                for name, offset, duration in sorted(self.spans, key=lambda span: span[1])
+            ],
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+def attach_trace(trace: Optional[Trace]) -> Token[Optional[Trace]]:
+    """Make ``trace`` the current one; pass the token to ``reset_trace`` afterwards."""
+    return _current.set(trace)
+
+
+def reset_trace(token: Token[Optional[Trace]]) -> None:
+    _current.reset(token)
+
+
+def detach_trace() -> None:
+    """Stop recording spans into the current trace from this task onwards.
+
+    For background tasks that inherited a request's context but do work on
+    behalf of other requests too, such as a batch dispatch.
+    """
+    _current.set(None)
+
+
+class Stage:
+    """A named, timed step of request handling backed by one histogram series."""
+
+    __slots__ = ("name", "series")
+
+    def __init__(self, name: str, series: HistogramSeries) -> None:
+        self.name = name
+        self.series = series
+
+    def since(self, started: float) -> float:
+        """Record the time from ``started`` (a ``perf_counter()`` value) until now."""
+        duration = perf_counter() - started
+        self.series.observe(duration)
+        trace = _current.get()
+        if trace is not None:
+            trace.spans.append((self.name, started - trace.started, duration))
+        return duration
+
+    def observe(self, duration: float) -> None:
+        """Record a duration measured elsewhere; it is not added to the current trace."""
+        self.series.observe(duration)
+
+
+class SlowTraceSampler:
+    """Samples requests for tracing and keeps the slowest ``keep`` of them."""
+
+    def __init__(
+        self,
+        sample_rate: float,
+        keep: int = 20,
+        *,
+        dump_path: Optional[Union[str, Path]] = None,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.dump_path = dump_path
+        self.sampled = 0
+        self._heap: list[tuple[float, int, Trace]] = []
+
+    def start(self, method: str, path: str) -> Optional[Trace]:
+        """Begin tracing this request if it is sampled; returns the trace or ``None``."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        return Trace(method, path)
+
+    def finish(self, trace: Trace, status: int) -> None:
+        trace.duration = perf_counter() - trace.started
+        trace.status = status
+        self.sampled += 1
+        entry = (trace.duration, self.sampled, trace)
+        if len(self._heap) < self.keep:
+            heapq.heappush(self._heap, entry)
+        elif trace.duration > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def slowest(self) -> list[dict[str, Any]]:
+        return [entry[2].as_dict() for entry in sorted(self._heap, reverse=True)]
+
+    def dump(self, path: Optional[Union[str, Path]] = None) -> Optional[Path]:
+        """Write the slowest traces as JSON to ``path`` (default ``dump_path``)."""
+        target = path or self.dump_path
+        if target is None:
+            return None
+        target = Path(target)
+        target.write_text(
+            json.dumps({"sampled": self.sampled, "traces": self.slowest()}, indent=2), "utf-8"
+        )
+        return target
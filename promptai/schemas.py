@@ -0,0 +1,79 @@
+"""Request and response bodies for the public HTTP API."""
+
+from __future__ import annotations
+
+from typing import Any, Optional, Union
+
+from pydantic import BaseModel, Field, model_validator
+
+from promptai.metrics.stages import TEMPLATE_RENDER
+from promptai.metrics.tracing import perf_counter
+from promptai.templates import get_template
+
+
+class CompletionRequest(BaseModel):
+    """A completion request, forwarded to the provider that serves ``model``.
+
+    The prompt is given either literally or as a ``template`` plus the
+    ``variables`` to render it with (see ``promptai.templates``).
+    """
+
+    model: str
+    prompt: Optional[str] = None
+    template: Optional[str] = None
+    variables: dict[str, Any] = Field(default_factory=dict)
+    max_tokens: Optional[int] = Field(None, ge=1)
+    temperature: Optional[float] = Field(None, ge=0)
+    top_p: Optional[float] = Field(None, gt=0, le=1)
+    stop: Optional[Union[str, list[str]]] = None
+    stream: bool = False
+    provider: Optional[str] = None
+
+    @model_validator(mode="after")
+    def _one_prompt_source(self) -> "CompletionRequest":
+        if (self.prompt is None) == (self.template is None):
+            raise ValueError("exactly one of 'prompt' or 'template' is required")
+        return self
+
+    def render_prompt(self) -> str:
+        """The literal prompt, or the template rendered with ``variables``.
+
+        Raises ``TemplateError`` or ``pydantic.ValidationError`` on bad input.
+        """
+        if self.template is None:
+            return self.prompt  # type: ignore[return-value]
+        started = perf_counter()
+        prompt = get_template(self.template).render(self.variables)
+        TEMPLATE_RENDER.since(started)
+        return prompt
+
+    def upstream_payload(self, prompt: str) -> dict[str, Any]:
+        """Body sent upstream: the rendered prompt plus model and sampling params."""
+        payload = self.model_dump(
+            exclude={"prompt", "template", "variables", "provider"}, exclude_none=True
+        )
+        payload["prompt"] = prompt
+        return payload
+
+    def sampling_params(self) -> dict[str, Any]:
+        """The parameters that, with model and prompt, determine the completion."""
+        return self.model_dump(
+            exclude={"model", "prompt", "template", "variables", "provider", "stream"},
+            exclude_none=True,
+        )
+
+
+class EmbeddingRequest(BaseModel):
+    """An embedding request; a single string input is eligible for micro-batching."""
+
+    model: str
+    input: Union[str, list[str]]
+    dimensions: Optional[int] = Field(None, ge=1)
+    provider: Optional[str] = None
+
+    def upstream_payload(self) -> dict[str, Any]:
+        return self.model_dump(exclude={"provider"}, exclude_none=True)
+
+
+class PoolStatsResponse(BaseModel):
+    providers: list[dict[str, Any]]
@@ -0,0 +1,79 @@
+"""Relay of upstream streaming completions to our own clients.
+
+Bytes are forwarded chunk by chunk as they arrive; the full answer is never
+held in memory.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Mapping, Optional
+
+import anyio
+import httpx
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+_RELAY_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stop nginx and similar proxies from buffering the event stream.
+    "X-Accel-Buffering": "no",
+}
+
+
+class UpstreamStreamResponse(StreamingResponse):
+    """Streams an already-opened upstream ``httpx.Response`` to the client.
+
+    Unlike the base class, this always watches for ``http.disconnect``
+    (whatever ASGI spec version the server reports), so a client that hangs
+    up cancels the upstream read immediately rather than on the next write.
+    The upstream response is closed however the relay ends, which returns its
+    pool slot and stops upstream generation.
+    """
+
+    def __init__(
+        self,
+        upstream: httpx.Response,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        media_type = upstream.headers.get("content-type", SSE_MEDIA_TYPE)
+        super().__init__(
+            upstream.aiter_bytes(),
+            status_code=upstream.status_code,
+            headers={**_RELAY_HEADERS, **(headers or {})},
+            media_type=media_type,
+        )
+        self.upstream = upstream
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            async with anyio.create_task_group() as task_group:
+
+                async def relay() -> None:
+                    try:
+                        await self.stream_response(send)
+                    except OSError:
+                        # Raised by some servers when writing to a closed socket.
+                        logger.debug("client went away mid-stream")
+                    except httpx.HTTPError as exc:
+                        # Headers are already sent; all we can do is cut the stream.
+                        logger.warning("upstream stream failed mid-relay: %r", exc)
+                    task_group.cancel_scope.cancel()
+
+                async def watch() -> None:
+                    await self.listen_for_disconnect(receive)
+                    logger.debug("client disconnected; cancelling upstream stream")
+                    task_group.cancel_scope.cancel()
+
+                task_group.start_soon(relay)
+                task_group.start_soon(watch)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.upstream.aclose()
+
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,482 @@
+"""Prompt templates compiled once into flat render plans.
+
+Syntax::
+
+    {{ name }}                  substitute a variable
+    {{ user.name }}             dotted lookup into mappings or attributes
+                                (names starting with ``_`` are rejected)
+    {{ doc | tail:2000 }}       filters, applied left to right
+    {{# examples | last:3 }}    repeat the block for each list item (or once
+    ...                         for any other truthy value); inside, names
+    {{/ examples }}             resolve against the item first, ``{{ . }}``
+                                is the item itself
+    {{^ examples }}...{{/ examples }}   block rendered only when falsy
+    {{! comment }}              ignored
+    {{ "{{" }}                  a quoted string is emitted literally
+
+Section and comment tags that sit alone on a line take the whole line with
+them, so block structure does not leave blank lines in the prompt.
+
+Compiling produces a list of literal slices with holes plus one op per hole;
+rendering copies the list, fills the holes and does a single ``"".join``.
+Variables are checked with a ``pydantic.TypeAdapter`` built once per
+variables type.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import re
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from typing import Any, Callable, NamedTuple, Optional
+
+from pydantic import ConfigDict, TypeAdapter
+from typing_extensions import TypedDict
+
+__all__ = [
+    "Template",
+    "TemplateCache",
+    "TemplateError",
+    "TemplateRenderError",
+    "TemplateSyntaxError",
+    "get_template",
+]
+
+_TAG_RE = re.compile(r"\{\{(.*?)\}\}", re.DOTALL)
+_NAME_RE = re.compile(r"^(?:\.|[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)$")
+_BLOCK_SIGILS = "#^/!"
+
+Scope = tuple[Any, ...]
+SlotOp = Callable[[Scope], str]
+Filter = tuple[str, Callable[[Any], Any]]
+
+
+class TemplateError(Exception):
+    """Base class for template errors."""
+
+
+class TemplateSyntaxError(TemplateError, ValueError):
+    def __init__(self, message: str, position: int) -> None:
+        super().__init__(f"{message} at offset {position}")
+        self.position = position
+
+
+class TemplateRenderError(TemplateError):
+    pass
+
+
+# -- filters -----------------------------------------------------------------
+
+
+def _int_arg(name: str, arg: Optional[str]) -> int:
+    if arg is None or not arg.strip().lstrip("-").isdigit():
+        raise ValueError(f"filter {name!r} needs an integer argument")
+    return int(arg)
+
+
+def _str_arg(arg: Optional[str]) -> str:
+    if arg is None:
+        return ""
+    arg = arg.strip()
+    if len(arg) >= 2 and arg[0] == arg[-1] and arg[0] in "\"'":
+        return json.loads('"' + arg[1:-1].replace('"', '\\"') + '"')
+    return arg
+
+
+def _filter_truncate(arg: Optional[str]) -> Callable[[Any], Any]:
+    n = _int_arg("truncate", arg)
+    return lambda v: _text(v)[:n]
+
+
+def _filter_tail(arg: Optional[str]) -> Callable[[Any], Any]:
+    n = _int_arg("tail", arg)
+    return lambda v: _text(v)[-n:] if n else ""
+
+
+def _filter_first(arg: Optional[str]) -> Callable[[Any], Any]:
+    n = _int_arg("first", arg)
+    return lambda v: v[:n]
+
+
+def _filter_last(arg: Optional[str]) -> Callable[[Any], Any]:
+    n = _int_arg("last", arg)
+    return lambda v: v[-n:] if n else v[:0]
+
+
+def _filter_join(arg: Optional[str]) -> Callable[[Any], Any]:
+    sep = _str_arg(arg)
+    return lambda v: sep.join(_text(item) for item in v)
+
+
+def _filter_default(arg: Optional[str]) -> Callable[[Any], Any]:
+    fallback = _str_arg(arg)
+    return lambda v: v if v not in (None, "") else fallback
+
+
+_FILTERS: dict[str, Callable[[Optional[str]], Callable[[Any], Any]]] = {
+    "truncate": _filter_truncate,
+    "tail": _filter_tail,
+    "first": _filter_first,
+    "last": _filter_last,
+    "join": _filter_join,
+    "default": _filter_default,
+    "json": lambda _: lambda v: json.dumps(v, ensure_ascii=False),
+    "strip": lambda _: lambda v: _text(v).strip(),
+    "upper": lambda _: lambda v: _text(v).upper(),
+    "lower": lambda _: lambda v: _text(v).lower(),
+}
+
+
+def _text(value: Any) -> str:
+    if value.__class__ is str:
+        return value
+    return "" if value is None else str(value)
+
+
+# -- compilation -------------------------------------------------------------
+
+
+class _Plan:
+    """Literal slices with holes, and how to fill each hole.
+
+    Plain ``{{ name }}`` holes are kept as ``(index, name)`` pairs and filled
+    inline, without a function call per slot; everything else has an op.
+    """
+
+    __slots__ = ("parts", "names", "slots")
+
+    def __init__(
+        self,
+        parts: list[str],
+        names: tuple[tuple[int, str], ...],
+        slots: tuple[tuple[int, SlotOp], ...],
+    ) -> None:
+        self.parts = parts
+        self.names = names
+        self.slots = slots
+
+    def render(self, scope: Scope) -> str:
+        out = self.parts.copy()
+        if self.names:
+            if len(scope) == 1:
+                frame = scope[0]
+                try:
+                    for index, name in self.names:
+                        value = frame[name]
+                        out[index] = value if value.__class__ is str else _text(value)
+                except KeyError:
+                    _lookup(scope, (name,))  # raises TemplateRenderError
+                    raise
+            else:
+                for index, name in self.names:
+                    out[index] = _text(_lookup(scope, (name,)))
+        for index, op in self.slots:
+            out[index] = op(scope)
+        return "".join(out)
+
+
+class _Section(NamedTuple):
+    name: str
+    path: tuple[str, ...]
+    filters: tuple[Filter, ...]
+    inverted: bool
+    opened_at: int
+
+
+class _Builder:
+    def __init__(self, section: Optional[_Section] = None) -> None:
+        self.section = section
+        self.parts: list[str] = []
+        self.names: list[tuple[int, str]] = []
+        self.slots: list[tuple[int, SlotOp]] = []
+        self._last_hole = -1
+
+    def literal(self, text: str) -> None:
+        if not text:
+            return
+        if self.parts and self._last_hole != len(self.parts) - 1:
+            self.parts[-1] += text
+        else:
+            self.parts.append(text)
+
+    def name(self, name: str) -> None:
+        self.names.append((self._hole(), name))
+
+    def slot(self, op: SlotOp) -> None:
+        self.slots.append((self._hole(), op))
+
+    def _hole(self) -> int:
+        self._last_hole = len(self.parts)
+        self.parts.append("")
+        return self._last_hole
+
+    def build(self) -> _Plan:
+        return _Plan(self.parts, tuple(self.names), tuple(self.slots))
+
+
+def _compile(source: str) -> tuple[_Plan, frozenset[str]]:
+    """Parse ``source`` into a plan; also return the top-level names it reads."""
+    stack = [_Builder()]
+    names: set[str] = set()
+    pos = 0
+    for match in _TAG_RE.finditer(source):
+        start, end = match.span()
+        body = match.group(1).strip()
+        sigil = body[:1] if body[:1] in _BLOCK_SIGILS else ""
+
+        literal_end, next_pos = start, end
+        if sigil:
+            line_start = source.rfind("\n", 0, start) + 1
+            line_end = source.find("\n", end)
+            line_end = len(source) if line_end == -1 else line_end
+            if (
+                line_start >= pos
+                and not source[line_start:start].strip()
+                and not source[end:line_end].strip()
+            ):
+                literal_end, next_pos = line_start, min(line_end + 1, len(source))
+        stack[-1].literal(source[pos:literal_end])
+        pos = next_pos
+
+        if sigil == "!":
+            continue
+        if sigil == "/":
+            name = body[1:].strip()
+            section = stack[-1].section
+            if section is None or section.name != name:
+                raise TemplateSyntaxError(f"unexpected closing tag {{{{/{name}}}}}", start)
+            plan = stack.pop().build()
+            stack[-1].slot(_section_op(section, plan))
+            continue
+        if sigil in ("#", "^"):
+            path, filters = _parse_expr(body[1:], start)
+            if len(stack) == 1 and path:
+                names.add(path[0])
+            name = _split_filters(body[1:])[0].strip()
+            stack.append(_Builder(_Section(name, path, filters, sigil == "^", start)))
+            continue
+        if body[:1] in "\"'" and len(body) >= 2 and body[-1] == body[0]:
+            stack[-1].literal(_str_arg(body))
+            continue
+        path, filters = _parse_expr(body, start)
+        if len(stack) == 1 and path:
+            names.add(path[0])
+        if len(path) == 1 and not filters:
+            stack[-1].name(path[0])
+        else:
+            stack[-1].slot(_slot_op(path, filters))
+
+    if len(stack) > 1:
+        section = stack[-1].section
+        raise TemplateSyntaxError(f"unclosed section {{{{#{section.name}}}}}", section.opened_at)
+    stack[0].literal(source[pos:])
+    return stack[0].build(), frozenset(names)
+
+
+def _split_filters(expr: str) -> list[str]:
+    """Split ``name | f:arg | g`` on pipes that are not inside quotes."""
+    pieces, current, quote = [], [], ""
+    for ch in expr:
+        if quote:
+            quote = "" if ch == quote else quote
+        elif ch in "\"'":
+            quote = ch
+        elif ch == "|":
+            pieces.append("".join(current))
+            current = []
+            continue
+        current.append(ch)
+    pieces.append("".join(current))
+    return pieces
+
+
+def _parse_expr(expr: str, position: int) -> tuple[tuple[str, ...], tuple[Filter, ...]]:
+    name, *filter_specs = (piece.strip() for piece in _split_filters(expr))
+    if not _NAME_RE.match(name):
+        raise TemplateSyntaxError(f"invalid variable name {name!r}", position)
+    path = () if name == "." else tuple(name.split("."))
+    if any(part.startswith("_") for part in path):
+        # Templates come from request bodies; never let them reach dunders
+        # such as ``x.__class__.__subclasses__`` through attribute lookup.
+        raise TemplateSyntaxError(f"names may not start with '_': {name!r}", position)
+    filters = []
+    for spec in filter_specs:
+        fname, sep, arg = spec.partition(":")
+        fname = fname.strip()
+        factory = _FILTERS.get(fname)
+        if factory is None:
+            raise TemplateSyntaxError(f"unknown filter {fname!r}", position)
+        try:
+            filters.append((fname, factory(arg if sep else None)))
+        except ValueError as exc:
+            raise TemplateSyntaxError(str(exc), position) from None
+    return path, tuple(filters)
+
+
+_MISSING = object()
+
+
+def _lookup(scope: Scope, path: tuple[str, ...]) -> Any:
+    if not path:
+        return scope[0]
+    head = path[0]
+    for frame in scope:
+        if isinstance(frame, Mapping):
+            value = frame.get(head, _MISSING)
+            if value is not _MISSING:
+                break
+    else:
+        raise TemplateRenderError(f"undefined variable {head!r}")
+    for attr in path[1:]:
+        if isinstance(value, Mapping):
+            value = value.get(attr, _MISSING)
+        else:
+            value = getattr(value, attr, _MISSING)
+        if value is _MISSING:
+            raise TemplateRenderError(f"undefined variable {'.'.join(path)!r}")
+    return value
+
+
+def _apply_filters(value: Any, filters: tuple[Filter, ...]) -> Any:
+    for name, f in filters:
+        try:
+            value = f(value)
+        except TemplateError:
+            raise
+        except Exception as exc:
+            # Variables come from callers; a value of the wrong type is their
+            # error, not ours.
+            raise TemplateRenderError(
+                f"filter {name!r} cannot be applied to {type(value).__name__}: {exc}"
+            ) from None
+    return value
+
+
+def _slot_op(path: tuple[str, ...], filters: tuple[Filter, ...]) -> SlotOp:
+    def op(scope: Scope) -> str:
+        return _text(_apply_filters(_lookup(scope, path), filters))
+
+    return op
+
+
+def _section_op(section: _Section, plan: _Plan) -> SlotOp:
+    path, filters, render = section.path, section.filters, plan.render
+
+    if section.inverted:
+
+        def inverted(scope: Scope) -> str:
+            value = _apply_filters(_lookup(scope, path), filters)
+            return "" if value else render(scope)
+
+        return inverted
+
+    def op(scope: Scope) -> str:
+        value = _apply_filters(_lookup(scope, path), filters)
+        if not value:
+            return ""
+        if isinstance(value, (list, tuple)):
+            return "".join([render((item,) + scope) for item in value])
+        return render((value,) + scope)
+
+    return op
+
+
+# -- public API --------------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=256)
+def _adapter_for(variables: Any) -> TypeAdapter:
+    return TypeAdapter(variables)
+
+
+@functools.lru_cache(maxsize=1024)
+def _inferred_variables(names: frozenset[str]) -> Any:
+    # Every top-level name must be present; values are unconstrained. Names
+    # read only inside sections are not listed, so other keys are kept.
+    variables = TypedDict(  # type: ignore[operator]
+        "TemplateVariables", {name: Any for name in sorted(names)}
+    )
+    variables.__pydantic_config__ = ConfigDict(extra="allow")
+    return variables
+
+
+class Template:
+    """A compiled prompt template.
+
+    ``variables`` is the type the render context must validate against,
+    normally a ``TypedDict``. Without one, the template requires every
+    top-level name it references and accepts any value for it.
+    """
+
+    __slots__ = ("source", "names", "variables", "_plan", "_adapter")
+
+    def __init__(self, source: str, variables: Any = None) -> None:
+        self.source = source
+        self._plan, self.names = _compile(source)
+        self.variables = variables if variables is not None else _inferred_variables(self.names)
+        self._adapter = _adapter_for(self.variables)
+
+    def validate(self, variables: Mapping[str, Any]) -> Mapping[str, Any]:
+        """Validate ``variables``; raises ``pydantic.ValidationError``."""
+        validated = self._adapter.validate_python(variables)
+        if not isinstance(validated, Mapping):
+            raise TypeError(f"template variables must validate to a mapping, got {type(validated)}")
+        return validated
+
+    def render(self, variables: Mapping[str, Any], *, validate: bool = True) -> str:
+        if validate:
+            variables = self.validate(variables)
+        return self._plan.render((variables,))
+
+    def __repr__(self) -> str:
+        return f"Template(names={sorted(self.names)!r}, length={len(self.source)})"
+
+
+class TemplateCache:
+    """Bounded LRU of compiled templates keyed by their source text.
+
+    The key is the source string itself, so lookups cost one string hash
+    (cached on the ``str`` object after first use) plus an equality check on
+    collision, cheaper than a cryptographic digest of a 32k-character prompt.
+    """
+
+    def __init__(self, max_size: int = 1024) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates: OrderedDict[tuple[str, Any], Template] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._templates)
+
+    def get(self, source: str, variables: Any = None) -> Template:
+        key = (source, variables)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+            self.misses += 1
+        template = Template(source, variables)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+
+_default_cache = TemplateCache()
+
+
+def get_template(source: str, variables: Any = None) -> Template:
+    """Compile ``source``, or return the cached compilation of identical text."""
+    return _default_cache.get(source, variables)
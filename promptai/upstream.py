@@ -0,0 +1,369 @@
+"""Pooled clients for upstream LLM providers.
+
+Each provider gets exactly one long-lived ``httpx.AsyncClient`` for the life of
+the application, so TCP/TLS connections (and HTTP/2 sessions when enabled) are
+reused across prompts instead of being opened per request.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Iterable, Optional
+
+import httpx
+
+from promptai.config import ProviderConfig, RetryConfig
+from promptai.metrics.stages import UpstreamStages
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 support is an optional extra (httpx[http2])
+    HAS_HTTP2 = False
+else:
+    HAS_HTTP2 = True
+
+_RETRYABLE_ERRORS: tuple[type[Exception], ...] = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.PoolTimeout,
+    httpx.RemoteProtocolError,
+)
+
+
+class UpstreamError(Exception):
+    """An upstream call failed after exhausting retries."""
+
+    def __init__(
+        self,
+        provider: str,
+        message: str,
+        status_code: Optional[int] = None,
+        body: Optional[str] = None,
+    ) -> None:
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.body = body
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    """Point-in-time snapshot of a provider's connection pool."""
+
+    provider: str
+    http2: bool
+    max_connections: int
+    max_keepalive_connections: int
+    connections: int
+    in_use: int
+    idle: int
+    active_requests: int
+    waiters: int
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class UpstreamClient:
+    """One provider's shared ``httpx.AsyncClient`` plus its retry policy."""
+
+    def __init__(
+        self,
+        config: ProviderConfig,
+        *,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> None:
+        self.config = config
+        self.name = config.name
+        self.stages = UpstreamStages(config.name)
+        pool = config.pool
+
+        self.http2 = pool.http2
+        if self.http2 and not HAS_HTTP2:
+            logger.warning(
+                "provider %r requested HTTP/2 but the 'h2' package is not installed; "
+                "falling back to HTTP/1.1",
+                config.name,
+            )
+            self.http2 = False
+
+        limits = httpx.Limits(
+            max_connections=pool.max_connections,
+            max_keepalive_connections=pool.max_keepalive_connections,
+            keepalive_expiry=pool.keepalive_expiry,
+        )
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(limits=limits, http2=self.http2)
+        self._transport = transport
+
+        timeouts = config.timeouts
+        self._client = httpx.AsyncClient(
+            base_url=config.base_url,
+            headers=self._default_headers(),
+            timeout=httpx.Timeout(
+                connect=timeouts.connect,
+                read=timeouts.read,
+                write=timeouts.write,
+                pool=timeouts.pool,
+            ),
+            transport=transport,
+        )
+
+    def _default_headers(self) -> dict[str, str]:
+        headers = dict(self.config.headers)
+        if self.config.api_key:
+            scheme = self.config.auth_scheme
+            value = f"{scheme} {self.config.api_key}" if scheme else self.config.api_key
+            headers[self.config.auth_header] = value
+        return headers
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Any = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> httpx.Response:
+        """Send a request, retrying transient failures with jittered backoff.
+
+        The returned response has been read and has a 2xx status; anything
+        else raises ``UpstreamError``.
+        """
+        retry = self.config.retry
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self._client.request(
+                    method, path, json=json, headers=headers, extensions=self._extensions()
+                )
+            except httpx.TransportError as exc:
+                if attempt >= retry.max_attempts or not self._is_retryable_error(exc):
+                    raise UpstreamError(self.name, f"{type(exc).__name__}: {exc}") from exc
+                delay = backoff_delay(retry, attempt)
+                logger.info("retrying %s %s on %r after %.3fs", method, path, exc, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            if response.is_success:
+                return response
+            if attempt >= retry.max_attempts or response.status_code not in retry.retry_statuses:
+                raise UpstreamError(
+                    self.name,
+                    f"HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    body=response.text,
+                )
+            delay = backoff_delay(retry, attempt, response)
+            logger.info(
+                "retrying %s %s on HTTP %d after %.3fs", method, path, response.status_code, delay
+            )
+            await asyncio.sleep(delay)
+
+    async def open_stream(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Any = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> httpx.Response:
+        """Send a request and return as soon as the response headers arrive.
+
+        Retries happen only before the first body byte, so a relayed stream
+        is never replayed. The caller owns the returned response and must
+        ``aclose()`` it; closing early frees its pool slot.
+        """
+        retry = self.config.retry
+        attempt = 0
+        while True:
+            attempt += 1
+            request = self._client.build_request(
+                method, path, json=json, headers=headers, extensions=self._extensions()
+            )
+            try:
+                response = await self._client.send(request, stream=True)
+            except httpx.TransportError as exc:
+                if attempt >= retry.max_attempts or not self._is_retryable_error(exc):
+                    raise UpstreamError(self.name, f"{type(exc).__name__}: {exc}") from exc
+                delay = backoff_delay(retry, attempt)
+                logger.info("retrying stream %s %s on %r after %.3fs", method, path, exc, delay)
+                await asyncio.sleep(delay)
+                continue
+
+            if response.is_success:
+                return response
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+            if attempt >= retry.max_attempts or response.status_code not in retry.retry_statuses:
+                raise UpstreamError(
+                    self.name,
+                    f"HTTP {response.status_code}",
+                    status_code=response.status_code,
+                    body=response.text,
+                )
+            delay = backoff_delay(retry, attempt, response)
+            logger.info(
+                "retrying stream %s %s on HTTP %d after %.3fs",
+                method,
+                path,
+                response.status_code,
+                delay,
+            )
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        method: str,
+        path: str,
+        *,
+        json: Any = None,
+        headers: Optional[dict[str, str]] = None,
+    ) -> AsyncIterator[httpx.Response]:
+        """Context-manager form of ``open_stream``."""
+        response = await self.open_stream(method, path, json=json, headers=headers)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def complete(self, payload: dict[str, Any]) -> dict[str, Any]:
+        """POST a completion request and return the decoded JSON body."""
+        response = await self.request("POST", self.config.completions_path, json=payload)
+        return response.json()
+
+    def _extensions(self) -> dict[str, Any]:
+        return {"trace": self.stages.timer()}
+
+    def _is_retryable_error(self, exc: httpx.TransportError) -> bool:
+        if isinstance(exc, _RETRYABLE_ERRORS):
+            return True
+        return self.config.retry.retry_read_timeouts and isinstance(exc, httpx.ReadTimeout)
+
+    def pool_stats(self) -> PoolStats:
+        """Snapshot of in-use/idle connections and queued requests.
+
+        Reads httpcore's pool directly; custom transports without a pool
+        report zeros.
+        """
+        pool_config = self.config.pool
+        connections = in_use = idle = active = waiters = 0
+        pool = getattr(self._transport, "_pool", None)
+        if pool is not None:
+            conns = list(getattr(pool, "connections", ()))
+            connections = len(conns)
+            idle = sum(1 for conn in conns if conn.is_idle())
+            in_use = connections - idle
+            requests = list(getattr(pool, "_requests", ()))
+            waiters = sum(1 for req in requests if req.is_queued())
+            active = len(requests) - waiters
+        return PoolStats(
+            provider=self.name,
+            http2=self.http2,
+            max_connections=pool_config.max_connections,
+            max_keepalive_connections=pool_config.max_keepalive_connections,
+            connections=connections,
+            in_use=in_use,
+            idle=idle,
+            active_requests=active,
+            waiters=waiters,
+        )
+
+
+class UpstreamRegistry:
+    """All provider clients, keyed by name, with model-to-provider routing."""
+
+    def __init__(self, clients: Iterable[UpstreamClient], default: Optional[str] = None) -> None:
+        self._clients = {client.name: client for client in clients}
+        if default is not None and default not in self._clients:
+            raise KeyError(f"unknown default provider {default!r}")
+        self._default = default
+
+    @classmethod
+    def from_configs(
+        cls,
+        configs: Iterable[ProviderConfig],
+        default: Optional[str] = None,
+        *,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ) -> "UpstreamRegistry":
+        return cls((UpstreamClient(c, transport=transport) for c in configs), default)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._clients
+
+    def __iter__(self):
+        return iter(self._clients.values())
+
+    def get(self, name: str) -> UpstreamClient:
+        try:
+            return self._clients[name]
+        except KeyError:
+            raise KeyError(f"unknown provider {name!r}") from None
+
+    def for_model(self, model: str, provider: Optional[str] = None) -> UpstreamClient:
+        """Pick the client for ``model``: explicit provider, then model lists, then default."""
+        if provider is not None:
+            return self.get(provider)
+        for client in self._clients.values():
+            if client.config.serves(model):
+                return client
+        if self._default is None:
+            raise KeyError(f"no provider configured for model {model!r}")
+        return self._clients[self._default]
+
+    def stats(self) -> list[PoolStats]:
+        return [client.pool_stats() for client in self._clients.values()]
+
+    async def aclose(self) -> None:
+        await asyncio.gather(
+            *(client.aclose() for client in self._clients.values()), return_exceptions=True
+        )
+
+
+def backoff_delay(
+    retry: RetryConfig, attempt: int, response: Optional[httpx.Response] = None
+) -> float:
+    """Delay before retry number ``attempt`` (1-based), honouring ``Retry-After``."""
+    if response is not None:
+        hinted = _retry_after(response)
+        if hinted is not None:
+            return min(hinted, retry.backoff_max)
+    ceiling = min(retry.backoff_max, retry.backoff_base * (2 ** (attempt - 1)))
+    return random.uniform(0, ceiling)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,88 @@
+"""Helpers for driving the app against a fake upstream in-process."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+from fastapi import FastAPI
+
+from promptai.app import create_app
+from promptai.config import Settings
+
+
+class FakeUpstream:
+    """``httpx.MockTransport`` handler answering completions after ``delay`` seconds.
+
+    ``slow`` maps prompts to a longer delay of their own; prompts in
+    ``broken`` make the transport raise ``RuntimeError``.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        slow: Optional[dict[str, float]] = None,
+        broken: frozenset[str] = frozenset(),
+    ) -> None:
+        self.delay = delay
+        self.slow = slow or {}
+        self.broken = broken
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            body = json.loads(request.content)
+            delay = self.slow.get(body["prompt"], self.delay)
+            if delay:
+                await asyncio.sleep(delay)
+            if body["prompt"] in self.broken:
+                raise RuntimeError(f"broken prompt {body['prompt']!r}")
+            return httpx.Response(
+                200, json={"choices": [{"index": 0, "text": f"re: {body['prompt']}"}]}
+            )
+        finally:
+            self.in_flight -= 1
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self)
+
+
+def make_settings(tmp_path: Path, **sections: dict[str, Any]) -> Settings:
+    data: dict[str, Any] = {
+        "providers": [{"name": "mock", "base_url": "http://upstream.test", "models": ["*"]}],
+        "cache": {"enabled": False},
+        "jobs": {"directory": str(tmp_path / "jobs")},
+    }
+    for name, values in sections.items():
+        data[name] = {**data.get(name, {}), **values}
+    return Settings.model_validate(data)
+
+
+@asynccontextmanager
+async def running_app(
+    settings: Settings, upstream: FakeUpstream
+) -> AsyncIterator[tuple[FastAPI, httpx.AsyncClient]]:
+    """The app with its lifespan entered, and a client talking to it in-process."""
+    app = create_app(settings, transport=upstream.transport())
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://promptai.test") as c:
+            yield app, c
+
+
+async def wait_until(predicate: Callable[[], Awaitable[bool]], timeout: float = 10.0) -> None:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await predicate():
+        if loop.time() > deadline:
+            raise AssertionError("timed out waiting for condition")
+        await asyncio.sleep(0.01)
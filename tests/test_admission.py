@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from promptai.admission import (
+    AdmissionController,
+    ConcurrencyLimiter,
+    QueueFull,
+    QueueTimeout,
+    SharedSlots,
+    SqliteLimiterBackend,
+)
+from promptai.config import AdmissionConfig
+from promptai.packing import MemoizedTokenCounter, get_token_counter
+from tests.support import FakeUpstream, make_settings, running_app
+
+pytestmark = pytest.mark.anyio
+
+
+def limiter(**overrides: float) -> ConcurrencyLimiter:
+    options = dict(
+        max_in_flight=1,
+        max_in_flight_per_tenant=1,
+        max_queue=10,
+        max_queue_per_tenant=5,
+        queue_timeout=5.0,
+    )
+    options.update(overrides)
+    return ConcurrencyLimiter(**options)  # type: ignore[arg-type]
+
+
+async def settle() -> None:
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def test_grants_immediately_under_the_caps() -> None:
+    limits = limiter(max_in_flight=2, max_in_flight_per_tenant=2)
+    assert await limits.acquire("a") == 0.0
+    assert await limits.acquire("b") == 0.0
+    assert limits.stats() == {
+        "in_flight": 2,
+        "queued": 0,
+        "tenants_in_flight": 2,
+        "tenants_queued": 0,
+    }
+    limits.release("a")
+    limits.release("b")
+    assert limits.in_flight == 0
+
+
+async def test_freed_slots_go_round_robin_across_tenants() -> None:
+    limits = limiter(max_in_flight_per_tenant=10)
+    await limits.acquire("holder")
+    granted: list[str] = []
+
+    async def request(tenant: str, name: str) -> None:
+        await limits.acquire(tenant)
+        granted.append(name)
+
+    tasks = [asyncio.ensure_future(request("a", f"a{i}")) for i in range(3)]
+    await settle()
+    tasks.append(asyncio.ensure_future(request("b", "b0")))
+    await settle()
+    assert limits.queued == 4
+
+    limits.release("holder")
+    for expected in (["a0"], ["a0", "b0"], ["a0", "b0", "a1"], ["a0", "b0", "a1", "a2"]):
+        await settle()
+        assert granted == expected
+        limits.release(expected[-1][0])
+    await asyncio.gather(*tasks)
+    assert limits.stats()["in_flight"] == 0
+
+
+async def test_per_tenant_cap_lets_other_tenants_through() -> None:
+    limits = limiter(max_in_flight=3, max_in_flight_per_tenant=1)
+    await limits.acquire("a")
+    waiter = asyncio.ensure_future(limits.acquire("a"))
+    await settle()
+    assert not waiter.done()
+    assert await limits.acquire("b") == 0.0
+    limits.release("a")
+    await settle()
+    assert waiter.done()
+
+
+async def test_queue_bounds_reject() -> None:
+    limits = limiter(max_queue=3, max_queue_per_tenant=2)
+    await limits.acquire("holder")
+    waiters = [asyncio.ensure_future(limits.acquire("a")) for _ in range(2)]
+    await settle()
+    with pytest.raises(QueueFull):
+        await limits.acquire("a")
+    waiters.append(asyncio.ensure_future(limits.acquire("b")))
+    await settle()
+    with pytest.raises(QueueFull):
+        await limits.acquire("c")
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    assert limits.queued == 0
+
+
+async def test_queue_timeout_rejects_and_forgets_the_waiter() -> None:
+    limits = limiter(queue_timeout=0.05)
+    await limits.acquire("holder")
+    with pytest.raises(QueueTimeout) as raised:
+        await limits.acquire("a")
+    assert raised.value.status_code == 503
+    assert limits.stats()["queued"] == 0
+    assert limits.stats()["tenants_queued"] == 0
+    limits.release("holder")
+    assert limits.in_flight == 0
+
+
+async def test_cancelled_waiter_is_skipped() -> None:
+    limits = limiter()
+    await limits.acquire("holder")
+    first = asyncio.ensure_future(limits.acquire("a"))
+    second = asyncio.ensure_future(limits.acquire("b"))
+    await settle()
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+    assert limits.queued == 1
+
+    limits.release("holder")
+    await settle()
+    assert second.done() and not second.cancelled()
+    assert limits.stats()["in_flight"] == 1
+    assert limits._active == {"b": 1}
+
+
+async def test_slot_granted_as_waiter_is_cancelled_is_not_lost() -> None:
+    limits = limiter()
+    await limits.acquire("holder")
+    first = asyncio.ensure_future(limits.acquire("a"))
+    second = asyncio.ensure_future(limits.acquire("b"))
+    await settle()
+    # The grant and the cancellation land in the same loop iteration. Python
+    # versions differ on which wins; either way the slot must end up owned.
+    limits.release("holder")
+    first.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+    await settle()
+    if not first.cancelled():
+        assert limits._active == {"a": 1}
+        assert not second.done()
+        limits.release("a")
+        await settle()
+    assert second.done() and not second.cancelled()
+    assert limits._active == {"b": 1}
+    assert limits.queued == 0
+
+
+async def test_shared_slots_cap_in_flight_across_processes(tmp_path: Path) -> None:
+    # Two backends on one file stand in for two worker processes.
+    path = tmp_path / "limits.sqlite3"
+    workers = [SharedSlots(SqliteLimiterBackend(path), 3, max_delay=0.01) for _ in range(2)]
+    in_flight = peak = 0
+
+    async def request(slots: SharedSlots) -> None:
+        nonlocal in_flight, peak
+        await slots.acquire(timeout=5.0)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        await slots.release()
+
+    await asyncio.gather(*(request(workers[i % 2]) for i in range(20)))
+    assert peak == 3
+    for slots in workers:
+        await slots.aclose()
+        await slots.backend.aclose()
+
+
+async def test_shared_slot_wait_times_out(tmp_path: Path) -> None:
+    path = tmp_path / "limits.sqlite3"
+    holder = SharedSlots(SqliteLimiterBackend(path), 1)
+    waiter = SharedSlots(SqliteLimiterBackend(path), 1, max_delay=0.01)
+    await holder.acquire(timeout=1.0)
+    with pytest.raises(QueueTimeout):
+        await waiter.acquire(timeout=0.05)
+    assert waiter.waiting == 0
+    await holder.release()
+    await waiter.acquire(timeout=1.0)
+    for slots in (holder, waiter):
+        await slots.aclose()
+        await slots.backend.aclose()
+
+
+async def test_oversized_body_is_still_charged_tokens(tmp_path: Path) -> None:
+    settings = make_settings(
+        tmp_path,
+        admission={"enabled": True, "tokens_per_minute": 1000, "max_estimate_body_bytes": 1024},
+    )
+    upstream = FakeUpstream()
+    async with running_app(settings, upstream) as (_, client):
+        small = await client.post("/v1/completions", json={"model": "m", "prompt": "hi"})
+        assert small.status_code == 200, small.text
+        large = await client.post("/v1/completions", json={"model": "m", "prompt": "x" * 8000})
+    assert large.status_code == 429
+    assert upstream.calls == 1
+
+
+async def test_estimates_do_not_fill_the_shared_token_cache() -> None:
+    shared = get_token_counter()
+    assert isinstance(shared, MemoizedTokenCounter)
+    misses = shared.misses
+    controller = AdmissionController(AdmissionConfig(enabled=True))
+    assert controller.estimate_tokens(b'{"prompt": "a one-off prompt", "max_tokens": 8}') > 8
+    assert shared.misses == misses
+    await controller.aclose()
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from collections.abc import Hashable
+
+import httpx
+import pytest
+
+from promptai.batching import MicroBatcher, UpstreamBatcher
+from promptai.config import BatchingConfig, ProviderConfig
+from promptai.upstream import UpstreamClient
+
+pytestmark = pytest.mark.anyio
+
+
+class Recorder:
+    def __init__(self, fail: bool = False) -> None:
+        self.batches: list[tuple[Hashable, list[int]]] = []
+        self.fail = fail
+
+    async def __call__(self, key: Hashable, items: list[int]) -> list[int]:
+        self.batches.append((key, items))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("upstream down")
+        return [item * 10 for item in items]
+
+
+async def test_full_batches_go_at_once_and_the_rest_after_max_wait() -> None:
+    dispatch = Recorder()
+    batcher: MicroBatcher[int, int] = MicroBatcher(dispatch, max_batch_size=4, max_wait=0.05)
+    results = await asyncio.gather(*(batcher.submit("k", i) for i in range(6)))
+    assert results == [i * 10 for i in range(6)]
+    assert dispatch.batches == [("k", [0, 1, 2, 3]), ("k", [4, 5])]
+    assert batcher.stats.batch_size.max == 4
+
+
+async def test_items_are_grouped_by_key() -> None:
+    dispatch = Recorder()
+    batcher: MicroBatcher[int, int] = MicroBatcher(dispatch, max_batch_size=8, max_wait=0.01)
+    await asyncio.gather(*(batcher.submit(i % 2, i) for i in range(6)))
+    assert sorted(dispatch.batches) == [(0, [0, 2, 4]), (1, [1, 3, 5])]
+
+
+async def test_cancelled_callers_are_dropped_before_dispatch() -> None:
+    dispatch = Recorder()
+    batcher: MicroBatcher[int, int] = MicroBatcher(dispatch, max_batch_size=8, max_wait=0.02)
+    tasks = [asyncio.ensure_future(batcher.submit("k", i)) for i in range(3)]
+    await asyncio.sleep(0)
+    tasks[1].cancel()
+    assert await tasks[0] == 0
+    assert await tasks[2] == 20
+    assert tasks[1].cancelled()
+    assert dispatch.batches == [("k", [0, 2])]
+
+
+async def test_a_failed_dispatch_fails_every_caller_in_the_batch() -> None:
+    batcher: MicroBatcher[int, int] = MicroBatcher(Recorder(fail=True), max_wait=0.01)
+    results = await asyncio.gather(
+        *(batcher.submit("k", i) for i in range(3)), return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert batcher.stats.failures == 1
+
+
+async def test_upstream_response_is_split_per_caller_by_index() -> None:
+    requests: list[dict] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        # Out of order, to check the split follows "index" rather than position.
+        choices = [{"index": i, "text": p.upper()} for i, p in enumerate(body["prompt"])]
+        usage = {"total_tokens": 99}
+        payload = {"model": body["model"], "choices": choices[::-1], "usage": usage}
+        return httpx.Response(200, json=payload)
+
+    config = ProviderConfig(name="mock", base_url="http://upstream.test")
+    client = UpstreamClient(config, transport=httpx.MockTransport(handler))
+    batcher = UpstreamBatcher(client, BatchingConfig(enabled=True, max_wait_ms=10))
+    bodies = await asyncio.gather(
+        *(batcher.complete({"model": "m", "prompt": p, "max_tokens": 5}) for p in ("a", "b"))
+    )
+    await batcher.aclose()
+    await client.aclose()
+
+    assert requests == [{"model": "m", "max_tokens": 5, "prompt": ["a", "b"]}]
+    assert [json.loads(body) for body in bodies] == [
+        {"model": "m", "choices": [{"index": 0, "text": "A"}]},
+        {"model": "m", "choices": [{"index": 0, "text": "B"}]},
+    ]
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from promptai.cache import MemoryBackend, SqliteBackend
+
+pytestmark = pytest.mark.anyio
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def test_memory_backend_evicts_least_recently_used() -> None:
+    backend = MemoryBackend(max_entries=2)
+    await backend.set("a", b"1", ttl=60)
+    await backend.set("b", b"2", ttl=60)
+    assert await backend.get("a") == b"1"
+    await backend.set("c", b"3", ttl=60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == b"1"
+    assert backend.stats.evictions == 1
+
+
+async def test_sqlite_bounds_hold_across_processes_sharing_the_file(tmp_path: Path) -> None:
+    # Two backends on one file stand in for two worker processes.
+    path = tmp_path / "cache.sqlite3"
+    workers = [SqliteBackend(path, max_entries=10, max_bytes=1000) for _ in range(2)]
+    for i in range(40):
+        await workers[i % 2].set(f"k{i}", b"x" * 50, ttl=60)
+    for backend in workers:
+        assert backend.stats.entries == 10
+        assert backend.stats.bytes == 500
+
+    for i in range(6):
+        await workers[i % 2].set(f"big{i}", b"y" * 300, ttl=60)
+    assert workers[1].stats.bytes <= 1000
+    assert await workers[0].get("big5") == b"y" * 300
+    for backend in workers:
+        await backend.aclose()
+
+
+async def test_sqlite_eviction_keeps_recently_read_entries(tmp_path: Path) -> None:
+    clock = Clock()
+    backend = SqliteBackend(tmp_path / "cache.sqlite3", max_entries=3, clock=clock)
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        await backend.set(key, key.encode(), ttl=60)
+    clock.now += 1
+    assert await backend.get("a") == b"a"  # buffered, flushed before evicting
+    await backend.set("d", b"d", ttl=60)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == b"a"
+    await backend.aclose()
+
+
+async def test_sqlite_entries_expire_and_survive_reopening(tmp_path: Path) -> None:
+    clock = Clock()
+    path = tmp_path / "cache.sqlite3"
+    backend = SqliteBackend(path, clock=clock)
+    await backend.set("short", b"1", ttl=5)
+    await backend.set("long", b"2", ttl=500)
+    await backend.aclose()
+
+    clock.now += 10
+    reopened = SqliteBackend(path, clock=clock)
+    assert reopened.stats.entries == 1
+    assert await reopened.get("short") is None
+    assert await reopened.get("long") == b"2"
+    await reopened.aclose()
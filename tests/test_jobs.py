@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import asyncio
+import io
+import json
+from pathlib import Path
+from typing import Any
+
+import httpx
+import pytest
+
+from promptai.jobs.records import STATE_FILE
+from promptai.jobs.runner import _read_lines, _Watermark
+from tests.support import FakeUpstream, make_settings, running_app, wait_until
+
+pytestmark = pytest.mark.anyio
+
+
+def jsonl(rows: list[dict[str, Any]]) -> bytes:
+    return b"".join(json.dumps(row).encode() + b"\n" for row in rows)
+
+
+def prompts(n: int) -> bytes:
+    return jsonl([{"model": "m", "prompt": f"p{i}", "custom_id": f"c{i}"} for i in range(n)])
+
+
+async def create(client: httpx.AsyncClient, body: bytes, **options: str) -> str:
+    response = await client.post("/v1/batches", content=body, params=options)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+async def describe(client: httpx.AsyncClient, job_id: str) -> dict[str, Any]:
+    response = await client.get(f"/v1/batches/{job_id}")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def wait_for_status(client: httpx.AsyncClient, job_id: str, status: str) -> dict[str, Any]:
+    state: dict[str, Any] = {}
+
+    async def reached() -> bool:
+        state.update(await describe(client, job_id))
+        return state["status"] == status
+
+    await wait_until(reached)
+    return state
+
+
+async def results(client: httpx.AsyncClient, job_id: str) -> list[dict[str, Any]]:
+    response = await client.get(f"/v1/batches/{job_id}/results")
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.content.splitlines()]
+
+
+def assert_each_line_once(rows: list[dict[str, Any]], total: int) -> None:
+    lines = sorted(row["line"] for row in rows)
+    assert lines == list(range(total))
+
+
+async def test_job_runs_every_line(tmp_path: Path) -> None:
+    upstream = FakeUpstream()
+    async with running_app(make_settings(tmp_path), upstream) as (_, client):
+        job_id = await create(client, prompts(50), concurrency="4")
+        state = await wait_for_status(client, job_id, "completed")
+        rows = await results(client, job_id)
+
+    assert state["progress"]["succeeded"] == 50
+    assert_each_line_once(rows, 50)
+    by_line = {row["line"]: row for row in rows}
+    assert by_line[7]["custom_id"] == "c7"
+    assert by_line[7]["response"]["choices"][0]["text"] == "re: p7"
+
+
+async def test_cancel_then_resume_writes_each_line_once(tmp_path: Path) -> None:
+    upstream = FakeUpstream(delay=0.005)
+    async with running_app(make_settings(tmp_path), upstream) as (_, client):
+        job_id = await create(client, prompts(200), concurrency="4")
+
+        async def started() -> bool:
+            return (await describe(client, job_id))["progress"]["processed_lines"] >= 20
+
+        await wait_until(started)
+        cancelled = (await client.post(f"/v1/batches/{job_id}/cancel")).json()
+        assert cancelled["status"] == "cancelled"
+        assert 0 < cancelled["progress"]["processed_lines"] < 200
+        partial = await results(client, job_id)
+        assert len(partial) == cancelled["progress"]["processed_lines"]
+
+        resumed = await client.post(f"/v1/batches/{job_id}/resume")
+        assert resumed.status_code == 200
+        state = await wait_for_status(client, job_id, "completed")
+        rows = await results(client, job_id)
+
+        conflict = await client.post(f"/v1/batches/{job_id}/resume")
+        assert conflict.status_code == 409
+
+    assert state["progress"]["succeeded"] == 200
+    assert_each_line_once(rows, 200)
+
+
+async def test_cancelling_a_paused_job_keeps_it_stopped(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path)
+    upstream = FakeUpstream(delay=0.005)
+    async with running_app(settings, upstream) as (_, client):
+        job_id = await create(client, prompts(100), concurrency="2")
+        await asyncio.sleep(0.05)
+    # Shutdown paused the job; a worker that does not resume it cancels it.
+    paused = make_settings(tmp_path, jobs={"resume_on_startup": False})
+    async with running_app(paused, upstream) as (_, client):
+        assert (await describe(client, job_id))["status"] == "paused"
+        cancelled = await client.post(f"/v1/batches/{job_id}/cancel")
+        assert cancelled.status_code == 200
+        assert cancelled.json()["status"] == "cancelled"
+        assert cancelled.json()["finished_at"] is not None
+
+    async with running_app(settings, upstream) as (app, client):
+        assert not any(job.running for job in app.state.jobs.jobs())
+        assert (await describe(client, job_id))["status"] == "cancelled"
+        assert (await client.post(f"/v1/batches/{job_id}/resume")).status_code == 200
+        await wait_for_status(client, job_id, "completed")
+        rows = await results(client, job_id)
+    assert_each_line_once(rows, 100)
+
+
+async def test_resumes_from_periodic_checkpoint_after_crash(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path, jobs={"checkpoint_interval": 0.02})
+    # Line 3 holds the low-water mark back while later lines finish.
+    upstream = FakeUpstream(delay=0.002, slow={"p3": 0.5})
+    async with running_app(settings, upstream) as (_, client):
+        job_id = await create(client, prompts(300), concurrency="8")
+        job_dir = tmp_path / "jobs" / job_id
+
+        def checkpoint() -> dict[str, Any]:
+            return json.loads((job_dir / STATE_FILE).read_bytes())["checkpoint"]
+
+        async def checkpointed_ahead() -> bool:
+            return len(checkpoint()["done"]) >= 20
+
+        await wait_until(checkpointed_ahead)
+        # What a killed process leaves behind: the last periodic checkpoint,
+        # and results written after it, possibly ending mid-line.
+        state = (job_dir / STATE_FILE).read_bytes()
+        output = (job_dir / "output.jsonl").read_bytes() + b'{"line": 299, "resp'
+    assert json.loads(state)["status"] == "running"
+    assert json.loads(state)["checkpoint"]["line"] == 3
+
+    (job_dir / STATE_FILE).write_bytes(state)
+    (job_dir / "output.jsonl").write_bytes(output)
+    async with running_app(settings, upstream) as (_, client):
+        final = await wait_for_status(client, job_id, "completed")
+        rows = await results(client, job_id)
+
+    assert final["progress"]["succeeded"] == 300
+    assert_each_line_once(rows, 300)
+
+
+async def test_over_long_and_invalid_lines_fail_alone(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path, jobs={"max_line_bytes": 200})
+    body = (
+        jsonl([{"model": "m", "prompt": "short"}])
+        + json.dumps({"model": "m", "prompt": "x" * 1000}).encode()
+        + b"\n\n"  # blank lines produce no result
+        + b"not json\n"
+        + jsonl([{"model": "m", "prompt": "last"}])
+    )
+    async with running_app(settings, FakeUpstream()) as (_, client):
+        job_id = await create(client, body)
+        state = await wait_for_status(client, job_id, "completed")
+        rows = {row["line"]: row for row in await results(client, job_id)}
+
+    assert sorted(rows) == [0, 1, 3, 4]
+    assert "response" in rows[0] and "response" in rows[4]
+    assert "longer than 200 bytes" in rows[1]["error"]["message"]
+    assert rows[3]["error"]["type"] == "invalid_request"
+    assert state["progress"]["succeeded"] == 2
+    assert state["progress"]["failed"] == 2
+
+
+async def test_unexpected_line_error_does_not_fail_the_job(tmp_path: Path) -> None:
+    upstream = FakeUpstream(broken=frozenset({"p5"}))
+    async with running_app(make_settings(tmp_path), upstream) as (_, client):
+        job_id = await create(client, prompts(50), concurrency="4")
+        state = await wait_for_status(client, job_id, "completed")
+        rows = {row["line"]: row for row in await results(client, job_id)}
+
+    assert state["progress"]["succeeded"] == 49
+    assert rows[5]["error"]["type"] == "internal_error"
+    assert "broken prompt" in rows[5]["error"]["message"]
+
+
+async def test_job_does_not_record_spans_on_the_upload_trace(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path, metrics={"trace_sample_rate": 1.0})
+    rows = [{"model": "m", "template": "p{{ i }}", "variables": {"i": i}} for i in range(50)]
+    async with running_app(settings, FakeUpstream()) as (_, client):
+        job_id = await create(client, jsonl(rows))
+        await wait_for_status(client, job_id, "completed")
+        traces = (await client.get("/metrics/traces")).json()["traces"]
+
+    [upload] = [trace for trace in traces if trace["path"] == "/v1/batches"]
+    assert all(span["name"] != "template_render" for span in upload["spans"])
+
+
+async def test_one_worker_runs_a_job_and_others_see_it(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path)
+    upstream = FakeUpstream(delay=0.005)
+    async with running_app(settings, upstream) as (app_a, client_a):
+        async with running_app(settings, upstream) as (app_b, client_b):
+            job_id = await create(client_a, prompts(100), concurrency="2")
+            seen = await describe(client_b, job_id)
+            assert seen["status"] in ("queued", "running")
+            assert [job["id"] for job in (await client_b.get("/v1/batches")).json()["data"]] == [
+                job_id
+            ]
+            assert (await client_b.post(f"/v1/batches/{job_id}/resume")).status_code == 409
+            assert (await client_b.post(f"/v1/batches/{job_id}/cancel")).status_code == 409
+            await wait_for_status(client_b, job_id, "completed")
+            assert not any(job.running for job in app_b.state.jobs.jobs())
+            rows = await results(client_b, job_id)
+    assert_each_line_once(rows, 100)
+
+
+async def test_interrupted_job_is_resumed_by_one_worker(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path)
+    upstream = FakeUpstream(delay=0.005)
+    async with running_app(settings, upstream) as (_, client):
+        job_id = await create(client, prompts(100), concurrency="2")
+        await asyncio.sleep(0.05)
+    # Shutdown pauses the job; both restarted workers try to resume it.
+    async with running_app(settings, upstream) as (app_a, client_a):
+        async with running_app(settings, upstream) as (app_b, _):
+            running = [
+                job.id
+                for app in (app_a, app_b)
+                for job in app.state.jobs.jobs()
+                if job.running
+            ]
+            assert running == [job_id]
+            await wait_for_status(client_a, job_id, "completed")
+            rows = await results(client_a, job_id)
+    assert_each_line_once(rows, 100)
+
+
+async def test_max_in_flight_caps_all_jobs_together(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path, jobs={"max_in_flight": 3})
+    upstream = FakeUpstream(delay=0.005)
+    async with running_app(settings, upstream) as (_, client):
+        ids = [await create(client, prompts(30), concurrency="8") for _ in range(2)]
+        for job_id in ids:
+            await wait_for_status(client, job_id, "completed")
+    assert upstream.peak == 3
+
+
+def test_read_lines_reports_offsets_and_skips_long_lines() -> None:
+    data = b"a\n" + b"x" * 50 + b"\n" + b"bb\n" + b"y" * 50
+    f = io.BytesIO(data)
+    lines = _read_lines(f, 10, limit=10)
+    assert lines == [(b"a\n", 2), (None, 53), (b"bb\n", 56), (None, len(data))]
+    assert _read_lines(f, 10, limit=10) == []
+
+
+def test_read_lines_resumes_from_offset() -> None:
+    f = io.BytesIO(b"one\ntwo\nthree\n")
+    assert _read_lines(f, 2, limit=100) == [(b"one\n", 4), (b"two\n", 8)]
+    f.seek(8)
+    assert _read_lines(f, 2, limit=100) == [(b"three\n", 14)]
+
+
+async def test_watermark_advances_over_finished_prefix() -> None:
+    window = asyncio.Semaphore(0)
+    watermark = _Watermark(10, 100, window)
+    entries = [watermark.add(10 + i, 110 + 10 * i) for i in range(4)]
+
+    watermark.finish(entries[1])
+    watermark.finish(entries[3])
+    assert (watermark.line, watermark.offset) == (10, 100)
+    assert watermark.done_ahead() == [11, 13]
+
+    watermark.finish(entries[0])
+    assert (watermark.line, watermark.offset) == (12, 120)
+    assert watermark.done_ahead() == [13]
+    # One window slot is freed per line advanced over.
+    await window.acquire()
+    await window.acquire()
+    assert window.locked()
+
+    watermark.finish(entries[2])
+    assert (watermark.line, watermark.offset) == (14, 140)
+    assert watermark.done_ahead() == []
+
+
+async def test_create_rejects_bad_options(tmp_path: Path) -> None:
+    async with running_app(make_settings(tmp_path), FakeUpstream()) as (_, client):
+        bad = await client.post("/v1/batches", content=prompts(1), params={"concurrency": "0"})
+        unknown = await client.post("/v1/batches", content=prompts(1), params={"colour": "red"})
+        listed = (await client.get("/v1/batches")).json()["data"]
+    assert bad.status_code == 422
+    assert unknown.status_code == 422
+    assert listed == []
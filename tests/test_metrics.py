@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from promptai.metrics.registry import MetricsRegistry, render_family
+from tests.support import FakeUpstream, make_settings, running_app
+
+
+def test_histogram_renders_cumulative_buckets_per_label_set() -> None:
+    registry = MetricsRegistry()
+    latency = registry.histogram("t_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0))
+    fast = latency.labels("fast")
+    fast.observe(0.05)
+    fast.observe(0.5)
+    latency.labels("slow").observe(2.0)
+    assert registry.render().splitlines() == [
+        "# HELP t_seconds Test latency.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{stage="fast",le="0.1"} 1',
+        't_seconds_bucket{stage="fast",le="1"} 2',
+        't_seconds_bucket{stage="fast",le="+Inf"} 2',
+        't_seconds_sum{stage="fast"} 0.55',
+        't_seconds_count{stage="fast"} 2',
+        't_seconds_bucket{stage="slow",le="0.1"} 0',
+        't_seconds_bucket{stage="slow",le="1"} 0',
+        't_seconds_bucket{stage="slow",le="+Inf"} 1',
+        't_seconds_sum{stage="slow"} 2',
+        't_seconds_count{stage="slow"} 1',
+    ]
+
+
+def test_registration_is_idempotent_but_labels_must_match() -> None:
+    registry = MetricsRegistry()
+    first = registry.histogram("x_seconds", "X.", ("a",))
+    assert registry.histogram("x_seconds", "X.", ("a",)) is first
+    with pytest.raises(ValueError):
+        registry.histogram("x_seconds", "X.", ("b",))
+    with pytest.raises(ValueError):
+        first.labels("one", "two")
+
+
+def test_families_escape_label_values_and_help() -> None:
+    text = render_family("g", "gauge", "line\nbreak", ("name",), [(('say "hi"\\',), 1.5)])
+    assert text == '# HELP g line\\nbreak\n# TYPE g gauge\ng{name="say \\"hi\\"\\\\"} 1.5\n'
+
+
+def samples(text: str) -> dict[str, float]:
+    pairs = (line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+    return {name: float(value) for name, value in pairs}
+
+
+@pytest.mark.anyio
+async def test_metrics_endpoint_exposes_stages_requests_and_components(tmp_path: Path) -> None:
+    # Histograms are process-wide, so compare against a scrape taken first.
+    settings = make_settings(tmp_path, cache={"enabled": True})
+    async with running_app(settings, FakeUpstream()) as (_, client):
+        before = samples((await client.get("/metrics")).text)
+        body = {"model": "m", "template": "say {{ w }}", "variables": {"w": "hi"}}
+        assert (await client.post("/v1/completions", json=body)).status_code == 200
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    after = samples(response.text)
+
+    def added(name: str) -> float:
+        return after[name] - before.get(name, 0.0)
+
+    assert added('promptai_stage_seconds_count{stage="template_render"}') == 1
+    route = 'route="/v1/completions",method="POST",status="200"'
+    assert added(f"promptai_request_seconds_count{{{route}}}") == 1
+    assert after['promptai_cache_lookups_total{outcome="miss"}'] == 1
+    assert after["promptai_cache_entries"] == 1
+
+
+@pytest.mark.anyio
+async def test_metrics_can_be_disabled(tmp_path: Path) -> None:
+    settings = make_settings(tmp_path, metrics={"enabled": False})
+    async with running_app(settings, FakeUpstream()) as (_, client):
+        assert (await client.get("/metrics")).status_code == 404
+        traces = (await client.get("/metrics/traces")).json()
+    assert traces == {"enabled": False, "sampled": 0, "traces": []}
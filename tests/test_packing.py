@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import pytest
+
+from promptai.packing import (
+    ApproximateTokenCounter,
+    BudgetExceededError,
+    ContextPacker,
+    MemoizedTokenCounter,
+    Segment,
+    SegmentKind,
+    TokenCounter,
+)
+
+
+class WordCounter(TokenCounter):
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+
+def test_packs_system_then_newest_turns_then_best_retrieved() -> None:
+    segments = [
+        Segment("be brief", SegmentKind.SYSTEM),
+        Segment("old turn one", SegmentKind.TURN),
+        Segment("new turn", SegmentKind.TURN),
+        Segment("weak match", SegmentKind.RETRIEVED, score=0.1),
+        Segment("strong match", SegmentKind.RETRIEVED, score=0.9),
+    ]
+    result = ContextPacker(WordCounter()).pack(segments, budget=6)
+    assert [s.text for s in result.segments] == ["be brief", "new turn", "strong match"]
+    assert result.tokens == 6
+    assert result.dropped == 2
+
+
+def test_history_is_counted_only_as_far_as_the_budget_reaches() -> None:
+    segments = [Segment(f"turn {i}") for i in range(10_000)]
+    result = ContextPacker(WordCounter()).pack(segments, budget=10)
+    assert [s.text for s in result.segments] == [f"turn {i}" for i in range(9995, 10_000)]
+    assert result.counted == 6
+
+
+def test_system_segments_over_budget_raise() -> None:
+    with pytest.raises(BudgetExceededError):
+        ContextPacker(WordCounter()).pack([Segment("a b c", SegmentKind.SYSTEM)], budget=2)
+
+
+def test_memoized_counter_is_bounded_by_total_text_length() -> None:
+    memo = MemoizedTokenCounter(ApproximateTokenCounter(), max_chars=1000)
+    for i in range(10):
+        memo.count(f"{i}" * 300)
+    assert memo.chars <= 1000
+    assert len(memo._counts) == 3
+
+    memo.count("x" * 5000)  # larger than the whole cache: counted, never stored
+    assert memo.chars <= 1000
+    assert memo.count("9" * 300) == memo.counter.count("9" * 300)
+    assert memo.hits == 1
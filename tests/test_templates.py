@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+from typing_extensions import TypedDict
+
+from promptai.templates import (
+    Template,
+    TemplateCache,
+    TemplateRenderError,
+    TemplateSyntaxError,
+)
+from tests.support import FakeUpstream, make_settings, running_app
+
+
+def test_renders_variables_and_dotted_lookups() -> None:
+    template = Template("Hi {{ user.name }}, about {{ topic }}.")
+    assert template.names == frozenset({"user", "topic"})
+    assert template.render({"user": {"name": "Ada"}, "topic": "maths"}) == "Hi Ada, about maths."
+
+
+def test_sections_repeat_per_item_and_skip_falsy_values() -> None:
+    source = (
+        "Examples:\n"
+        "{{# examples }}\n"
+        "- {{ q }} -> {{ a }} ({{ style }})\n"
+        "{{/ examples }}\n"
+        "{{^ examples }}\n"
+        "none\n"
+        "{{/ examples }}\n"
+        "Go."
+    )
+    template = Template(source)
+    rows = [{"q": "1+1", "a": "2"}, {"q": "2+2", "a": "4"}]
+    assert template.render({"examples": rows, "style": "terse"}) == (
+        "Examples:\n- 1+1 -> 2 (terse)\n- 2+2 -> 4 (terse)\nGo."
+    )
+    assert template.render({"examples": [], "style": "terse"}) == "Examples:\nnone\nGo."
+
+
+def test_names_used_only_inside_sections_survive_validation() -> None:
+    template = Template("{{# items }}{{ . }}{{ sep }}{{/ items }}")
+    assert template.render({"items": ["a", "b"], "sep": ";"}) == "a;b;"
+
+
+def test_filters_apply_left_to_right() -> None:
+    template = Template('{{ doc | tail:5 | upper }} {{ tags | last:2 | join:", " }} {{ x | json }}')
+    rendered = template.render({"doc": "hello world", "tags": ["a", "b", "c"], "x": {"k": 1}})
+    assert rendered == 'WORLD b, c {"k": 1}'
+    assert Template("{{ v | default:none }}").render({"v": ""}) == "none"
+
+
+def test_filter_on_the_wrong_type_is_a_render_error() -> None:
+    with pytest.raises(TemplateRenderError, match="'first'"):
+        Template("{{ n | first:2 }}").render({"n": 5})
+
+
+@pytest.mark.parametrize(
+    "source",
+    ["{{# a }}x", "{{ a | nope }}", "{{ a | tail }}", "{{ a.__class__ }}", "{{/ a }}"],
+)
+def test_bad_templates_fail_to_compile(source: str) -> None:
+    with pytest.raises(TemplateSyntaxError):
+        Template(source)
+
+
+def test_missing_variables_and_declared_types_are_validated() -> None:
+    with pytest.raises(ValidationError):
+        Template("{{ a }} {{ b }}").render({"a": 1})
+
+    class Variables(TypedDict):
+        count: int
+
+    template = Template("{{ count }}", Variables)
+    assert template.render({"count": "3"}) == "3"
+    with pytest.raises(ValidationError):
+        template.render({"count": "three"})
+
+
+def test_cache_is_bounded_and_reuses_compilations() -> None:
+    cache = TemplateCache(max_size=2)
+    first = cache.get("{{ a }}")
+    assert cache.get("{{ a }}") is first
+    cache.get("{{ b }}")
+    cache.get("{{ c }}")
+    assert len(cache) == 2
+    assert cache.get("{{ a }}") is not first
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+@pytest.mark.anyio
+async def test_api_answers_template_errors_with_422(tmp_path: Path) -> None:
+    upstream = FakeUpstream()
+    async with running_app(make_settings(tmp_path), upstream) as (_, client):
+        ok = await client.post(
+            "/v1/completions",
+            json={"model": "m", "template": "say {{ w }}", "variables": {"w": "hi"}},
+        )
+        bad = await client.post(
+            "/v1/completions",
+            json={"model": "m", "template": "{{ n | first:2 }}", "variables": {"n": 5}},
+        )
+    assert ok.status_code == 200, ok.text
+    assert bad.status_code == 422
+    assert "first" in bad.text
+    assert upstream.calls == 1